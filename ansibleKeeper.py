@@ -9,9 +9,19 @@ __maintainer__ = "Jan Kogut"
 __status__     = "Beta"
 
 
+## only what the --host fast path needs, the rest (kazoo included) is imported by the functions using it
+import os
+import re
+import sys
 import json
-from optparse import OptionParser,OptionGroup
-from kazoo.client import KazooClient
+import time
+import zlib
+import fcntl
+import struct
+import thread
+import hashlib
+from itertools import chain
+from contextlib import contextmanager
 
 
 
@@ -27,6 +37,26 @@ cfg = OurConfig()
 
 cfg.zkServers  = 'localhost:2181'
 cfg.aPath      = '/ansible-test'
+cfg.debug       = False ## connection setup time on stderr
+cfg.asyncWindow = 128  ## max number of async zookeeper requests in flight
+cfg.migrateBatch = 50  ## hosts converted per transaction by --migrate
+cfg.txnMaxBytes = 512 * 1024  ## multi request size limit, well under default jute.maxbuffer of 1MB
+cfg.txnMaxOps   = 1000
+cfg.cacheDir    = os.path.expanduser('~/.cache/ansible-keeper')
+cfg.cacheTtl    = 0     ## seconds a cached inventory is served without asking zookeeper at all
+cfg.hostCacheTtl = 30   ## seconds since -I ansible validated the cache in which --host is answered without zookeeper
+cfg.socketPath  = os.environ.get('ANSIBLE_KEEPER_SOCKET', os.path.join(cfg.cacheDir, 'inventory.sock'))
+cfg.stats       = False ## count and time zookeeper requests and phases, summary with --stats
+cfg.journal     = True  ## append a change record to <aPath>/journal with every write
+cfg.journalSize = 10000 ## change records kept by journal compaction
+cfg.journalCompactEvery = 500  ## writes between journal compactions
+cfg.deleteParallel = 8  ## multi requests in flight while deleting a big host or group
+cfg.batchParallel  = 8  ## reads of --batch running at the same time
+cfg.compressBytes  = 4096        ## hostvar values and packed blobs of this size and more are stored compressed
+cfg.chunkBytes     = 256 * 1024  ## stored hostvar values larger than this are split into chunk znodes of this size
+cfg.chunkGcAge     = 3600        ## seconds an unreferenced chunk set is kept before --chunk-gc removes it
+cfg.zkBackend      = 'kazoo'  ## memory: in-process znode tree instead of zookeeper (tests, benchmarks)
+cfg.memoryLatency  = 0.0      ## seconds per round trip of the memory backend
 
 #################################################
 ## END of config section 
@@ -39,6 +69,8 @@ def oParser():
     Return dict (parsed options).
     '''
 
+    from optparse import OptionParser, OptionGroup  ## not needed by the --host fast path
+
     parser = OptionParser(usage="usage: %prog [opts] <args>",
                           version="%prog 0.0.1")
     parser.add_option("-A", nargs = 1,
@@ -48,7 +80,7 @@ def oParser():
     parser.add_option("-D", nargs = 1,
                       help="delete host or group recursively: groupname1:hostname1 or groupname1 or hosts:hostname1")
     parser.add_option("-U", nargs = 1,
-                      help="update host variables with comma separated hostvars: groupname1:hostname1,var1:newvalue1,var2:newvalue2")
+                      help="update host variables with comma separated hostvars: groupname1:hostname1,var1:newvalue1,var2:newvalue2 or for every host of a group: groupname1,var1:newvalue1 (all,var1:newvalue1 --limit 'dc1:&kafka' for a host pattern)")
     parser.add_option("-R", nargs = 1,
                       help="rename existing hostname or groupname: groups:oldgroupname:newgroupname or hosts:oldhostname:newhostname")
     parser.add_option("-S", nargs = 1,
@@ -57,6 +89,56 @@ def oParser():
                       help="inventory mode: groups|all|ansible dumps inventory in json format from zookeeper")
     parser.add_option("--host", nargs = 1,
                       help="ansible compliant option for hostvars access: --host hostname")
+    parser.add_option("--group-vars", nargs = 1, dest = "groupVars",
+                      help="set or update group variables, group all applies to every host: groupname1,var1:value1,var2:value2")
+    parser.add_option("--show-group-vars", nargs = 1, dest = "showGroupVars",
+                      help="show group variables for a given group: --show-group-vars groupname1")
+    parser.add_option("--child", nargs = 1, dest = "childGroup",
+                      help="add group as a child of another group, missing groups are created: parentgroup:childgroup")
+    parser.add_option("--delete-child", nargs = 1, dest = "deleteChild",
+                      help="remove group from children of another group: parentgroup:childgroup")
+    parser.add_option("--dry-run", action = "store_true", dest = "dryRun", default = False,
+                      help="with -D only report how many znodes would be removed, nothing is deleted")
+    parser.add_option("--limit", nargs = 1,
+                      help="ansible style host pattern for -I ansible and group-wide -U, only matching groups and hosts are fetched: --limit 'dc1:&kafka:!kafka03*'")
+    parser.add_option("--batch", nargs = 1, dest = "batchFile",
+                      help="run operations in the commandline syntax or as JSON lists, one per line, over one session with one JSON result per line: --batch ops.txt (- for stdin)")
+    parser.add_option("--window", nargs = 1, type = "int", default = cfg.asyncWindow,
+                      help="max number of async zookeeper requests in flight for inventory dumps: --window 128")
+    parser.add_option("--fetch-speedup", action = "store_true", dest = "fetchSpeedup",
+                      help="time serial and pipelined ansible inventory dumps and report the speedup")
+    parser.add_option("--migrate", nargs = 1,
+                      help="convert hostvars storage format in place: --migrate packed|legacy")
+    parser.add_option("--no-cache", action = "store_true", dest = "noCache", default = False,
+                      help="do not use local inventory cache for -I ansible and --host")
+    parser.add_option("--cache-ttl", nargs = 1, type = "float", dest = "cacheTtl",
+                      help="seconds a cached inventory is served without asking zookeeper: --cache-ttl 60")
+    parser.add_option("--import", nargs = 1, dest = "importFile",
+                      help="import hosts, groups and hostvars from ansible INI, YAML or JSON inventory file: --import hosts.ini")
+    parser.add_option("--snapshot-export", nargs = 1, dest = "snapshotExport",
+                      help="write groups, hosts and hostvars into one compressed snapshot file: --snapshot-export inventory.snap")
+    parser.add_option("--snapshot-import", nargs = 1, dest = "snapshotImport",
+                      help="restore snapshot file with batched transactions: --snapshot-import inventory.snap")
+    parser.add_option("--from-snapshot", nargs = 1, dest = "fromSnapshot",
+                      help="answer -I, -S and --host from a snapshot file without zookeeper: --from-snapshot inventory.snap")
+    parser.add_option("--changes-since", nargs = 1, dest = "changesSince",
+                      help="changes written after a journal position, 'now' gives the current position: --changes-since 1234")
+    parser.add_option("--reindex", action = "store_true",
+                      help="rebuild host to groups reverse index from the group tree and the host digest index from the hostvars")
+    parser.add_option("--value-stats", action = "store_true", dest = "valueStats",
+                      help="report stored and raw hostvar bytes, compressed and chunked values and the compression ratio")
+    parser.add_option("--chunk-gc", action = "store_true", dest = "chunkGc",
+                      help="with --value-stats remove chunk sets no hostvar refers to any more")
+    parser.add_option("--hashes", action = "store_true",
+                      help="roll content hashes of hosts and groups up from the host digest index (read only) and print their roots")
+    parser.add_option("--diff", nargs = 2,
+                      help="compare two inventories descending only where content hashes differ, each one of /ansible-keeper/path, live, cache or a snapshot file: --diff /ansible-prod inventory.snap")
+    parser.add_option("--stats", action = "store_true", default = False,
+                      help="print zookeeper request counts, latency histograms and phase timings on stderr")
+    parser.add_option("--debug", action = "store_true", default = False,
+                      help="print zookeeper connection setup time on stderr")
+    parser.add_option("--serve", action = "store_true",
+                      help="run inventory daemon answering -I, -S and --host requests on unix socket: $ANSIBLE_KEEPER_SOCKET")
 
     group = OptionGroup(parser, "Example usage",
                         "ansibleKeeper.py -A flink:flink-master01,lan_ip:10.1.1.1")
@@ -66,13 +148,45 @@ def oParser():
     (opts, args) = parser.parse_args()
     
     
-    if (opts.A or opts.G or opts.D or opts.U or opts.R or opts.S or opts.I or opts.host) == None:
+    if (opts.A or opts.G or opts.D or opts.U or opts.R or opts.S or opts.I or opts.host or opts.fetchSpeedup or opts.migrate or opts.serve or opts.importFile or opts.reindex or
+        opts.snapshotExport or opts.snapshotImport or opts.groupVars or opts.showGroupVars or opts.childGroup or opts.deleteChild or
+        opts.changesSince or opts.batchFile or opts.valueStats or opts.hashes or opts.diff) == None:
 
         parser.print_help()
         exit(-1)
         
     return {'addMode':opts.A, 'groupMode':opts.G, 'deleteMode':opts.D, 'updateMode':opts.U,
-            'renameMode':opts.R, 'showMode':opts.S, 'inventoryMode':opts.I, 'ansibleHost':opts.host}
+            'renameMode':opts.R, 'showMode':opts.S, 'inventoryMode':opts.I, 'ansibleHost':opts.host,
+            'window':opts.window, 'fetchSpeedup':opts.fetchSpeedup, 'migrateMode':opts.migrate,
+            'noCache':opts.noCache, 'cacheTtl':opts.cacheTtl, 'serveMode':opts.serve,
+            'debug':opts.debug, 'importFile':opts.importFile, 'reindex':opts.reindex,
+            'stats':opts.stats, 'snapshotExport':opts.snapshotExport, 'snapshotImport':opts.snapshotImport,
+            'fromSnapshot':opts.fromSnapshot, 'groupVars':opts.groupVars, 'showGroupVars':opts.showGroupVars,
+            'childGroup':opts.childGroup, 'deleteChild':opts.deleteChild, 'limit':opts.limit,
+            'changesSince':opts.changesSince, 'dryRun':opts.dryRun, 'batchFile':opts.batchFile,
+            'valueStats':opts.valueStats, 'chunkGc':opts.chunkGc, 'hashes':opts.hashes, 'diff':opts.diff}
+
+
+KazooClient = None  ## imported with the first connection, --host answered from the cache never pays for it
+
+
+def kazooClientClass():
+    '''
+    Import kazoo client class unless it is imported or replaced (tests, benchmarks) already,
+    for cfg.zkBackend memory a factory of clients of one in-process znode tree.
+
+    Return class.
+    '''
+
+    global KazooClient
+
+    if KazooClient is None and cfg.zkBackend == 'memory':
+        KazooClient = memoryClientFactory(MemoryTree(cfg.memoryLatency))
+
+    elif KazooClient is None:
+        from kazoo.client import KazooClient
+
+    return KazooClient
 
 
 def zkStartRo():
@@ -82,7 +196,7 @@ def zkStartRo():
     Return zookeeper read-only connection object.
     '''
 
-    zk = KazooClient(hosts=cfg.zkServers, read_only = True)
+    zk = kazooClientClass()(hosts=cfg.zkServers, read_only = True)
     zk.start()
     
     return zk
@@ -95,12 +209,680 @@ def zkStartRw():
     Return zookeeper read-write connection object.
     '''
 
-    zk = KazooClient(hosts=cfg.zkServers)
+    zk = kazooClientClass()(hosts=cfg.zkServers)
     zk.start()
     
     return zk
     
 
+class ZkStats(object):
+    '''
+    Zookeeper request accounting: counts and latency histograms by request type, time spent in phases.
+    '''
+
+    ## histogram bucket upper bounds in seconds, the last bucket takes everything slower
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self):
+        self.lock      = thread.allocate_lock()  ## async results are recorded from kazoo callback threads
+        self.startTime = time.time()
+        self.requests  = {}  ## {method: [count, total seconds, max seconds, [bucket counts]]}
+        self.phases    = {}  ## {phase: seconds}
+
+    def record(self, method, seconds):
+        bucket = len([bound for bound in self.BUCKETS if bound < seconds])
+
+        with self.lock:
+            if method not in self.requests:
+                self.requests[method] = [0, 0.0, 0.0, [0] * (len(self.BUCKETS) + 1)]
+            entry = self.requests[method]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2]  = max(entry[2], seconds)
+            entry[3][bucket] += 1
+
+    def addPhase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        startTime = time.time()
+        try:
+            yield
+        finally:
+            self.addPhase(name, time.time() - startTime)
+
+    def timed(self, name, func):
+        '''
+        Return function (func adding its run time to phase name, func itself when stats are off).
+        '''
+
+        if not cfg.stats:
+            return func
+
+        def timedFunc(*args, **kwargs):
+            startTime = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.addPhase(name, time.time() - startTime)
+
+        return timedFunc
+
+    def timedIter(self, name, iterable):
+        '''
+        Return generator (items of iterable, time spent producing them is added to phase name,
+        name can be a function of the produced item).
+        '''
+
+        if not cfg.stats:
+            for item in iterable:
+                yield item
+            return
+
+        iterator = iter(iterable)
+        while True:
+            startTime = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.addPhase(name(item) if callable(name) else name, time.time() - startTime)
+            yield item
+
+    def percentile(self, buckets, fraction):
+        count, seen = sum(buckets), 0
+        for bound, bucketCount in zip(self.BUCKETS + (None,), buckets):
+            seen += bucketCount
+            if seen >= fraction * count:
+                return bound
+
+    def summary(self):
+        '''
+        Machine-readable summary, latency percentiles are bucket upper bounds (None: slower than the last bucket).
+
+        Return dict.
+        '''
+
+        with self.lock:
+            requests = dict((method, list(entry[:3]) + [list(entry[3])]) for method, entry in self.requests.items())
+            phases   = dict(self.phases)
+
+        latency = {}
+        for method, (count, total, maxTime, buckets) in requests.items():
+            latency[method] = {'count': count, 'total': total, 'mean': total / count, 'max': maxTime,
+                               'p50': self.percentile(buckets, 0.5), 'p99': self.percentile(buckets, 0.99),
+                               'buckets': zip(self.BUCKETS + (None,), buckets)}
+
+        return {'requests': dict((method, requests[method][0]) for method in requests),
+                'requestsTotal': sum(entry[0] for entry in requests.values()),
+                'latency': latency, 'phases': phases, 'wall': time.time() - self.startTime}
+
+    def report(self):
+        '''
+        Human readable summary.
+
+        Return string.
+        '''
+
+        summary = self.summary()
+        ms      = lambda seconds: "{0:.2f}ms".format(seconds * 1000) if seconds is not None else "slower"
+
+        lineList = ["STATS  ==> requests: {0} ({1}) wall: {2:.3f}s".format(
+            summary['requestsTotal'],
+            ", ".join("{0}: {1}".format(method, count) for method, count in sorted(summary['requests'].items())),
+            summary['wall'])]
+
+        for method, latency in sorted(summary['latency'].items()):
+            lineList.append("STATS  ==> {0:<14} count: {1:<7} total: {2:.3f}s mean: {3} p50 <= {4} p99 <= {5} max: {6}".format(
+                method, latency['count'], latency['total'], ms(latency['mean']), ms(latency['p50']),
+                ms(latency['p99']), ms(latency['max'])))
+
+        lineList.append("STATS  ==> phases: {0}".format(
+            ", ".join("{0}: {1:.3f}s".format(name, seconds) for name, seconds in sorted(summary['phases'].items())) or "none"))
+
+        return "\n".join(lineList)
+
+zkStats = ZkStats()
+
+
+class StatsTransaction(object):
+    ''' Multi request accounting wrapper '''
+
+    def __init__(self, transaction, stats):
+        self.transaction = transaction
+        self.stats       = stats
+
+    def __getattr__(self, name):
+        return getattr(self.transaction, name)
+
+    def commit(self):
+        startTime = time.time()
+        try:
+            return self.transaction.commit()
+        finally:
+            self.stats.record('multi', time.time() - startTime)
+
+    def commit_async(self):
+        startTime   = time.time()
+        asyncResult = self.transaction.commit_async()
+        asyncResult.rawlink(lambda result: self.stats.record('multi', time.time() - startTime))
+        return asyncResult
+
+
+class StatsClient(object):
+    '''
+    Zookeeper client wrapper recording every request into ZkStats, async requests are timed
+    until their result arrives. Everything else is passed to the wrapped client.
+    '''
+
+    METHODS = ('exists', 'get', 'get_children', 'create', 'set', 'delete', 'ensure_path')
+
+    def __init__(self, client, stats):
+        self.client = client
+        self.stats  = stats
+
+    def __getattr__(self, name):
+        attr   = getattr(self.client, name)
+        method = name[:-len('_async')] if name.endswith('_async') else name
+
+        if name == 'transaction':
+            return lambda: StatsTransaction(attr(), self.stats)
+
+        if method not in self.METHODS:
+            return attr
+
+        if name.endswith('_async'):
+            def asyncCall(*args, **kwargs):
+                startTime   = time.time()
+                asyncResult = attr(*args, **kwargs)
+                asyncResult.rawlink(lambda result: self.stats.record(method, time.time() - startTime))
+                return asyncResult
+            return asyncCall
+
+        def syncCall(*args, **kwargs):
+            startTime = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.stats.record(method, time.time() - startTime)
+        return syncCall
+
+
+class ZkSession(object):
+    '''
+    One zookeeper client connection shared by all operations of a process.
+    Connection is opened lazily in read-only mode, which also connects to a read-only server of a partitioned
+    ensemble. Connected to a normal server it serves writes as well, so it is reconnected read-write on the
+    first write only when it sits on a read-only server.
+    An injected client (library callers, tests) is used as is and never stopped here.
+    '''
+
+    def __init__(self, client=None):
+        self.client      = client
+        self.readOnly    = False if client is not None else None
+        self.owned       = client is None
+        self.connects    = 0
+        self.connectTime = 0.0
+
+    def ro(self):
+        '''
+        Return zookeeper connection object usable for reads.
+        '''
+
+        if self.client is None:
+            self.connect(zkStartRo, True)
+
+        return self.client
+
+    def rw(self):
+        '''
+        Return zookeeper connection object usable for writes.
+        '''
+
+        if self.readOnly and getattr(self.client, 'client_state', None) != 'CONNECTED_RO':
+            ## read-only mode session of a read-write server, no second handshake
+            self.readOnly = False
+
+        if self.client is None or self.readOnly:
+            self.close()
+            self.connect(zkStartRw, False)
+
+        return self.client
+
+    def connect(self, zkStart, readOnly):
+        startTime = time.time()
+        self.client, self.readOnly, self.owned = zkStart(), readOnly, True
+        connectTime = time.time() - startTime
+
+        if cfg.stats:
+            zkStats.addPhase('connect', connectTime)
+            self.client = StatsClient(self.client, zkStats)
+
+        self.connects    += 1
+        self.connectTime += connectTime
+
+        if cfg.debug:
+            sys.stderr.write("DEBUG  ==> connected to: {0} {1} in {2:.3f}s (connections: {3})\n".format(
+                cfg.zkServers, 'read-only' if readOnly else 'read-write', connectTime, self.connects))
+
+    def close(self):
+        if self.client is not None and self.owned:
+            self.client.stop()
+            self.client.close()
+            self.client = None
+
+zkSession = ZkSession()
+
+
+class Znode(object):
+    ''' One znode of the in-memory backend tree '''
+
+    def __init__(self, data, zxid):
+        self.data     = data
+        self.children = {}
+        self.czxid    = zxid
+        self.mzxid    = zxid
+        self.pzxid    = zxid
+        self.version  = 0
+        self.cversion = 0
+        self.ctime    = int(time.time() * 1000)
+        self.mtime    = self.ctime
+
+    def stat(self):
+        from kazoo.protocol.states import ZnodeStat
+        return ZnodeStat(self.czxid, self.mzxid, self.ctime, self.mtime, self.version, self.cversion, 0, 0,
+                         len(self.data), len(self.children), self.pzxid)
+
+
+class MemoryTree(object):
+    '''
+    In-memory znode tree of the memory backend, shared by all its clients in a process,
+    latency is slept by every request to mimic a zookeeper round trip.
+    '''
+
+    def __init__(self, latency=0.0):
+        import threading
+        self.root      = Znode('', 0)
+        self.zxid      = 0
+        self.latency   = latency  ## seconds per round trip
+        self.lock      = threading.RLock()
+        self.watches   = []  ## active MemoryWatch
+        self.watchLock = threading.RLock()  ## callbacks run one at a time, like kazoo's event thread
+
+    def run(self, func, args):
+        self.lock.acquire()
+        zxid = self.zxid
+        try:
+            return func(*args)
+        finally:
+            changed = self.zxid != zxid
+            self.lock.release()
+
+            if changed and self.watches:  ## outside the tree lock, callbacks may take their own locks and read
+                self.fireWatches()
+
+    def fireWatches(self):
+        with self.watchLock:
+            for watch in list(self.watches):
+                if watch.active:
+                    watch.fire()
+
+    def find(self, path):
+        node = self.root
+        for name in [name for name in path.split('/') if name]:
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def parent(self, path):
+        parentPath, name = path.rsplit('/', 1)
+        return self.find(parentPath or '/'), name
+
+    def nextZxid(self):
+        self.zxid += 1
+        return self.zxid
+
+    def exists(self, path):
+        node = self.find(path)
+        return node.stat() if node is not None else None
+
+    def get(self, path):
+        from kazoo.exceptions import NoNodeError
+        node = self.find(path)
+        if node is None:
+            raise NoNodeError()
+        return node.data, node.stat()
+
+    def getChildren(self, path, includeData=False):
+        from kazoo.exceptions import NoNodeError
+        node = self.find(path)
+        if node is None:
+            raise NoNodeError()
+        children = list(node.children)
+        return (children, node.stat()) if includeData else children
+
+    def create(self, path, value='', makepath=False, sequence=False):
+        from kazoo.exceptions import NoNodeError, NodeExistsError
+        parentNode, name = self.parent(path)
+        if parentNode is None:
+            if not makepath:
+                raise NoNodeError()
+            self.ensurePath(path.rsplit('/', 1)[0])
+            parentNode, name = self.parent(path)
+
+        if sequence:
+            name = "{0}{1:010d}".format(name, parentNode.cversion)
+        if name in parentNode.children:
+            raise NodeExistsError()
+
+        zxid = self.nextZxid()
+        parentNode.children[name] = Znode(value or '', zxid)
+        parentNode.cversion += 1
+        parentNode.pzxid     = zxid
+        return "{0}/{1}".format(path.rsplit('/', 1)[0], name)
+
+    def ensurePath(self, path):
+        current = ''
+        for name in [name for name in path.split('/') if name]:
+            current += '/' + name
+            if self.find(current) is None:
+                self.create(current)
+        return True
+
+    def setData(self, path, value, version=-1):
+        from kazoo.exceptions import NoNodeError, BadVersionError
+        node = self.find(path)
+        if node is None:
+            raise NoNodeError()
+        if version != -1 and node.version != version:
+            raise BadVersionError()
+        node.data     = value
+        node.version += 1
+        node.mzxid    = self.nextZxid()
+        node.mtime    = int(time.time() * 1000)
+        return node.stat()
+
+    def delete(self, path, version=-1, recursive=False):
+        from kazoo.exceptions import NoNodeError, BadVersionError, NotEmptyError
+        node = self.find(path)
+        if node is None:
+            raise NoNodeError()
+        if node.children and not recursive:
+            raise NotEmptyError()
+        if version != -1 and node.version != version:
+            raise BadVersionError()
+
+        parentNode, name = self.parent(path)
+        del parentNode.children[name]
+        parentNode.cversion += 1
+        parentNode.pzxid     = self.nextZxid()
+        return True
+
+    def check(self, path, version):
+        from kazoo.exceptions import NoNodeError, BadVersionError
+        node = self.find(path)
+        if node is None:
+            raise NoNodeError()
+        if version != -1 and node.version != version:
+            raise BadVersionError()
+        return True
+
+
+class MemoryAsyncResult(object):
+    '''
+    Result of an async request, ready one round trip after it was sent.
+    '''
+
+    def __init__(self, tree, func, args):
+        self.readyAt = time.time() + tree.latency
+
+        try:
+            self.value, self.exception = tree.run(func, args), None
+        except Exception as error:
+            self.value, self.exception = None, error
+
+    def get(self, block=True, timeout=None):
+        waitTime = self.readyAt - time.time()
+        if waitTime > 0:
+            time.sleep(waitTime)
+
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+    def successful(self):
+        return self.exception is None
+
+    def rawlink(self, callback):
+        ## called right away: latency seen by callbacks is not simulated, only by get()
+        callback(self)
+
+
+class MemoryTransaction(object):
+    '''
+    All-or-nothing multi request, results follow kazoo: RolledBackError for operations not applied.
+    '''
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.ops  = []
+
+    def create(self, path, value='', acl=None, ephemeral=False, sequence=False):
+        self.ops.append((self.tree.create, (path, value, False, sequence)))
+
+    def delete(self, path, version=-1):
+        self.ops.append((self.tree.delete, (path, version)))
+
+    def set_data(self, path, value, version=-1):
+        self.ops.append((self.tree.setData, (path, value, version)))
+
+    def check(self, path, version):
+        self.ops.append((self.tree.check, (path, version)))
+
+    def commit_async(self):
+        return MemoryAsyncResult(self.tree, self.apply, ())
+
+    def commit(self):
+        return self.commit_async().get()
+
+    def apply(self):
+        from kazoo.exceptions import RolledBackError
+        undoLog = []
+        results = []
+
+        for func, args in self.ops:
+            try:
+                undoLog.append(self.snapshot(args[0]))
+                results.append(func(*args))
+            except Exception as error:
+                for path, parentNode, name, node in reversed(undoLog):
+                    self.restore(path, parentNode, name, node)
+                return [RolledBackError()] * len(results) + [error] + \
+                       [RolledBackError()] * (len(self.ops) - len(results) - 1)
+
+        return results
+
+    def snapshot(self, path):
+        ## the parent keeps a reference to the original znode, copy what the operation can change
+        parentNode, name = self.tree.parent(path)
+        if parentNode is None:
+            return path, None, name, None
+
+        node = parentNode.children.get(name)
+        saved = (parentNode.cversion, parentNode.pzxid, dict(parentNode.children))
+        nodeSaved = (node, node.data, node.version, node.mzxid) if node is not None else None
+        return path, parentNode, name, (saved, nodeSaved)
+
+    def restore(self, path, parentNode, name, state):
+        if parentNode is None:
+            return
+        (cversion, pzxid, children), nodeSaved = state
+        parentNode.cversion, parentNode.pzxid, parentNode.children = cversion, pzxid, children
+        if nodeSaved is not None:
+            node, node.data, node.version, node.mzxid = nodeSaved
+
+
+class MemoryWatch(object):
+    '''
+    ChildrenWatch/DataWatch of a MemoryTree. Like kazoo, the callback runs when registered and after
+    every change of the znode until it returns False, a ChildrenWatch also stops when the znode is gone
+    and a DataWatch gets (None, None) for a missing znode. Callbacks run in the thread of the writing request.
+    '''
+
+    def __init__(self, tree, kind, path, func):
+        self.tree   = tree
+        self.kind   = kind  ## children or data
+        self.path   = path
+        self.func   = func
+        self.key    = ()    ## never the key of a znode, so registering fires
+        self.active = True
+
+        with tree.watchLock:
+            tree.watches.append(self)
+            self.fire()
+
+    def current(self):
+        with self.tree.lock:
+            node = self.tree.find(self.path)
+            if node is None:
+                return None, None
+            if self.kind == 'children':
+                childList = sorted(node.children)
+                return childList, childList
+            return (node.czxid, node.version), (node.data, node.stat())  ## created, deleted or set
+
+    def fire(self):
+        key, value = self.current()
+        if key == self.key:
+            return
+        self.key = key
+
+        if self.kind == 'children':
+            result = self.func(value) if value is not None else False
+        else:
+            result = self.func(*(value or (None, None)))
+
+        if result is False:
+            self.active = False
+            self.tree.watches.remove(self)
+
+
+class MemoryZk(object):
+    '''
+    KazooClient compatible client of a MemoryTree: the subset of the kazoo API used by this module
+    (exists, get, get_children, create, set, delete, ensure_path, their async variants, transactions,
+    ChildrenWatch and DataWatch) with kazoo semantics, exceptions and ZnodeStat versions.
+    Like kazoo, a stopped client refuses requests.
+    '''
+
+    def __init__(self, tree, hosts=None, read_only=False, **kwargs):
+        self.tree         = tree
+        self.connected    = False
+        self.stopped      = False
+        self.client_state = 'LOST'
+
+    def start(self, timeout=15):
+        self.stopped      = False
+        self.roundTrip()
+        self.connected    = True
+        self.client_state = 'CONNECTED'  ## never a read-only server
+
+    def stop(self):
+        self.connected    = False
+        self.stopped      = True
+        self.client_state = 'LOST'
+
+    def close(self):
+        pass
+
+    def checkOpen(self):
+        from kazoo.exceptions import ConnectionClosedError
+        if self.stopped:
+            raise ConnectionClosedError("Connection has been closed")
+
+    def roundTrip(self):
+        self.checkOpen()
+        if self.tree.latency:
+            time.sleep(self.tree.latency)
+
+    def call(self, func, *args):
+        self.roundTrip()
+        return self.tree.run(func, args)
+
+    def exists(self, path, watch=None):
+        return self.call(self.tree.exists, path)
+
+    def get(self, path, watch=None):
+        return self.call(self.tree.get, path)
+
+    def get_children(self, path, watch=None, include_data=False):
+        return self.call(self.tree.getChildren, path, include_data)
+
+    def create(self, path, value='', acl=None, ephemeral=False, sequence=False, makepath=False):
+        return self.call(self.tree.create, path, value, makepath, sequence)
+
+    def ensure_path(self, path, acl=None):
+        return self.call(self.tree.ensurePath, path)
+
+    def set(self, path, value, version=-1):
+        return self.call(self.tree.setData, path, value, version)
+
+    def delete(self, path, version=-1, recursive=False):
+        return self.call(self.tree.delete, path, version, recursive)
+
+    def exists_async(self, path, watch=None):
+        self.checkOpen()
+        return MemoryAsyncResult(self.tree, self.tree.exists, (path,))
+
+    def get_async(self, path, watch=None):
+        self.checkOpen()
+        return MemoryAsyncResult(self.tree, self.tree.get, (path,))
+
+    def get_children_async(self, path, watch=None, include_data=False):
+        self.checkOpen()
+        return MemoryAsyncResult(self.tree, self.tree.getChildren, (path, include_data))
+
+    def create_async(self, path, value='', acl=None, ephemeral=False, sequence=False, makepath=False):
+        self.checkOpen()
+        return MemoryAsyncResult(self.tree, self.tree.create, (path, value, makepath, sequence))
+
+    def set_async(self, path, value, version=-1):
+        self.checkOpen()
+        return MemoryAsyncResult(self.tree, self.tree.setData, (path, value, version))
+
+    def delete_async(self, path, version=-1):
+        self.checkOpen()
+        return MemoryAsyncResult(self.tree, self.tree.delete, (path, version))
+
+    def transaction(self):
+        self.checkOpen()
+        return MemoryTransaction(self.tree)
+
+    def ChildrenWatch(self, path, func):
+        self.checkOpen()
+        return MemoryWatch(self.tree, 'children', path, func)
+
+    def DataWatch(self, path, func):
+        self.checkOpen()
+        return MemoryWatch(self.tree, 'data', path, func)
+
+
+def memoryClientFactory(tree):
+    '''
+    KazooClient replacement creating clients of one shared MemoryTree (cfg.zkBackend memory, tests, benchmarks).
+
+    Return function.
+    '''
+
+    def memoryClient(hosts=None, read_only=False, **kwargs):
+        return MemoryZk(tree, hosts, read_only)
+
+    return memoryClient
+
+
 class ArgError(object):
     ''' Class for handling errors '''
 
@@ -116,6 +898,16 @@ class CommonInformer(ArgError):
     ''' Class for message informing '''
     
     pass
+
+
+def resultMessage(result):
+    '''
+    Message of an operation result, ArgError and CommonInformer results are tuples (message type, message).
+
+    Return result (the message of a tuple).
+    '''
+
+    return result[1] if type(result) is tuple else result
                                             
     
 def splitZnodeVarString(znodeVarString):
@@ -139,6 +931,41 @@ def splitZnodeVarString(znodeVarString):
     return { groupName : { hostName : varDict }}
 
 
+def splitGroupVarString(groupVarString):
+    '''
+    Parse string for commandline opt: <--group-vars>, values may contain colons.
+
+    Return tuple (groupName, groupPath, varDict).
+    '''
+
+    ## example string: groupname,var1:val1,var2:val2
+    ## desired tuple : ("groupname", "/ansible_zk/groups/groupname", {"var1":"val1", "var2":"val2"})
+
+    varList   = groupVarString.split(',')
+    groupName = varList[0]
+    varDict   = dict(var.split(':', 1) for var in varList[1:] if ':' in var)
+
+    return groupName, "{0}/groups/{1}".format(cfg.aPath, groupName), varDict
+
+
+def splitChildGroupString(childGroupString):
+    '''
+    Parse string for commandline opts: <--child> and <--delete-child>.
+
+    Return tuple (parentName, childName) or string (SYNTAX ERROR).
+    '''
+
+    ## example string: dc1:dc1-kafka
+    ## desired tuple : ("dc1", "dc1-kafka")
+
+    groupList = childGroupString.split(':')
+
+    if len(groupList) != 2 or '' in groupList:
+        return "SYNTAX ERROR --> {0} <-- no valid number of groupnames [parentgroup:childgroup]".format(childGroupString)
+
+    return groupList[0], groupList[1]
+
+
 def splitZnodeString(znodeString):
     '''
     Splits znodeString into groupName, hostName, groupPath, hostPath, hostGroupPath.
@@ -213,568 +1040,5011 @@ def splitRenameZnodeString(renameZnodeString):
         return ArgError('NO_VALID_KEYWORDS_STRING', ERROR_MSGS['NO_VALID_KEYWORDS_STRING']).format()
 
     
-def addHostWithHostvars(znodeDict):
-    '''
-    Add existing znode to new group.
+## hostvars storage formats kept in <cfg.aPath>/format znode:
+##   1 ==> legacy, every hostvar is its own znode: /hosts/<host>/<var>
+##   2 ==> packed, all hostvars of a host in one blob on the host znode: /hosts/<host>
+## readers understand both layouts on a per host basis, writers follow the format marker
+## for new hosts and keep the layout of existing ones, so migration can run online
 
-    Return string (ADDED    ==> host: hostname to group: groupname).
-    '''
-  
-    zk = zkStartRw()
+FORMAT_VERSIONS = {'legacy': '1', 'packed': '2'}
+PACKED_HEADER   = 'ak:packed:1\n'
 
-    groupName      = znodeDict.keys()[0]
-    hostName       = znodeDict[groupName].keys()[0]
-    groupPath      = "{0}/groups/{1}".format(cfg.aPath, groupName)
-    hostPath       = "{0}/hosts/{1}".format(cfg.aPath, hostName)
-    hostGroupPath  = "{0}/{1}".format(groupPath, hostName)
+## large values in either format are encoded on write, whatever reads hostvars decodes them:
+##   ak:zlib:1\n<zlib stream>        ==> compressed hostvar value or packed blob
+##   ak:chunks:1\n<JSON manifest>    ==> hostvar value kept in chunk znodes /chunks/<sha1 of stored bytes>/<number>
 
-    ERROR_MSGS = {
-        'HOST_EXISTS': "host: {0} exists !!!".format(hostName),
-        'HOST_EXISTS_IN_GROUP': "host: {0} in group {1} exists !!!".format(hostName, groupName)
-    }
+VALUE_TAG      = 'ak:'
+ZLIB_HEADER    = 'ak:zlib:1\n'
+CHUNKED_HEADER = 'ak:chunks:1\n'
 
-    COMMON_MSGS = {
-        'ADDED_HOST_TO_GROUP': "ADDED  ==> host: {0} to group: {1}".format(hostName, groupName)
-    }
 
-    try:
-        if zk.exists(hostPath):
-            return ArgError('HOST_EXISTS',ERROR_MSGS['HOST_EXISTS']).format()
+def storageFormat(zk):
+    '''
+    Read hostvars storage format marker.
+
+    Return string (legacy|packed).
+    '''
 
-        elif zk.exists(hostGroupPath):
-            return ArgError('HOST_EXISTS_IN_GROUP',ERROR_MSGS['HOST_EXISTS_IN_GROUP']).format()
+    from kazoo.exceptions import NoNodeError
 
-        else:
-            zk.ensure_path(hostPath)
-            zk.ensure_path(hostGroupPath)
+    try:
+        version = zk.get("{}/format".format(cfg.aPath))[0]
 
-            for key in znodeDict[groupName][hostName]:
-                varPath = "{0}/{1}".format(hostPath, key)
-                varVal  = znodeDict[groupName][hostName][key]
-                zk.create(varPath, varVal)
+    except NoNodeError:
+        return 'legacy'
 
-            return CommonInformer('ADDED_HOST_TO_GROUP',COMMON_MSGS['ADDED_HOST_TO_GROUP']).format()
+    for formatName in FORMAT_VERSIONS:
+        if FORMAT_VERSIONS[formatName] == version:
+            return formatName
 
-    finally:
-        zk.stop()    
-    
+    return 'legacy'
 
-def addHostToGroup(znodeStringSplited):
+
+def packHostVars(varDict):
     '''
-    Add host to group.
+    Serialize hostvars dict into a packed host znode blob.
 
-    Return string (ADDED  ==> host: hostname to group: groupname).
+    Return string.
     '''
 
-    zk = zkStartRw()
+    return PACKED_HEADER + json.dumps(varDict, sort_keys=True, separators=(',', ':'))
 
-    groupName, groupPath              = znodeStringSplited[0]
-    hostName, hostPath, hostGroupPath = znodeStringSplited[1]
 
-    ERROR_MSGS = {
-        'HOST_EXISTS_IN_GROUP': "ERROR  ==> host: {0} in group {1} exists !!!".format(hostName, groupName),
-        'HOST_DOES_NOT_EXIST': "ERROR  ==> host: {0} does not exist !!! Could not add non-existent host: {0} to group: {1}".format(hostName, groupName)
-    }
+def unpackHostVars(data):
+    '''
+    Deserialize packed host znode blob into hostvars dict.
 
-    COMMON_MSGS = {
-        'ADDED_HOST_TO_GROUP': "ADDED  ==> host: {0} to group: {1}".format(hostName, groupName)
-    }
-  
-    try:
-        if zk.exists(hostGroupPath):
-            return ArgError('HOST_EXISTS_IN_GROUP',ERROR_MSGS['HOST_EXISTS_IN_GROUP']).format()
+    Return dict or None (data is not a packed blob).
+    '''
 
-        if zk.exists(hostPath) is None:
-            return ArgError('HOST_DOES_NOT_EXIST',ERROR_MSGS['HOST_DOES_NOT_EXIST']).format()
-        
-        zk.ensure_path(hostGroupPath)
-        return CommonInformer('ADDED_HOST_TO_GROUP',COMMON_MSGS['ADDED_HOST_TO_GROUP']).format()
+    if data and data.startswith(ZLIB_HEADER):
+        data = decodeValue(data)
 
-    finally:
-        zk.stop()
+    if not data or not data.startswith(PACKED_HEADER):
+        return None
+
+    ## keep byte strings like zk.get() does for legacy hostvar znodes
+    varDict = json.loads(data[len(PACKED_HEADER):])
+    return dict((var.encode('utf-8'), val.encode('utf-8')) for var, val in varDict.items())
 
 
-def deleteZnodeRecur(znodeStringSplited):
+def groupVars(data):
     '''
-    Delete znode recursivelly for a given string groupname or hosts:hostname or groupname:hostname.
+    Decode group vars kept in the group znode, packed the same way as packed hostvars.
 
-    Return string (DELETED||ERROR  ==> [host: hostname || group: groupname]).
+    Return dict.
     '''
 
-    zk = zkStartRw()
+    return unpackHostVars(data) or {}
 
-    try:
-        if len(znodeStringSplited) > 1:  ## check if it is <groupname:hostname> case
 
-            groupName, groupPath              = znodeStringSplited[0]
-            hostName, hostPath, hostGroupPath = znodeStringSplited[1]
+def compressValue(value):
+    '''
+    Return string (value zlib compressed with ZLIB_HEADER or the value itself when that does not make it smaller).
+    '''
 
-            ERROR_MSGS = {
-                'HOST_DOES_NOT_EXIST': "ERROR  ==> could not delete host: {0} that does not exist !!!".format(hostName),
-                'HOST_DOES_NOT_EXISTS_IN_GROUP': "ERROR  ==> could not delete host: {0} that does not exist in group: {1} !!!".format(hostName, groupName),
-                'GROUP_DOES_NOT_EXIST': "ERROR  ==> could not delete group: {0} that does not exist !!!".format(groupName)
-            }
+    compressed = ZLIB_HEADER + zlib.compress(value, 6)
+    return compressed if len(compressed) < len(value) else value
 
-            COMMON_MSGS = {
-                'DELETED_HOST_IN_GROUP': "DELETED ==> host: {0} in group: {1}".format(hostName, groupName),
-                'DELETED_GROUP': "DELETED ==> group: {0}".format(groupName),
-                'DELETED_HOST': "DELETED ==> host: {0}".format(hostName)
-                
-            }
 
-            
-            if zk.exists(hostPath) is None:
-                return ArgError('HOST_DOES_NOT_EXIST',ERROR_MSGS['HOST_DOES_NOT_EXIST']).format()
+def decodeValue(value):
+    '''
+    Return string (value decompressed when it carries ZLIB_HEADER, otherwise as it is).
+    '''
 
-            if zk.exists(hostGroupPath) is None:
-                return  ArgError('HOST_DOES_NOT_EXISTS_IN_GROUP',ERROR_MSGS['HOST_DOES_NOT_EXISTS_IN_GROUP']).format()
+    if value and value.startswith(ZLIB_HEADER):
+        return zlib.decompress(value[len(ZLIB_HEADER):])
 
-            if len(zk.get_children(groupPath)) == 1:  ## delete group if there is only one host in it
-                zk.delete(groupPath, recursive=True)
+    return value
 
-            else:
-                zk.delete(hostGroupPath, recursive=True)
-                return CommonInformer('DELETED_HOST_IN_GROUP',ERROR_MSGS['DELETED_HOST_IN_GROUP']).format()
-    
-        elif len(znodeStringSplited) == 1:  ## check if it is <groupname> or <hosts:hostname> case    
-            if len(znodeStringSplited[0]) == 2:  ## first check for group only
-        
-                groupName, groupPath = znodeStringSplited[0]
-       
-                if zk.exists(groupPath) is None:
-                    return ArgError('GROUP_DOES_NOT_EXIST',ERROR_MSGS['GROUP_DOES_NOT_EXIST']).format()
 
-                else:
-                    zk.delete(groupPath, recursive=True)
-                    return CommonInformer('DELETED_GROUP',ERROR_MSGS['DELETED_GROUP']).format()
-            
-            else:  ## then assume check for hosts only 
+def chunkPath(chunkId, number=None):
+    '''
+    Path of a chunked value: <aPath>/chunks/<id>[/<number>].
 
-                hostName, hostPath, notUsedValue = znodeStringSplited[0]
-                
-                if zk.exists(hostPath) is None:
-                    return ArgError('HOST_DOES_NOT_EXIST',ERROR_MSGS['HOST_DOES_NOT_EXIST']).format()
+    Return string.
+    '''
 
-                else:
-                    zk.delete(hostPath, recursive=True)
-                    return CommonInformer('DELETED_HOST',ERROR_MSGS['DELETED_HOST']).format()
-            
-        else:  ## Unknown cases        
-            return "ERROR with processing znodeStrings !!!"           
+    if number is None:
+        return "{0}/chunks/{1}".format(cfg.aPath, chunkId)
 
-    finally:
-        zk.stop()
+    return "{0}/chunks/{1}/{2:04d}".format(cfg.aPath, chunkId, number)
 
 
-def updateZnode(znodeDict):
+def writeChunkSet(zk, chunkId, chunkList):
     '''
-    Update znode with hostvars.
+    Write chunk znodes of a chunk set ahead of the write using them, named by their sha1 so equal values
+    share one chunk set and an interrupted write is completed by the next one.
+    The set is marked complete (and its mtime renewed for --chunk-gc) before the manifest is used.
 
-    Return string (ERROR ... || UPDATED ... || NOT UPDATED ...).
+    Return None.
     '''
 
+    from kazoo.exceptions import NoNodeError, NodeExistsError
 
-    # COMMON_MSGS = {
-    #     'DELETED_HOST_IN_GROUP': "DELETED ==> host: {0} in group: {1}".format(hostName, groupName),
-    #     'DELETED_GROUP': "DELETED ==> group: {0}".format(groupName),
-    #     'DELETED_HOST': "DELETED ==> host: {0}".format(hostName)
+    try:
+        complete = zk.get(chunkPath(chunkId))[0] == 'complete'
 
-    # }
+    except NoNodeError:
+        complete = False
+        try:
+            zk.create(chunkPath(chunkId), '', makepath=True)
+        except NodeExistsError:
+            pass
 
-    
-    zk = zkStartRw()
-    
-    groupName   = znodeDict.keys()[0]
-    hostName    = znodeDict[groupName].keys()[0]
-    hostPath    = "{0}/hosts/{1}".format(cfg.aPath, hostName)
-    hostVarList = zk.get_children(hostPath)
+    if not complete:
+        for number, chunk in enumerate(chunkList):
+            try:
+                zk.create(chunkPath(chunkId, number), chunk)
+            except NodeExistsError:  ## same bytes, written by an interrupted or concurrent writer
+                pass
 
-    ERROR_MSGS = {
-        'HOST_DOES_NOT_EXIST': "ERROR  ==> could not update host: {0} that does not exist !!!".format(hostName)
-        # 'HOST_DOES_NOT_EXISTS_IN_GROUP': "ERROR  ==> could not delete host: {0} that does not exist in group: {1} !!!".format(hostName, groupName),
-        # 'GROUP_DOES_NOT_EXIST': "ERROR  ==> could not delete group: {0} that does not exist !!!".format(groupName)
-    }
+    zk.set(chunkPath(chunkId), 'complete')
 
-    
-    try:
-        if zk.exists(hostPath) is None:
-#            return ArgError('HOST_DOES_NOT_EXIST',ERROR_MSGS['HOST_DOES_NOT_EXIST']).format()
-            return "ERROR  ==> could not update host: {0} that does not exist !!!".format(hostName)
 
-        for hostVar in hostVarList:
-            if zk.exists("{0}/{1}".format(hostPath, hostVar)) is None: 
-                return "ERROR  ==> hostvar: {0} for host {1} does not exist !!!".format(hostVar, hostName)
+def writeChunks(zk, payload, rawSize, chunkSets=None):
+    '''
+    Store bytes too large for one znode as chunk znodes of cfg.chunkBytes. A new chunk set is put
+    into chunkSets when given, to be created by the multi request of the write using it, otherwise
+    (and when the set exists already) it is written ahead.
+
+    Return string (manifest value: CHUNKED_HEADER and JSON {"id", "chunks", "size", "raw", "crc"}).
+    '''
+
+    chunkId   = hashlib.sha1(payload).hexdigest()
+    chunkList = [payload[i:i + cfg.chunkBytes] for i in range(0, len(payload), cfg.chunkBytes)]
+
+    if chunkSets is None or zk.exists(chunkPath(chunkId)) is not None:
+        writeChunkSet(zk, chunkId, chunkList)
+    elif chunkId not in [queuedId for queuedId, queuedList in chunkSets]:
+        chunkSets.append((chunkId, chunkList))
+
+    manifest = {'id': chunkId, 'chunks': len(chunkList), 'size': len(payload), 'raw': rawSize,
+                'crc': zlib.crc32(payload) & 0xffffffff}
+
+    return CHUNKED_HEADER + json.dumps(manifest, sort_keys=True, separators=(',', ':'))
+
+
+def storedValue(zk, path, value, chunkSets=None):
+    '''
+    Encode value of cfg.compressBytes or more written to a znode under <aPath>/hosts:
+    hostvar values and packed blobs are compressed when it pays off, hostvar values still larger
+    than cfg.chunkBytes are moved into chunk znodes (in a packed blob the largest ones, until it fits),
+    new chunk sets go into chunkSets as of writeChunks.
+    Encoded values are let through, so copies of stored znodes (rename) keep their bytes.
+
+    Return string.
+    '''
+
+    hostsPrefix = "{}/hosts/".format(cfg.aPath)
+
+    if len(value) < cfg.compressBytes or not path.startswith(hostsPrefix):
+        return value
+
+    if value.startswith(PACKED_HEADER):
+        varDict = unpackHostVars(value)
+        for var in sorted(varDict, key=lambda var: len(varDict[var]), reverse=True):
+            if len(value) <= cfg.chunkBytes or len(varDict[var]) < cfg.compressBytes:
+                break
+            payload      = compressValue(varDict[var])
+            varDict[var] = writeChunks(zk, payload, len(varDict[var]), chunkSets)
+            value        = packHostVars(varDict)
+        return compressValue(value)
+
+    if value.startswith(VALUE_TAG) or '/' not in path[len(hostsPrefix):]:
+        return value
+
+    payload = compressValue(value)
+    return writeChunks(zk, payload, len(value), chunkSets) if len(payload) > cfg.chunkBytes else payload
+
+
+def resolveValues(zk, varDictList, window=None):
+    '''
+    Decode stored hostvar values of hostvars dicts in place: compressed values are decompressed,
+    chunked values are reassembled from their chunk znodes fetched with pipelined gets and checked
+    against size and crc of the manifest (a damaged one is replaced by an ERROR string).
+
+    Return list of dicts (varDictList).
+    '''
+
+    chunkedList = []  ## (hostvars dict, var, manifest)
+
+    for varDict in varDictList:
+        for var, value in varDict.iteritems():
+            if not value or value[:3] != VALUE_TAG:
+                continue
+            if value.startswith(ZLIB_HEADER):
+                varDict[var] = decodeValue(value)
+            elif value.startswith(CHUNKED_HEADER):
+                chunkedList.append((varDict, var, json.loads(value[len(CHUNKED_HEADER):])))
+
+    if len(chunkedList) == 0:
+        return varDictList
+
+    chunkRequests = (((n, number), 'data', chunkPath(manifest['id'], number))
+                     for n, (varDict, var, manifest) in enumerate(chunkedList) for number in range(manifest['chunks']))
+    chunkDict     = dict((key, result[0] if result is not None else None)
+                         for key, path, result in pipelinedFetch(zk, chunkRequests, window))
+
+    for n, (varDict, var, manifest) in enumerate(chunkedList):
+        chunkList = [chunkDict[(n, number)] for number in range(manifest['chunks'])]
+        payload   = ''.join(chunk for chunk in chunkList if chunk is not None)
+
+        if None in chunkList or len(payload) != manifest['size'] or zlib.crc32(payload) & 0xffffffff != manifest['crc']:
+            varDict[var] = "ERROR  ==> chunked value: {0} is damaged or incomplete !!!".format(manifest['id'])
+        else:
+            varDict[var] = decodeValue(payload)
+
+    return varDictList
+
+
+def readHostVars(zk, hostPath, window=None):
+    '''
+    Read hostvars of one host in either storage format.
+    Packed host costs one get, legacy host costs one get, one get_children and pipelined gets per var.
+
+    Return dict or None (host does not exist).
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    try:
+        data, stat = zk.get(hostPath)
+
+    except NoNodeError:
+        return None
+
+    varDict = unpackHostVars(data)
+    if varDict is not None:
+        return resolveValues(zk, [varDict], window)[0]
+
+    if stat.numChildren == 0:
+        return {}
+
+    varRequests = ((var, 'data', "{0}/{1}".format(hostPath, var)) for var in zk.get_children(hostPath))
+    varDict     = dict((var, result[0]) for var, path, result in pipelinedFetch(zk, varRequests, window)
+                       if result is not None)
+
+    return resolveValues(zk, [varDict], window)[0]
+
+
+def hostVarsFromResult(zk, hostPath, result):
+    '''
+    Decode first async result for a host znode, fetched with data or childrenStat method.
+    Hosts with an unexpected layout (only while migrating) are completed with a blocking call.
+
+    Return tuple (dict with hostvars, list of hostvar znodes still to be fetched).
+    '''
+
+    if type(result[0]) is list:  ## childrenStat result: (varList, stat)
+        varList, stat = result
+        if stat.dataLength == 0:
+            return {}, varList
+
+        varDict = unpackHostVars(zk.get(hostPath)[0])
+        return (varDict, []) if varDict is not None else ({}, varList)
+
+    data, stat = result  ## data result: (data, stat)
+    varDict = unpackHostVars(data)
+    if varDict is not None:
+        return varDict, []
+
+    return {}, (zk.get_children(hostPath) if stat.numChildren else [])
+
+
+def opBatches(ops, maxBytes=None, maxOps=None):
+    '''
+    Split list of transaction operations (transaction method, args...) into batches
+    whose estimated multi request size stays under maxBytes and maxOps operations.
+
+    Return generator of lists.
+    '''
+
+    maxBytes   = maxBytes or cfg.txnMaxBytes
+    maxOps     = maxOps or cfg.txnMaxOps
+    batch      = []
+    batchBytes = 0
+
+    for op in ops:
+        opBytes = opSize(op)
+
+        if len(batch) > 0 and (batchBytes + opBytes > maxBytes or len(batch) >= maxOps):
+            yield batch
+            batch, batchBytes = [], 0
+
+        batch.append(op)
+        batchBytes += opBytes
+
+    if len(batch) > 0:
+        yield batch
+
+
+def opSize(op):
+    '''
+    Return int (estimated size of a transaction operation in a multi request: path, data and a generous header).
+    '''
+
+    return 64 + sum(len(arg) for arg in op[1:3] if isinstance(arg, basestring))
+
+
+def hostOpBatches(hostOps, maxBytes=None, maxOps=None):
+    '''
+    Split list of tuples (hostname, list of transaction operations) into batches like opBatches does,
+    operations of one host always stay together in one batch.
+
+    Return generator of lists of tuples (hostname, list of transaction operations).
+    '''
+
+    maxBytes   = maxBytes or cfg.txnMaxBytes
+    maxOps     = maxOps or cfg.txnMaxOps
+    batch      = []
+    batchBytes = 0
+    batchOps   = 0
+
+    for host, ops in hostOps:
+        hostBytes = sum(opSize(op) for op in ops)
+
+        if len(batch) > 0 and (batchBytes + hostBytes > maxBytes or batchOps + len(ops) > maxOps):
+            yield batch
+            batch, batchBytes, batchOps = [], 0, 0
+
+        batch.append((host, ops))
+        batchBytes += hostBytes
+        batchOps   += len(ops)
+
+    if len(batch) > 0:
+        yield batch
+
+
+def opTransaction(zk, ops):
+    '''
+    Add list of transaction operations (transaction method, args...) to a transaction, not committed yet.
+    New chunk sets of large values are created in the same transaction, so a failed commit leaves none behind;
+    only sets too big for one multi request are written ahead (and left to --chunk-gc when the commit fails).
+
+    Return tuple (transaction, list of its operations: chunk set creates first, then the given ones).
+    '''
+
+    chunkSets  = []
+    encodedOps = []
+    for op in ops:
+        if op[0] in ('create', 'set_data') and isinstance(op[2], basestring) and len(op[2]) >= cfg.compressBytes:
+            op = op[:2] + (storedValue(zk, op[1], op[2], chunkSets),) + op[3:]
+        encodedOps.append(op)
+
+    chunkOps = []
+    for chunkId, chunkList in chunkSets:
+        chunkOps.append(('create', chunkPath(chunkId), 'complete'))
+        chunkOps.extend(('create', chunkPath(chunkId, number), chunk) for number, chunk in enumerate(chunkList))
+
+    if sum(opSize(op) for op in chunkOps + encodedOps) > cfg.txnMaxBytes:
+        for chunkId, chunkList in chunkSets:
+            writeChunkSet(zk, chunkId, chunkList)
+        chunkOps = []
+
+    elif len(chunkOps) > 0:
+        zk.ensure_path("{}/chunks".format(cfg.aPath))
+
+    tx = zk.transaction()
+    for op in chunkOps + encodedOps:
+        getattr(tx, op[0])(*op[1:])
+
+    return tx, chunkOps + ops
+
+
+def failedOp(ops, commitResults):
+    '''
+    Return None or tuple (failed operation, exception) for results of a committed multi request.
+    '''
+
+    from kazoo.exceptions import RolledBackError
+
+    failedList = [(op, result) for op, result in zip(ops, commitResults) if isinstance(result, Exception)]
+    if len(failedList) == 0:
+        return None
+
+    ## the failed operation carries the real error, all the others are just rolled back
+    return ([failed for failed in failedList if not isinstance(failed[1], RolledBackError)] or failedList)[0]
+
+
+def commitOps(zk, ops, results=None):
+    '''
+    Commit list of transaction operations (transaction method, args...) as one zookeeper multi request,
+    results of the operations are put into a given results list.
+
+    Return None or tuple (failed operation, exception) - nothing is committed then.
+    '''
+
+    tx, txOps     = opTransaction(zk, ops)
+    commitResults = tx.commit()
+    if results is not None:
+        results[:] = commitResults[len(txOps) - len(ops):]
+
+    return failedOp(txOps, commitResults)
+
+
+def commitBatches(zk, batchList, parallel=None, committed=None):
+    '''
+    Commit independent batches of transaction operations as multi requests with up to parallel of them in flight,
+    no new batch is sent once one has failed. Committed batches are appended to the committed list when given.
+
+    Return None or tuple (failed operation, exception) - batches not failed are committed.
+    '''
+
+    from collections import deque
+
+    parallel  = parallel or cfg.deleteParallel
+    inFlight  = deque()
+    failed    = None
+    committed = [] if committed is None else committed
+
+    def collect():
+        batch, txOps, asyncResult = inFlight.popleft()
+        batchFailed = failedOp(txOps, asyncResult.get())
+        if batchFailed is None:
+            committed.append(batch)
+        return batchFailed
+
+    for batch in batchList:
+        tx, txOps = opTransaction(zk, batch)
+        inFlight.append((batch, txOps, tx.commit_async()))
+
+        if len(inFlight) >= parallel:
+            failed = collect()
+            if failed is not None:
+                break
+
+    while inFlight:
+        failed = collect() or failed
+
+    return failed
+
+
+def commitResumable(zk, ops, markPath, mark, resuming, change=None):
+    '''
+    Commit one logical write too big for one multi request in ordered batches: the first batch creates
+    a mark znode, the last one deletes it together with the change record, so a write stopped halfway is
+    recognized by its mark and finished by a rerun. A rerun skips creates of existing and deletes of
+    missing znodes, those were committed by the stopped run.
+
+    Return None or tuple (failed operation, exception) - batches before the failed one are committed.
+    '''
+
+    if resuming:
+        pathRequests = ((n, 'data', op[1]) for n, op in enumerate(ops) if op[0] in ('create', 'delete'))
+        doneSet      = set(n for n, path, result in pipelinedFetch(zk, pathRequests)
+                           if (result is not None) == (ops[n][0] == 'create'))
+        ops          = [op for n, op in enumerate(ops) if n not in doneSet]
+    else:
+        zk.ensure_path(markPath.rsplit('/', 1)[0])
+        ops = [('create', markPath, mark)] + ops
+
+    ## room for the change record and the generation stamp in the last batch
+    batchList = list(opBatches(ops + [('delete', markPath, -1)], cfg.txnMaxBytes * 3 // 4 - 1024, cfg.txnMaxOps - 2))
+
+    for batch in batchList[:-1]:
+        failed = commitOps(zk, batch)
+        if failed is not None:
+            return failed
+
+    return commitWrite(zk, batchList[-1], change)
+
+
+def commitWrite(zk, ops, change=None):
+    '''
+    Commit one logical write as a single multi request together with the generation stamp bump
+    and its change record appended to the journal.
+    Missing base znodes (hosts, groups, journal, generation) are created and the write is retried once.
+
+    Return None or tuple (failed operation, exception) - nothing is committed then.
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    generationPath = "{}/generation".format(cfg.aPath)
+    basePathList   = ["{}/hosts".format(cfg.aPath), "{}/groups".format(cfg.aPath), journalPath()]
+    generationOp   = ('set_data', generationPath, '')
+    writeOps       = ops + ([journalOp(change)] if change is not None and cfg.journal else []) + [generationOp]
+    results        = []
+
+    failed = commitOps(zk, writeOps, results)
+
+    if failed is not None and isinstance(failed[1], NoNodeError) and (
+            failed[0] is generationOp or (failed[0][0] == 'create' and failed[0][1].rsplit('/', 1)[0] in basePathList)):
+        for basePath in basePathList:
+            zk.ensure_path(basePath)
+        if zk.exists(generationPath) is None:
+            bumpGeneration(zk)
+
+        failed = commitOps(zk, writeOps, results)
+
+    ## generation version counts writes, every journalCompactEvery-th writer compacts the journal
+    if failed is None and len(writeOps) > len(ops) + 1 and results[-1].version % cfg.journalCompactEvery == 0:
+        compactJournal(zk)
+
+    return failed
+
+
+def journalPath(entryName=None):
+    '''
+    Path of the change journal: <aPath>/journal[/<entry>], entries are sequential znodes entry-<token>.
+
+    Return string.
+    '''
+
+    if entryName is None:
+        return "{}/journal".format(cfg.aPath)
+
+    return "{0}/journal/{1}".format(cfg.aPath, entryName)
+
+
+def journalOp(change):
+    '''
+    Transaction operation appending a change record (dict) to the journal as a sequential znode,
+    a record too big for a write request keeps only its strings and is marked for resync.
+
+    Return tuple.
+    '''
+
+    record = json.dumps(change, sort_keys=True)
+
+    if len(record) > cfg.txnMaxBytes // 4:
+        ## too big for the write request: consumers re-read the named host or group, or the whole inventory
+        record = json.dumps(dict([(key, val) for key, val in change.items() if isinstance(val, basestring)],
+                                 resync=True), sort_keys=True)
+
+    return ('create', journalPath('entry-'), record, None, False, True)
+
+
+def journalToken(entryName):
+    '''
+    Return int (position of a journal entry: its sequence number + 1, so 0 is before the first entry).
+    '''
+
+    return int(entryName.rsplit('-', 1)[1]) + 1
+
+
+def compactJournal(zk, keep=None):
+    '''
+    Delete journal entries beyond the newest keep ones, the last deleted position is kept as data
+    of the journal znode, so --changes-since can tell a compacted token from an up to date one.
+
+    Return int (number of deleted entries).
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    keep = cfg.journalSize if keep is None else keep
+
+    try:
+        entryList = sorted(zk.get_children(journalPath()), key=journalToken)
+    except NoNodeError:
+        return 0
+
+    dropList = entryList[:max(len(entryList) - keep, 0)]
+    if len(dropList) == 0:
+        return 0
+
+    ## the compaction mark goes first, a token is never reported valid while its entries are being deleted
+    ops = [('set_data', journalPath(), str(journalToken(dropList[-1])))]
+    ops.extend(('delete', journalPath(entry), -1) for entry in dropList)
+
+    for batch in opBatches(ops):
+        if commitOps(zk, batch) is not None:  ## concurrent compaction got there first
+            break
+
+    return len(dropList)
+
+
+def changesSince(token, window=None):
+    '''
+    Change records appended to the journal after a given position, token 'now' gives the current position only.
+
+    Return dict {"token": last position, "changes": [change, ...]} or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    zk = zkSession.ro()
+
+    if token != 'now' and not str(token).isdigit():
+        return ArgError('BAD_TOKEN', "ERROR  ==> bad journal token: {0} !!! [--changes-since <number>|now]".format(token)).format()
+
+    dataAsync     = zk.get_async(journalPath())
+    childrenAsync = zk.get_children_async(journalPath())
+
+    try:
+        compactedTo = int(dataAsync.get()[0] or 0)
+        entryList   = sorted(childrenAsync.get(), key=journalToken)
+    except NoNodeError:
+        compactedTo, entryList = 0, []
+
+    lastToken = journalToken(entryList[-1]) if len(entryList) > 0 else compactedTo
+
+    if token == 'now':
+        return {'token': lastToken, 'changes': []}
+
+    token = int(token)
+    if token < compactedTo:
+        return ArgError('COMPACTED', "ERROR  ==> changes since: {0} are compacted, journal starts after: {1} !!! dump the inventory again".format(
+            token, compactedTo)).format()
+
+    entryRequests = ((journalToken(entry), 'data', journalPath(entry)) for entry in entryList if journalToken(entry) > token)
+    changeList    = []
+
+    for entryToken, path, result in pipelinedFetch(zk, entryRequests, window):
+        if result is None:  ## compacted meanwhile
+            compactedTo = max(compactedTo, int(zk.get(journalPath())[0] or 0))
+            continue
+        change = json.loads(result[0])
+        change.update(token=entryToken, time=result[1].ctime / 1000.0)
+        changeList.append(change)
+
+    if token < compactedTo:
+        return ArgError('COMPACTED', "ERROR  ==> changes since: {0} are compacted, journal starts after: {1} !!! dump the inventory again".format(
+            token, compactedTo)).format()
+
+    return {'token': max(lastToken, token), 'changes': changeList}
+
+
+def membershipPath(hostName, groupName=None):
+    '''
+    Path of host to groups reverse index entry: <aPath>/memberships/<host>[/<group>].
+
+    Return string.
+    '''
+
+    if groupName is None:
+        return "{0}/memberships/{1}".format(cfg.aPath, hostName)
+
+    return "{0}/memberships/{1}/{2}".format(cfg.aPath, hostName, groupName)
+
+
+def membershipIndexed(zk):
+    '''
+    Check if host to groups reverse index is maintained, an empty inventory starts with one
+    created by its first write (an existing inventory gets it with --reindex). Reads only.
+
+    Return bool.
+    '''
+
+    if zk.exists("{}/memberships".format(cfg.aPath)) is not None:
+        return True
+
+    hostsPath = "{}/hosts".format(cfg.aPath)
+    return zk.exists(hostsPath) is None or len(zk.get_children(hostsPath)) == 0
+
+
+def staleIndexPath(failed):
+    '''
+    Path of the membership index entry a failed multi request tripped over, an entry left
+    over from an interrupted write by an older client.
+
+    Return string or None.
+    '''
+
+    if failed is not None and failed[0][1].startswith("{}/memberships/".format(cfg.aPath)):
+        return failed[0][1]
+
+    return None
+
+
+def staleIndexWarning(stalePath, hostName, groupName):
+    '''
+    Tell on stderr that a host was added without its index entry, the add itself succeeded.
+
+    Return None.
+    '''
+
+    sys.stderr.write("WARNING  ==> stale membership index entry: {0} !!! host: {1} added to group: {2} without the index, run --reindex\n".format(
+        stalePath, hostName, groupName))
+
+
+def hostGroups(zk, hostName, indexed=None):
+    '''
+    Find all groups the host is a member of, from the reverse index or by listing members
+    of every group with pipelined requests when there is no index.
+
+    Return list.
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    if indexed is None:
+        indexed = zk.exists("{}/memberships".format(cfg.aPath)) is not None
+
+    if indexed:
+        try:
+            return sorted(zk.get_children(membershipPath(hostName)))
+        except NoNodeError:
+            return []
+
+    groupList     = zk.get_children('{}/groups'.format(cfg.aPath))
+    groupRequests = ((group, 'children', '{0}/groups/{1}'.format(cfg.aPath, group)) for group in groupList)
+
+    return [group for group, path, hostList in pipelinedFetch(zk, groupRequests)
+            if hostList is not None and hostName in hostList]
+
+
+def rebuildMembershipIndex():
+    '''
+    Rebuild host to groups reverse index from the group tree, only missing and stale entries are written.
+
+    Return string (REINDEXED ... || ERROR ...).
+    '''
+
+    zk = zkSession.rw()
+
+    indexPath = "{}/memberships".format(cfg.aPath)
+    zk.ensure_path("{}/hosts".format(cfg.aPath))
+    zk.ensure_path("{}/groups".format(cfg.aPath))
+
+    hostList  = zk.get_children("{}/hosts".format(cfg.aPath))
+    groupList = zk.get_children("{}/groups".format(cfg.aPath))
+
+    wantedDict = dict((host, set()) for host in hostList)
+    groupRequests = ((group, 'children', '{0}/groups/{1}'.format(cfg.aPath, group)) for group in groupList)
+    for group, path, members in pipelinedFetch(zk, groupRequests):
+        for host in members or []:
+            if host in wantedDict:
+                wantedDict[host].add(group)
+
+    ## current index: host entries and their groups
+    ops = []
+    if zk.exists(indexPath) is None:
+        ops.append(('create', indexPath, ''))
+        indexedList = []
+    else:
+        indexedList = zk.get_children(indexPath)
+
+    currentDict = {}
+    indexRequests = ((host, 'children', membershipPath(host)) for host in indexedList)
+    for host, path, groups in pipelinedFetch(zk, indexRequests):
+        if groups is not None:
+            currentDict[host] = set(groups)
+
+    counts = {'added': 0, 'removed': 0}
+
+    for host in sorted(set(currentDict) - set(wantedDict)):
+        counts['removed'] += len(currentDict[host])
+        ops.extend(('delete', membershipPath(host, group)) for group in sorted(currentDict[host]))
+        ops.append(('delete', membershipPath(host)))
+
+    for host in sorted(wantedDict):
+        if host not in currentDict:
+            ops.append(('create', membershipPath(host), ''))
+        currentGroups = currentDict.get(host, set())
+
+        counts['added']   += len(wantedDict[host] - currentGroups)
+        counts['removed'] += len(currentGroups - wantedDict[host])
+        ops.extend(('create', membershipPath(host, group), '') for group in sorted(wantedDict[host] - currentGroups))
+        ops.extend(('delete', membershipPath(host, group)) for group in sorted(currentGroups - wantedDict[host]))
+
+    ## batches are committed in order, so host entries are always created before their groups
+    for batch in opBatches(ops):
+        failed = commitOps(zk, batch)
+        if failed is not None:
+            return "ERROR  ==> reindex stopped at: {0} {1} !!! rerun to continue".format(
+                failed[0][1], type(failed[1]).__name__)
+
+    return "REINDEXED  ==> hosts: {0} memberships: {1} (added: {2}, removed: {3})".format(
+        len(wantedDict), sum(len(groups) for groups in wantedDict.values()), counts['added'], counts['removed'])
+
+
+def digestPath(hostName=None):
+    '''
+    Path of host digest index entry: <aPath>/digests[/<host>], its data is JSON {hostvar: digest of its value}.
+    Writes keep the entry in the multi request changing the hostvars, version checked, so it is never stale.
+
+    Return string.
+    '''
+
+    if hostName is None:
+        return "{}/digests".format(cfg.aPath)
+
+    return "{0}/digests/{1}".format(cfg.aPath, hostName)
+
+
+def varDigests(varDict):
+    '''
+    Return dict {hostvar: digest of its value} (data of a host digest index entry).
+    '''
+
+    return dict((var, contentDigest(value)) for var, value in varDict.items())
+
+
+def packDigests(varDigestDict):
+    '''
+    Return string (host digest index entry data).
+    '''
+
+    return json.dumps(varDigestDict, sort_keys=True, separators=(',', ':'))
+
+
+def unpackDigests(data):
+    '''
+    Return dict {hostvar: digest} or None (damaged host digest index entry).
+    '''
+
+    try:
+        varDigestDict = json.loads(data)
+    except ValueError:
+        return None
+
+    if not isinstance(varDigestDict, dict):
+        return None
+
+    ## byte strings like the hostvars they were made of
+    return dict((var.encode('utf-8'), digest.encode('utf-8')) for var, digest in varDigestDict.items())
+
+
+def rebuildDigestIndex(window=None):
+    '''
+    Rebuild host digest index from hostvars, only missing, stale and orphaned entries are written
+    (hosts written by an older ansibleKeeper.py have none or stale ones).
+
+    Return string (REINDEXED ... || ERROR ...).
+    '''
+
+    zk = zkSession.rw()
+
+    zk.ensure_path(digestPath())
+    zk.ensure_path("{}/hosts".format(cfg.aPath))
+
+    hostList    = zk.get_children("{}/hosts".format(cfg.aPath))
+    entryList   = zk.get_children(digestPath())
+    wantedDict  = readVarDigests(zk, hostList, window)
+    entryDict   = dict((host, (result[0], result[1].version)) for host, path, result in
+                       pipelinedFetch(zk, ((host, 'data', digestPath(host)) for host in entryList), window)
+                       if result is not None)
+
+    counts = {'added': 0, 'fixed': 0, 'removed': 0}
+    ops    = []
+
+    for host in sorted(set(entryDict) - set(wantedDict)):
+        counts['removed'] += 1
+        ops.append(('delete', digestPath(host), entryDict[host][1]))
+
+    for host in sorted(wantedDict):
+        if host not in entryDict:
+            counts['added'] += 1
+            ops.append(('create', digestPath(host), packDigests(wantedDict[host])))
+        elif unpackDigests(entryDict[host][0]) != wantedDict[host]:
+            counts['fixed'] += 1
+            ops.append(('set_data', digestPath(host), packDigests(wantedDict[host]), entryDict[host][1]))
+
+    for batch in opBatches(ops):
+        failed = commitOps(zk, batch)
+        if failed is not None:
+            return "ERROR  ==> reindex of host digests stopped at: {0} {1} !!! rerun to continue".format(
+                failed[0][1], type(failed[1]).__name__)
+
+    return "REINDEXED  ==> host digests: {0} (added: {1}, fixed: {2}, removed: {3})".format(
+        len(wantedDict), counts['added'], counts['fixed'], counts['removed'])
+
+
+def childrenPath(parentName=None, childName=None):
+    '''
+    Path of group to child groups edges: <aPath>/children[/<parent>[/<child>]].
+    Data of <aPath>/children is rewritten with every edge change, so edge changes are serialized.
+
+    Return string.
+    '''
+
+    path = "{}/children".format(cfg.aPath)
+
+    for name in (parentName, childName):
+        if name is None:
+            break
+        path = "{0}/{1}".format(path, name)
+
+    return path
+
+
+def groupChildren(zk, window=None):
+    '''
+    Read group to child groups edges with pipelined requests, one per parent group.
+
+    Return tuple (dict {parent: [child, ...]}, stat of <aPath>/children or None).
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    try:
+        parentList, stat = zk.get_children(childrenPath(), include_data=True)
+    except NoNodeError:
+        return {}, None
+
+    parentRequests = ((parent, 'children', childrenPath(parent)) for parent in parentList)
+    childDict      = dict((parent, sorted(childList)) for parent, path, childList in pipelinedFetch(zk, parentRequests, window)
+                          if childList)
+
+    return childDict, stat
+
+
+def descendantGroups(childDict, groupName):
+    '''
+    Find all groups below a given group, stopping at cycles.
+
+    Return list (groupname first).
+    '''
+
+    groupList, seen = [groupName], set([groupName])
+
+    for group in groupList:  ## list grows while walking, breadth first
+        for child in childDict.get(group, []):
+            if child not in seen:
+                seen.add(child)
+                groupList.append(child)
+
+    return groupList
+
+
+def flattenGroups(groupDict, childDict):
+    '''
+    Expand every group into its own hosts and hosts of all its descendant groups,
+    memoized so every group is expanded once however deep and wide the hierarchy is.
+
+    Return dict {groupname: [hostname, ...]} (sorted).
+    '''
+
+    flatDict = {}
+
+    def expand(group, path):
+        if group not in flatDict:
+            hostSet = set(groupDict.get(group, []))
+            for child in childDict.get(group, []):
+                if child not in path:  ## cycles are rejected on write, guard against edited trees anyway
+                    hostSet.update(expand(child, path | set([child])))
+            flatDict[group] = sorted(hostSet)
+        return flatDict[group]
+
+    for group in groupDict:
+        expand(group, set([group]))
+
+    return flatDict
+
+
+def groupHosts(zk, groupName, window=None):
+    '''
+    List hosts of a group and of all groups below it, reading only groups of that subtree.
+
+    Return list (sorted).
+    '''
+
+    childDict     = groupChildren(zk, window)[0]
+    groupRequests = ((group, 'children', "{0}/groups/{1}".format(cfg.aPath, group))
+                     for group in descendantGroups(childDict, groupName))
+    groupDict     = dict((group, hostList) for group, path, hostList in pipelinedFetch(zk, groupRequests, window)
+                         if hostList is not None)
+
+    return flattenGroups(groupDict, childDict).get(groupName, [])
+
+
+def childEdgeOps(childDict, rootStat, groupName, newName=None):
+    '''
+    Operations deleting (or moving to newName) all edges of a group, as a parent and as a child.
+
+    Return tuple (list of create ops, list of delete ops).
+    '''
+
+    createOps, deleteOps = [], []
+
+    for parent, childList in sorted(childDict.items()):
+        if parent == groupName:
+            deleteOps.extend(('delete', childrenPath(parent, child), -1) for child in childList)
+            deleteOps.append(('delete', childrenPath(parent), -1))
+            if newName is not None:
+                createOps.append(('create', childrenPath(newName), ''))
+                createOps.extend(('create', childrenPath(newName, child), '') for child in childList)
+
+        elif groupName in childList:
+            deleteOps.append(('delete', childrenPath(parent, groupName), -1))
+            if newName is not None:
+                createOps.append(('create', childrenPath(parent, newName), ''))
+            elif len(childList) == 1:
+                deleteOps.append(('delete', childrenPath(parent), -1))
+
+    if len(deleteOps) > 0:
+        deleteOps.append(('set_data', childrenPath(), '', rootStat.version))
+
+    return createOps, deleteOps
+
+
+def keptGroups(zk, groupList):
+    '''
+    Filter groups which are parents or children of other groups, such a group is kept when its last host goes away.
+    Edges are read only when there is a group to check.
+
+    Return list.
+    '''
+
+    if len(groupList) == 0:
+        return []
+
+    childDict = groupChildren(zk)[0]
+    edgeSet   = set(childDict).union(*childDict.values())
+
+    return [group for group in groupList if group in edgeSet]
+
+
+def addChildGroup(groupPair):
+    '''
+    Add group as a child of another group for a given tuple (parentName, childName), missing groups are created.
+    An edge closing a cycle is rejected, the check and the write are serialized by version of <aPath>/children.
+
+    Return string (ADDED ...) or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    zk = zkSession.rw()
+
+    parentName, childName = groupPair
+
+    if parentName == childName:
+        return ArgError('CHILD_OF_ITSELF', "ERROR  ==> group: {0} can not be a child of itself !!!".format(parentName)).format()
+
+    for attempt in range(3):
+        groupAsyncs = [zk.exists_async("{0}/groups/{1}".format(cfg.aPath, group)) for group in groupPair]
+        childDict, rootStat = groupChildren(zk)
+
+        if childName in childDict.get(parentName, []):
+            return ArgError('CHILD_EXISTS', "ERROR  ==> group: {0} is already a child of group: {1} !!!".format(childName, parentName)).format()
+
+        if parentName in descendantGroups(childDict, childName):
+            return ArgError('CHILD_CYCLE', "ERROR  ==> group: {0} is already below group: {1}, adding group: {1} to group: {0} would create a cycle !!!".format(
+                parentName, childName)).format()
+
+        ops = [('create', "{0}/groups/{1}".format(cfg.aPath, group), '')
+               for group, groupAsync in zip(groupPair, groupAsyncs) if groupAsync.get() is None]
+
+        if rootStat is None:
+            ops.append(('create', childrenPath(), ''))
+        else:
+            ops.append(('set_data', childrenPath(), '', rootStat.version))
+
+        if parentName not in childDict:
+            ops.append(('create', childrenPath(parentName), ''))
+        ops.append(('create', childrenPath(parentName, childName), ''))
+
+        if commitWrite(zk, ops, {'op': 'child', 'group': parentName, 'child': childName}) is None:
+            return "ADDED  ==> group: {0} to group: {1}".format(childName, parentName)
+
+    return ArgError('CONFLICT', "ERROR  ==> groups keep changing, group: {0} not added to group: {1} !!!".format(childName, parentName)).format()
+
+
+def deleteChildGroup(groupPair):
+    '''
+    Remove group from children of another group for a given tuple (parentName, childName), both groups are kept.
+
+    Return string (DELETED ...) or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    zk = zkSession.rw()
+
+    parentName, childName = groupPair
+
+    for attempt in range(3):
+        childDict, rootStat = groupChildren(zk)
+
+        if childName not in childDict.get(parentName, []):
+            return ArgError('CHILD_DOES_NOT_EXIST', "ERROR  ==> group: {0} is not a child of group: {1} !!!".format(childName, parentName)).format()
+
+        ops = [('set_data', childrenPath(), '', rootStat.version), ('delete', childrenPath(parentName, childName), -1)]
+        if len(childDict[parentName]) == 1:
+            ops.append(('delete', childrenPath(parentName), -1))
+
+        if commitWrite(zk, ops, {'op': 'delete', 'group': parentName, 'child': childName}) is None:
+            return "DELETED ==> group: {0} from group: {1}".format(childName, parentName)
+
+    return ArgError('CONFLICT', "ERROR  ==> groups keep changing, group: {0} not deleted from group: {1} !!!".format(childName, parentName)).format()
+
+
+def migrateStorageFormat(targetFormat, batchSize=None):
+    '''
+    Convert hostvars of all hosts in place into targetFormat (legacy|packed),
+    committing batchSize hosts per transaction.
+
+    Return string (ERROR ... || MIGRATED ...).
+    '''
+
+    if targetFormat not in FORMAT_VERSIONS:
+        return "ERROR  ==> no such storage format: {0} !!! [legacy|packed]".format(targetFormat)
+
+    batchSize  = batchSize or cfg.migrateBatch
+    formatPath = "{}/format".format(cfg.aPath)
+
+    zk = zkSession.rw()
+
+    ## switch writers first, so no new hosts are created in the old format meanwhile
+    if zk.exists(formatPath) is None:
+        zk.create(formatPath, FORMAT_VERSIONS[targetFormat], makepath=True)
+    else:
+        zk.set(formatPath, FORMAT_VERSIONS[targetFormat])
+
+    zk.ensure_path("{}/hosts".format(cfg.aPath))
+    hostList = sorted(zk.get_children("{}/hosts".format(cfg.aPath)))
+    migrated, skipped, failedList = 0, 0, []
+
+    for start in range(0, len(hostList), batchSize):
+        batchList = hostList[start:start + batchSize]
+        batchOps  = []
+
+        for host in batchList:
+            hostPath = "{0}/hosts/{1}".format(cfg.aPath, host)
+            ops      = migrateHostOps(zk, hostPath, targetFormat == 'packed')
+            if ops is None:
+                skipped += 1
+            else:
+                batchOps.append((host, ops))
+
+        if len(batchOps) == 0:
+            continue
+
+        if commitOps(zk, [op for host, ops in batchOps for op in ops]) is None:
+            migrated += len(batchOps)
+            continue
+
+        ## a host changed under our feet, retry the batch host by host with fresh reads
+        for host, ops in batchOps:
+            hostPath = "{0}/hosts/{1}".format(cfg.aPath, host)
+            ops      = migrateHostOps(zk, hostPath, targetFormat == 'packed')
+            if ops is None:
+                skipped += 1
+                continue
+
+            if commitOps(zk, ops) is not None:
+                failedList.append(host)
+            else:
+                migrated += 1
+
+    bumpGeneration(zk)
+
+    if len(failedList) > 0:
+        return "ERROR  ==> migrated hosts: {0} to format: {1}, could not migrate hosts: {2} !!!".format(migrated, targetFormat, failedList)
+
+    return "MIGRATED  ==> hosts: {0} to format: {1} (already in format: {2})".format(migrated, targetFormat, skipped)
+
+
+def valueStats(window=None, collect=False):
+    '''
+    Walk stored hostvars with pipelined requests and account stored bytes (znode data including chunks)
+    against raw bytes (the same hostvars uncompressed and unchunked). Chunk sets no hostvar refers to
+    are orphans, with collect those untouched for cfg.chunkGcAge seconds are deleted.
+
+    Return dict.
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    zk = zkSession.rw() if collect else zkSession.ro()
+
+    stats = {'hosts': 0, 'values': 0, 'storedBytes': 0, 'rawBytes': 0, 'compressedValues': 0, 'compressedBlobs': 0,
+             'chunkedValues': 0, 'chunkBytes': 0, 'chunkSets': 0, 'orphanChunkSets': 0}
+    referenced = set()
+
+    def account(value):
+        ## one stored hostvar value: count it, return its raw size
+        stats['values'] += 1
+        if value.startswith(CHUNKED_HEADER):
+            manifest = json.loads(value[len(CHUNKED_HEADER):])
+            stats['chunkedValues'] += 1
+            stats['chunkBytes']    += manifest['size']
+            stats['storedBytes']   += manifest['size']
+            referenced.add(manifest['id'])
+            return manifest['raw']
+        if value.startswith(ZLIB_HEADER):
+            stats['compressedValues'] += 1
+            return len(decodeValue(value))
+        return len(value or '')
+
+    hostList = zk.get_children("{}/hosts".format(cfg.aPath))
+    stats['hosts'] = len(hostList)
+
+    def valueRequests():
+        hostRequests = ((host, 'childrenStat', "{0}/hosts/{1}".format(cfg.aPath, host)) for host in hostList)
+
+        for host, hostPath, result in pipelinedFetch(zk, hostRequests, window):
+            if result is None:
+                continue
+            if result[1].dataLength:
+                yield 'blob', 'data', hostPath
+            for var in result[0]:
+                yield 'var', 'data', "{0}/{1}".format(hostPath, var)
+
+    for kind, path, result in pipelinedFetch(zk, valueRequests(), window):
+        if result is None or result[0] is None:
+            continue
+
+        data = result[0]
+        stats['storedBytes'] += len(data)
+
+        if kind == 'var':
+            stats['rawBytes'] += account(data)
+            continue
+
+        if data.startswith(ZLIB_HEADER):
+            stats['compressedBlobs'] += 1
+        varDict = unpackHostVars(data) or {}
+        stats['rawBytes'] += len(decodeValue(data)) + sum(account(value) - len(value) for value in varDict.values())
+
+    try:
+        chunkSetList = zk.get_children("{}/chunks".format(cfg.aPath))
+    except NoNodeError:
+        chunkSetList = []
+
+    orphanList = [chunkId for chunkId in chunkSetList if chunkId not in referenced]
+    stats['chunkSets'], stats['orphanChunkSets'] = len(chunkSetList), len(orphanList)
+    stats['ratio'] = round(stats['rawBytes'] / float(stats['storedBytes']), 2) if stats['storedBytes'] else 1.0
+
+    if collect:
+        ## a writer renews mtime of a chunk set it reuses, young sets may belong to a write in progress
+        stats['collectedChunkSets'] = 0
+        for chunkId in orphanList:
+            stat = zk.exists(chunkPath(chunkId))
+            if stat is not None and time.time() - stat.mtime / 1000.0 > cfg.chunkGcAge:
+                zk.delete(chunkPath(chunkId), recursive=True)
+                stats['collectedChunkSets'] += 1
+
+    return stats
+
+
+def migrateHostOps(zk, hostPath, packed):
+    '''
+    Prepare version checked transaction operations converting one host into packed or legacy layout.
+
+    Return list of tuples (transaction method, args...) or None (nothing to do).
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    try:
+        data, stat = zk.get(hostPath)
+        varList    = zk.get_children(hostPath)
+
+    except NoNodeError:
+        return None
+
+    packedVars = unpackHostVars(data)
+
+    if packed:
+        if packedVars is not None and len(varList) == 0:
+            return None
+
+        ops     = []
+        varDict = packedVars or {}
+        for var, path, result in pipelinedFetch(zk, ((var, 'data', "{0}/{1}".format(hostPath, var)) for var in varList)):
+            if result is None:
+                continue
+            varDict[var] = decodeValue(result[0])  ## chunked values keep their manifest
+            ops.append(('delete', path, result[1].version))
+
+        ops.append(('set_data', hostPath, packHostVars(varDict), stat.version))
+        return ops
+
+    if packedVars is None:
+        return None
+
+    ops = [('create', "{0}/{1}".format(hostPath, var), packedVars[var]) for var in packedVars if var not in varList]
+    ops.append(('set_data', hostPath, '', stat.version))
+    return ops
+
+
+def bumpGeneration(zk):
+    '''
+    Bump inventory generation stamp in <cfg.aPath>/generation znode after a write,
+    so local inventory caches notice hostvar changes invisible in /hosts and /groups Stat.
+
+    Return None.
+    '''
+
+    from kazoo.exceptions import NoNodeError, NodeExistsError
+
+    generationPath = "{}/generation".format(cfg.aPath)
+
+    try:
+        zk.set(generationPath, '')
+
+    except NoNodeError:
+        try:
+            zk.create(generationPath, '', makepath=True)
+
+        except NodeExistsError:  ## created by a concurrent writer
+            zk.set(generationPath, '')
+
+
+def addHostWithHostvars(znodeDict):
+    '''
+    Add new host with hostvars to group, host, its hostvars and group membership
+    are created with one multi request. Tripping over a stale index entry, the host is added
+    without the index and a WARNING on stderr asks for --reindex.
+
+    Return string (ADDED    ==> host: hostname to group: groupname) or tuple (ArgError: message type, ERROR ...).
+    '''
+  
+    from kazoo.exceptions import NoNodeError, NodeExistsError
+
+    zk = zkSession.rw()
+
+    groupName      = znodeDict.keys()[0]
+    hostName       = znodeDict[groupName].keys()[0]
+    groupPath      = "{0}/groups/{1}".format(cfg.aPath, groupName)
+    hostPath       = "{0}/hosts/{1}".format(cfg.aPath, hostName)
+    hostGroupPath  = "{0}/{1}".format(groupPath, hostName)
+    varDict        = znodeDict[groupName][hostName]
+
+    ERROR_MSGS = {
+        'HOST_EXISTS': "host: {0} exists !!!".format(hostName),
+        'HOST_EXISTS_IN_GROUP': "host: {0} in group {1} exists !!!".format(hostName, groupName)
+    }
+
+    COMMON_MSGS = {
+        'ADDED_HOST_TO_GROUP': "ADDED  ==> host: {0} to group: {1}".format(hostName, groupName)
+    }
+
+    if storageFormat(zk) == 'packed':
+        ops = [('create', hostPath, packHostVars(varDict))]
+    else:
+        ops = [('create', hostPath, '')]
+        ops.extend(('create', "{0}/{1}".format(hostPath, var), varDict[var]) for var in sorted(varDict))
+    ops.append(('create', digestPath(hostName), packDigests(varDigests(varDict))))
+
+    ## optimistic: assume the group exists, add it to the request only when the first attempt says otherwise
+    memberOps = [('create', hostGroupPath, '')]
+
+    if membershipIndexed(zk):
+        memberOps.extend([('create', membershipPath(hostName), ''), ('create', membershipPath(hostName, groupName), '')])
+    change    = {'op': 'add', 'host': hostName, 'group': groupName, 'vars': varDict}
+    failed    = commitWrite(zk, ops + memberOps, change)
+
+    if failed is not None and failed[0][1] == digestPath(hostName):
+        ## no digest index yet, or an entry left behind by a host an older client deleted
+        if isinstance(failed[1], NoNodeError):
+            zk.ensure_path(digestPath())
+        else:
+            ops[-1] = ('set_data', digestPath(hostName), ops[-1][2], -1)
+        failed = commitWrite(zk, ops + memberOps, change)
+
+    groupOps = []
+    if failed is not None and failed[0][1] == hostGroupPath and isinstance(failed[1], NoNodeError):
+        groupOps = [('create', groupPath, '')]
+        failed   = commitWrite(zk, ops + groupOps + memberOps, change)
+
+    if failed is not None and failed[0][1] == membershipPath(hostName) and isinstance(failed[1], NoNodeError):
+        ## first host of an empty inventory, it starts with the index
+        zk.ensure_path("{}/memberships".format(cfg.aPath))
+        failed = commitWrite(zk, ops + groupOps + memberOps, change)
+
+    if failed is not None and failed[0][1] == groupPath and isinstance(failed[1], NodeExistsError):
+        ## group created meanwhile by another writer, also while the index was being created
+        groupOps = []
+        failed   = commitWrite(zk, ops + memberOps, change)
+
+    stalePath = staleIndexPath(failed)
+    if stalePath is not None:
+        ## stale index entry, carry on without the index and leave it to --reindex
+        failed = commitWrite(zk, ops + groupOps + memberOps[:1], change)
+
+    if failed is None and stalePath is not None:
+        staleIndexWarning(stalePath, hostName, groupName)
+
+    if failed is None:
+        return CommonInformer('ADDED_HOST_TO_GROUP',COMMON_MSGS['ADDED_HOST_TO_GROUP']).format()
+
+    elif failed[0][1] == hostPath and isinstance(failed[1], NodeExistsError):
+        return ArgError('HOST_EXISTS',ERROR_MSGS['HOST_EXISTS']).format()
+
+    elif failed[0][1] == hostGroupPath and isinstance(failed[1], NodeExistsError):
+        return ArgError('HOST_EXISTS_IN_GROUP',ERROR_MSGS['HOST_EXISTS_IN_GROUP']).format()
+
+    return ArgError('ADD_FAILED', "ERROR  ==> could not add host: {0} to group: {1}: {2} {3} !!!".format(
+        hostName, groupName, type(failed[1]).__name__, failed[0][1])).format()
+
+
+def addHostToGroup(znodeStringSplited):
+    '''
+    Add host to group with one multi request checking that the host exists, like addHostWithHostvars()
+    without the index when it trips over a stale index entry.
+
+    Return string (ADDED  ==> host: hostname to group: groupname) or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    from kazoo.exceptions import NoNodeError, NodeExistsError
+
+    zk = zkSession.rw()
+
+    groupName, groupPath              = znodeStringSplited[0]
+    hostName, hostPath, hostGroupPath = znodeStringSplited[1]
+
+    ERROR_MSGS = {
+        'HOST_EXISTS_IN_GROUP': "ERROR  ==> host: {0} in group {1} exists !!!".format(hostName, groupName),
+        'HOST_DOES_NOT_EXIST': "ERROR  ==> host: {0} does not exist !!! Could not add non-existent host: {0} to group: {1}".format(hostName, groupName)
+    }
+
+    COMMON_MSGS = {
+        'ADDED_HOST_TO_GROUP': "ADDED  ==> host: {0} to group: {1}".format(hostName, groupName)
+    }
+  
+    memberOps = [('create', hostGroupPath, ''), ('check', hostPath, -1)]
+
+    if membershipIndexed(zk):
+        memberOps.append(('create', membershipPath(hostName, groupName), ''))
+
+    change = {'op': 'member', 'host': hostName, 'group': groupName}
+    failed = commitWrite(zk, memberOps, change)
+
+    groupOps = []
+    if failed is not None and failed[0][1] == hostGroupPath and isinstance(failed[1], NoNodeError):
+        groupOps = [('create', groupPath, '')]
+        failed   = commitWrite(zk, groupOps + memberOps, change)
+
+    if failed is not None and failed[0][1] == membershipPath(hostName, groupName) and isinstance(failed[1], NoNodeError):
+        ## host added by an older client without its index entry
+        memberOps.insert(2, ('create', membershipPath(hostName), ''))
+        failed = commitWrite(zk, groupOps + memberOps, change)
+
+    if failed is not None and failed[0][1] == groupPath and isinstance(failed[1], NodeExistsError):
+        ## group created meanwhile by another writer, also while the index entry was being added
+        groupOps = []
+        failed   = commitWrite(zk, memberOps, change)
+
+    stalePath = staleIndexPath(failed)
+    if stalePath is not None:
+        ## stale index entry, carry on without the index and leave it to --reindex
+        failed = commitWrite(zk, groupOps + memberOps[:2], change)
+
+    if failed is None and stalePath is not None:
+        staleIndexWarning(stalePath, hostName, groupName)
+
+    if failed is None:
+        return CommonInformer('ADDED_HOST_TO_GROUP',COMMON_MSGS['ADDED_HOST_TO_GROUP']).format()
+
+    elif failed[0][1] == hostGroupPath and isinstance(failed[1], NodeExistsError):
+        return ArgError('HOST_EXISTS_IN_GROUP',ERROR_MSGS['HOST_EXISTS_IN_GROUP']).format()
+
+    elif failed[0][1] == hostPath and isinstance(failed[1], NoNodeError):
+        return ArgError('HOST_DOES_NOT_EXIST',ERROR_MSGS['HOST_DOES_NOT_EXIST']).format()
+
+    return ArgError('ADD_FAILED', "ERROR  ==> could not add host: {0} to group: {1}: {2} {3} !!!".format(
+        hostName, groupName, type(failed[1]).__name__, failed[0][1])).format()
+
+
+def deleteZnodeRecur(znodeStringSplited, dryRun=False):
+    '''
+    Delete znode recursivelly for a given string groupname or hosts:hostname or groupname:hostname,
+    group memberships and reverse index entries are deleted together with one multi request.
+    A delete too big for one multi request removes leaves (group members with their index entries, hostvars)
+    in batches with cfg.deleteParallel multi requests in flight, the group or host znode itself goes last,
+    so an interrupted delete is finished by running it again. dryRun only counts znodes to be removed.
+
+    Return string (DELETED||DRY RUN ==> [host: hostname || group: groupname]) or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    zk = zkSession.rw()
+
+    if len(znodeStringSplited) > 1:  ## check if it is <groupname:hostname> case
+        groupName, groupPath              = znodeStringSplited[0]
+        hostName, hostPath, hostGroupPath = znodeStringSplited[1]
+
+    elif len(znodeStringSplited) == 1 and len(znodeStringSplited[0]) == 2:  ## <groupname> case
+        groupName, groupPath = znodeStringSplited[0]
+        hostName             = None
+
+    elif len(znodeStringSplited) == 1:  ## <hosts:hostname> case
+        hostName, hostPath, notUsedValue = znodeStringSplited[0]
+        groupName                        = None
+
+    else:  ## Unknown cases        
+        return ArgError('SYNTAX_ERROR', "ERROR with processing znodeStrings !!!").format()
+
+    ERROR_MSGS = {
+        'HOST_DOES_NOT_EXIST': "ERROR  ==> could not delete host: {0} that does not exist !!!".format(hostName),
+        'HOST_DOES_NOT_EXISTS_IN_GROUP': "ERROR  ==> could not delete host: {0} that does not exist in group: {1} !!!".format(hostName, groupName),
+        'GROUP_DOES_NOT_EXIST': "ERROR  ==> could not delete group: {0} that does not exist !!!".format(groupName)
+    }
+
+    COMMON_MSGS = {
+        'DELETED_HOST_IN_GROUP': "DELETED ==> host: {0} in group: {1}".format(hostName, groupName),
+        'DELETED_GROUP': "DELETED ==> group: {0}".format(groupName),
+        'DELETED_HOST': "DELETED ==> host: {0}".format(hostName)
+    }
+
+    indexed   = zk.exists("{}/memberships".format(cfg.aPath)) is not None
+    committed = []  ## batches of a too big delete already removed by earlier attempts
+
+    for attempt in range(3):
+        if len(znodeStringSplited) > 1:
+            hostAsync  = zk.exists_async(hostPath)
+            groupAsync = zk.get_children_async(groupPath, include_data=True)
+
+            if hostAsync.get() is None:
+                return ArgError('HOST_DOES_NOT_EXIST',ERROR_MSGS['HOST_DOES_NOT_EXIST']).format()
+
+            try:
+                memberList, groupStat = groupAsync.get()
+            except NoNodeError:
+                memberList, groupStat = [], None
+
+            if hostName not in memberList:
+                return ArgError('HOST_DOES_NOT_EXISTS_IN_GROUP',ERROR_MSGS['HOST_DOES_NOT_EXISTS_IN_GROUP']).format()
+
+            leafOps = []
+            ops     = [('delete', hostGroupPath, -1)]
+            if len(memberList) == 1 and groupStat.dataLength == 0 and keptGroups(zk, [groupName]) == []:
+                ## delete group if there is only one host in it, no group vars and no parent or child groups
+                ops.append(('delete', groupPath, groupStat.version))
+            if indexed:
+                ops.append(('delete', membershipPath(hostName, groupName), -1))
+
+            deletedMsg = CommonInformer('DELETED_HOST_IN_GROUP',COMMON_MSGS['DELETED_HOST_IN_GROUP']).format()
+            change     = {'op': 'delete', 'host': hostName, 'group': groupName}
+
+        elif hostName is None:
+            try:
+                memberList = zk.get_children(groupPath)
+            except NoNodeError:
+                return ArgError('GROUP_DOES_NOT_EXIST',ERROR_MSGS['GROUP_DOES_NOT_EXIST']).format()
+
+            ## a member and its index entry are one leaf, they are never split between batches
+            leafOps = [(host, [('delete', "{0}/{1}".format(groupPath, host), -1)] +
+                              ([('delete', membershipPath(host, groupName), -1)] if indexed else []))
+                       for host in sorted(memberList)]
+            ops     = [('delete', groupPath, -1)]
+
+            childDict, rootStat = groupChildren(zk)
+            ops.extend(childEdgeOps(childDict, rootStat, groupName)[1])
+
+            deletedMsg = CommonInformer('DELETED_GROUP',COMMON_MSGS['DELETED_GROUP']).format()
+            change     = {'op': 'delete', 'group': groupName}
+
+        else:
+            try:
+                hostVarList = zk.get_children(hostPath)
+            except NoNodeError:
+                return ArgError('HOST_DOES_NOT_EXIST',ERROR_MSGS['HOST_DOES_NOT_EXIST']).format()
+
+            ## only the groups the host is in are touched, a group left empty without group vars is deleted as well
+            groupList     = hostGroups(zk, hostName, indexed)
+            groupRequests = ((group, 'childrenStat', "{0}/groups/{1}".format(cfg.aPath, group)) for group in groupList)
+
+            leafOps = [(var, [('delete', "{0}/{1}".format(hostPath, var), -1)]) for var in sorted(hostVarList)]
+            ops     = [('delete', hostPath, -1)]
+
+            emptiedList = []
+
+            for group, path, result in pipelinedFetch(zk, groupRequests):
+                if result is None or hostName not in result[0]:
+                    continue
+                ops.append(('delete', "{0}/{1}".format(path, hostName), -1))
+                if len(result[0]) == 1 and result[1].dataLength == 0:
+                    emptiedList.append((group, path, result[1].version))
+                if indexed:
+                    ops.append(('delete', membershipPath(hostName, group), -1))
+
+            keptList = keptGroups(zk, [group for group, path, version in emptiedList])
+            ops.extend(('delete', path, version) for group, path, version in emptiedList if group not in keptList)
+
+            ## host index entries in one round trip
+            entryList   = ([membershipPath(hostName)] if indexed else []) + [digestPath(hostName)]
+            entryAsyncs = [(path, zk.exists_async(path)) for path in entryList]
+            ops.extend(('delete', path, -1) for path, entryAsync in entryAsyncs if entryAsync.get() is not None)
+
+            deletedMsg = CommonInformer('DELETED_HOST',COMMON_MSGS['DELETED_HOST']).format()
+            change     = {'op': 'delete', 'host': hostName}
+
+        ## room for the change record and the generation stamp
+        allOps    = [op for leaf, opList in leafOps for op in opList] + ops
+        batchList = [[op for leaf, opList in batch for op in opList]
+                     for batch in hostOpBatches(leafOps, cfg.txnMaxBytes * 3 // 4 - 1024, cfg.txnMaxOps - 2)]
+        oneBatch  = len(list(opBatches(allOps, cfg.txnMaxBytes * 3 // 4 - 1024, cfg.txnMaxOps - 2))) == 1
+
+        if dryRun:
+            return "DRY RUN  ==> delete {0} would remove znodes: {1} in multi requests: {2}".format(
+                deletedMsg[1].split('==> ', 1)[1], len([op for op in allOps if op[0] == 'delete']),
+                1 if oneBatch else len(batchList) + 1)
+
+        if oneBatch:
+            failed = commitWrite(zk, allOps, change)
+        else:
+            ## too big for one multi request: leaves first, the parent znode goes last
+            failed = commitBatches(zk, batchList, committed=committed)
+            if failed is None:
+                failed = commitWrite(zk, ops, change)
+            else:
+                commitWrite(zk, [], change)  ## partly done counts as changed
+
+        if failed is None:
+            return deletedMsg
+
+        if failed[0][1].startswith("{}/memberships/".format(cfg.aPath)) and isinstance(failed[1], NoNodeError):
+            ## stale index entry, carry on without the index and leave it to --reindex
+            indexed = False
+
+    if len(committed) > 0:
+        return ArgError('CONFLICT', "ERROR  ==> {0} keeps changing during delete, removed znodes: {1} in multi requests: {2} !!! rerun to finish the delete".format(
+            hostName or groupName, sum(len(batch) for batch in committed), len(committed))).format()
+
+    return ArgError('CONFLICT', "ERROR  ==> {0} keeps changing during delete, nothing deleted !!!".format(hostName or groupName)).format()
+
+
+def hostUpdateOps(hostPath, data, stat, hostVarList, varDict, digestResult=None):
+    '''
+    Prepare version checked transaction operations setting existing hostvars of one host,
+    packed host is set as a whole, legacy host gets its hostvar znodes set and a check of the host znode.
+    The host digest index entry read with them (digestResult: data and stat) is set version checked as well,
+    a host without one is left to readers and --reindex.
+
+    Return tuple (list of tuples (transaction method, args...), dict with updated hostvars, list of nonexistent hostvars).
+    '''
+
+    packedVars   = unpackHostVars(data)  ## packed host: all hostvars live in the host znode
+    nonExistList = []
+    updatedDict  = {}
+    ops          = []
+
+    if packedVars is not None:
+        hostVarList = packedVars.keys()
+
+    for var in varDict:
+        if var in hostVarList: ## check if given variable exists
+            if packedVars is not None:
+                packedVars[var] = varDict[var]
+            else:
+                ops.append(('set_data', "{0}/{1}".format(hostPath, var), varDict[var]))
+            updatedDict[var] = varDict[var]
+
+        else:
+            nonExistList.append(var)
+
+    if len(updatedDict) > 0:
+        if packedVars is not None:
+            ops.append(('set_data', hostPath, packHostVars(packedVars), stat.version))
+        else:
+            ops.append(('check', hostPath, stat.version))
+
+    varDigestDict = unpackDigests(digestResult[0]) if digestResult is not None else None
+    if len(updatedDict) > 0 and varDigestDict is not None:
+        varDigestDict.update(varDigests(updatedDict))
+        ops.append(('set_data', digestPath(hostPath.rsplit('/', 1)[1]), packDigests(varDigestDict), digestResult[1].version))
+
+    return ops, updatedDict, nonExistList
+
+
+def updateMessage(hostName, updatedDict, nonExistList):
+    '''
+    Return string (UPDATED ... || NOT UPDATED ...) for one updated host.
+    '''
+
+    if len(nonExistList) > 0 and len(updatedDict) == 0:
+        return "NOT UPDATED  ==> host: {0} with no existing hostvars {1} ===> NOT UPDATED hostvars {2} which do not exist".format(hostName, updatedDict, nonExistList)
+
+    elif len(nonExistList) and len(updatedDict) > 0:
+        return "UPDATED  ==> host: {0} with new hostvars {1} ===> NOT UPDATED hostvars {2} which do not exist".format(hostName, updatedDict, nonExistList)
+    
+    else:
+        return "UPDATED  ==> host: {0} with new hostvars {1}".format(hostName, updatedDict)
+
+
+def updateZnode(znodeDict):
+    '''
+    Update znode with hostvars, all hostvars are set with one multi request,
+    host znode is version checked and the update is retried when it changed meanwhile.
+
+    Return string (UPDATED ... || NOT UPDATED ...) or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    zk = zkSession.rw()
+    
+    groupName   = znodeDict.keys()[0]
+    hostName    = znodeDict[groupName].keys()[0]
+    hostPath    = "{0}/hosts/{1}".format(cfg.aPath, hostName)
+
+    for attempt in range(3):
+        ## host blob, hostvar list and digest index entry in one round trip
+        hostAsync     = zk.get_async(hostPath)
+        childrenAsync = zk.get_children_async(hostPath)
+        digestAsync   = zk.get_async(digestPath(hostName))
+
+        try:
+            data, stat  = hostAsync.get()
+            hostVarList = childrenAsync.get()
+
+        except NoNodeError:
+            return ArgError('HOST_DOES_NOT_EXIST', "ERROR  ==> could not update host: {0} that does not exist !!!".format(hostName)).format()
+
+        try:
+            digestResult = digestAsync.get()
+        except NoNodeError:
+            digestResult = None
+
+        ops, updatedDict, nonExistList = hostUpdateOps(hostPath, data, stat, hostVarList, znodeDict[groupName][hostName],
+                                                       digestResult)
+
+        if len(ops) == 0 or commitWrite(zk, ops, {'op': 'update', 'host': hostName, 'vars': updatedDict}) is None:
+            break
+
+    else:
+        return ArgError('CONFLICT', "ERROR  ==> host: {0} keeps changing during update, nothing updated !!!".format(hostName)).format()
+
+    return updateMessage(hostName, updatedDict, nonExistList)
+
+
+def updateGroupHosts(groupVarTuple, limit=None, window=None):
+    '''
+    Update hostvars of all hosts of a group (and of groups below it) for a given tuple (groupName, groupPath, varDict),
+    group all means every host, a --limit pattern narrows the hosts further.
+    Hosts are read with pipelined requests and updated with batched multi requests, every host version checked;
+    hosts of a batch that failed are updated one by one with fresh reads.
+
+    Return list of strings (one ERROR ... || UPDATED ... || NOT UPDATED ... per host, summary last: tuple (ArgError: message type, ERROR ...) if any host failed).
+    '''
+
+    zk = zkSession.rw()
+
+    groupName, groupPath, varDict = groupVarTuple
+
+    if len(varDict) == 0:
+        return [ArgError('NO_VARS', "ERROR  ==> no hostvars given for hosts of group: {0} !!! [-U groupname,var1:val1,var2:val2]".format(groupName)).format()]
+
+    zk.ensure_path("{}/hosts".format(cfg.aPath))
+    zk.ensure_path("{}/groups".format(cfg.aPath))
+
+    if groupName != 'all' and zk.exists(groupPath) is None:
+        return [ArgError('GROUP_DOES_NOT_EXIST', "ERROR  ==> could not update hosts of group: {0} that does not exist !!!".format(groupName)).format()]
+
+    if limit is not None:
+        ## the pattern needs every group, the group target comes out of the same listing
+        hostList      = zk.get_children("{}/hosts".format(cfg.aPath))
+        groupRequests = ((group, 'children', "{0}/groups/{1}".format(cfg.aPath, group))
+                         for group in zk.get_children("{}/groups".format(cfg.aPath)))
+        groupDict     = dict((group, members) for group, path, members in pipelinedFetch(zk, groupRequests, window)
+                             if members is not None)
+        childDict     = groupChildren(zk, window)[0]
+
+        hostSet  = limitSelection(limit, groupDict, childDict, hostList)[0]
+        hostSet &= matchLimitTerm(groupName, flattenGroups(groupDict, childDict), hostList)
+        hostList = sorted(hostSet)
+
+    elif groupName == 'all':
+        hostList = sorted(zk.get_children("{}/hosts".format(cfg.aPath)))
+
+    else:
+        hostList = groupHosts(zk, groupName, window)
+
+    ## host znodes first: packed hosts are complete, legacy hosts need their hostvar list as well
+    hostRequests = ((host, 'data', "{0}/hosts/{1}".format(cfg.aPath, host)) for host in hostList)
+    hostResults  = dict((host, result) for host, path, result in pipelinedFetch(zk, hostRequests, window))
+
+    legacyRequests = ((host, 'children', "{0}/hosts/{1}".format(cfg.aPath, host)) for host in hostList
+                      if hostResults[host] is not None and unpackHostVars(hostResults[host][0]) is None
+                      and hostResults[host][1].numChildren > 0)
+    legacyResults  = dict((host, varList) for host, path, varList in pipelinedFetch(zk, legacyRequests, window))
+
+    digestRequests = ((host, 'data', digestPath(host)) for host in hostList if hostResults[host] is not None)
+    digestResults  = dict((host, result) for host, path, result in pipelinedFetch(zk, digestRequests, window))
+
+    messageDict = {}
+    hostOps     = []
+    updatedDict = {}
+
+    for host in hostList:
+        if hostResults[host] is None:
+            messageDict[host] = "ERROR  ==> could not update host: {0} that does not exist !!!".format(host)
+            continue
+
+        data, stat = hostResults[host]
+        ops, updatedDict[host], nonExistList = hostUpdateOps("{0}/hosts/{1}".format(cfg.aPath, host), data, stat,
+                                                             legacyResults.get(host) or [], varDict, digestResults.get(host))
+        messageDict[host] = updateMessage(host, updatedDict[host], nonExistList)
+        if len(ops) > 0:
+            hostOps.append((host, ops))
+
+    ## room for the change record and the generation stamp of every batch
+    requestCount = 0
+    for batch in hostOpBatches(hostOps, cfg.txnMaxBytes * 3 // 4 - 1024, cfg.txnMaxOps - 2):
+        requestCount += 1
+        change = {'op': 'update', 'group': groupName, 'hosts': dict((host, updatedDict[host]) for host, ops in batch)}
+
+        if commitWrite(zk, [op for host, ops in batch for op in ops], change) is None:
+            continue
+
+        ## a host changed under our feet, retry the batch host by host with fresh reads
+        for host, ops in batch:
+            requestCount += 1
+            messageDict[host] = resultMessage(updateZnode({groupName: {host: varDict}}))
+
+    counts = {'UPDATED': 0, 'NOT UPDATED': 0, 'ERROR': 0}
+    for message in messageDict.values():
+        counts[message.split('  ==>')[0]] += 1
+
+    summary = "{0}  ==> hosts of group: {1}: {2} (updated: {3}, not updated: {4}, failed: {5}) in multi requests: {6}".format(
+        'ERROR' if counts['ERROR'] else 'UPDATED', groupName, len(hostList), counts['UPDATED'], counts['NOT UPDATED'],
+        counts['ERROR'], requestCount)
+
+    if counts['ERROR']:
+        summary = ArgError('HOSTS_FAILED', summary + " !!!").format()
+
+    return [messageDict[host] for host in hostList] + [summary]
+
+
+def renameMarkPath(oldPath):
+    '''
+    Path of the mark of a rename too big for one multi request: <aPath>/renames/<hosts|groups>:<oldname>,
+    its data is the new name.
+
+    Return string.
+    '''
+
+    return "{0}/renames/{1}".format(cfg.aPath, oldPath[len(cfg.aPath) + 1:].replace('/', ':', 1))
 
-        nonExistList = []    
-        updatedDict  = {}
-    
-        for var in znodeDict[groupName][hostName]:
-            varPath = "{0}/{1}".format(hostPath, var)
-            varVal  = znodeDict[groupName][hostName][var]
         
-            if var in hostVarList: ## check if given variable exists
-                zk.set(varPath, varVal)
-                updatedDict[var] = varVal
+def renameZnode(znodeRenameStringSplited):
+    '''
+    Rename znode for a given tuple of ((oldName, oldPath), (newName, newPath)).
+    Copy and delete are committed with one multi request, so a failed rename leaves nothing behind.
+    A rename too big for one multi request copies first and deletes last in ordered batches under
+    a rename mark, a stopped one is finished by rerunning the same rename.
+
+    Return string (RENAMED ... || NOT RENAMED ...) or tuple (ArgError: message type, ERROR ...).
+    '''
+    
+    from kazoo.exceptions import NoNodeError, NodeExistsError
+
+    zk = zkSession.rw()
+
+    oldName, oldPath  = znodeRenameStringSplited[0]
+    newName, newPath  = znodeRenameStringSplited[1]
+
+    if 'hosts' not in oldPath and 'groups' not in oldPath:
+        return "ERROR no valid keywords <groups|hosts> found"
+
+    indexed  = zk.exists("{}/memberships".format(cfg.aPath)) is not None
+    markPath = renameMarkPath(oldPath)
+
+    for attempt in range(3):
+        try:
+            mark = zk.get(markPath)[0]
+        except NoNodeError:
+            mark = None
+
+        if mark is not None and mark != newName:
+            return ArgError('RENAME_HALF_DONE', "ERROR  ==> rename of {0} to: {1} is half done !!! rerun it to finish it first".format(oldPath, mark)).format()
+
+        resuming = mark is not None
+
+        oldAsync      = zk.get_async(oldPath)
+        childrenAsync = zk.get_children_async(oldPath)
+
+        try:
+            data, stat    = oldAsync.get()
+            oldChildren   = childrenAsync.get()
+
+        except NoNodeError:
+            return ArgError('PATH_DOES_NOT_EXIST', "ERROR  ==> could not rename nonexistent path: {0} !!!".format(oldPath)).format()
+
+        if 'hosts' in oldPath:
+            ## create newPath in hosts, copy hostvars from oldPath and move host in all its groups
+            oldDigestAsync = zk.get_async(digestPath(oldName))
+            newDigestAsync = zk.exists_async(digestPath(newName))
+
+            ops = [('create', newPath, data)]
+            delOps = []
+
+            if newDigestAsync.get() is not None and not resuming:
+                ## entry left behind by a host an older client deleted
+                ops.append(('delete', digestPath(newName), -1))
+            try:
+                digestData, digestStat = oldDigestAsync.get()
+                ops.append(('create', digestPath(newName), digestData))
+                delOps.append(('delete', digestPath(oldName), digestStat.version))
+            except NoNodeError:  ## written by an older client or moved by the stopped run
+                pass
+
+            for var, varPath, result in pipelinedFetch(zk, ((var, 'data', '{0}/{1}'.format(oldPath, var)) for var in oldChildren)):
+                if result is not None:
+                    ops.append(('create', '{0}/{1}'.format(newPath, var), result[0]))
+                    delOps.append(('delete', varPath, result[1].version))
+
+            groupList = hostGroups(zk, oldName, indexed and not resuming)  ## index entries may be half moved
+            if indexed:
+                ops.append(('create', membershipPath(newName), ''))
+
+            for group in groupList:
+                if cfg.debug:
+                    sys.stderr.write("DEBUG  ==> found: {0}/groups/{1}/{2}\n".format(cfg.aPath, group, oldName))
+                ops.append(('create', '{0}/groups/{1}/{2}'.format(cfg.aPath, group, newName), ''))
+                delOps.append(('delete', '{0}/groups/{1}/{2}'.format(cfg.aPath, group, oldName), -1))
+                if indexed:
+                    ops.append(('create', membershipPath(newName, group), ''))
+                    delOps.append(('delete', membershipPath(oldName, group), -1))
+
+            if indexed and resuming:
+                try:
+                    staleList = [group for group in zk.get_children(membershipPath(oldName)) if group not in groupList]
+                except NoNodeError:
+                    staleList = []
+                delOps.extend(('delete', membershipPath(oldName, group), -1) for group in staleList)
+            if indexed:
+                delOps.append(('delete', membershipPath(oldName), -1))
+            delOps.append(('delete', oldPath, stat.version))
+            renamedMsg = "RENAMED {0} --> {1}".format(oldName, newName)
+            change     = {'op': 'rename', 'host': oldName, 'to': newName}
+
+        else:
+            ## look for hosts in the group, create new group with the same members and delete the old one
+            ops    = [('create', newPath, data)]
+            ops.extend(('create', '{0}/{1}'.format(newPath, child), '') for child in oldChildren)
+            delOps = [('delete', '{0}/{1}'.format(oldPath, child), -1) for child in oldChildren]
+            delOps.append(('delete', oldPath, stat.version))
+            if indexed:
+                ops.extend(('create', membershipPath(child, newName), '') for child in oldChildren)
+                delOps.extend(('delete', membershipPath(child, oldName), -1) for child in oldChildren)
+
+            ## parent and child group edges move with the group
+            childDict, rootStat = groupChildren(zk)
+            edgeOps = childEdgeOps(childDict, rootStat, oldName, newName)
+            ops.extend(edgeOps[0])
+            delOps.extend(edgeOps[1])
+            renamedMsg = "RENAMED group {0} --> {1}".format(oldName, newName)
+            change     = {'op': 'rename', 'group': oldName, 'to': newName}
+
+        if resuming or len(list(opBatches(ops + delOps, cfg.txnMaxBytes * 3 // 4 - 1024, cfg.txnMaxOps - 2))) > 1:
+            ## too big for one multi request: copy first and delete last, so nothing is ever lost
+            failed = commitResumable(zk, ops + delOps, markPath, newName, resuming, change)
+        else:
+            failed = commitWrite(zk, ops + delOps, change)
+
+        if failed is None:
+            return renamedMsg
+
+        if failed[0][1] == newPath and isinstance(failed[1], NodeExistsError):
+            return ArgError('NEW_PATH_EXISTS', "ERROR  ==> new path already exist: {0} !!!".format(newPath)).format()
+
+        if failed[0][1].startswith("{}/memberships/".format(cfg.aPath)):
+            ## stale index entry, carry on without the index and leave it to --reindex
+            indexed = False
+
+    if zk.exists(markPath) is not None:
+        return ArgError('RENAME_HALF_DONE', "ERROR  ==> rename of {0} to: {1} is half done: {2} {3} !!! rerun it to finish".format(
+            oldPath, newName, type(failed[1]).__name__, failed[0][1])).format()
+
+    return ArgError('CONFLICT', "ERROR  ==> {0} keeps changing during rename, nothing renamed !!!".format(oldPath)).format()
+
+            
+            
+def updateGroupVars(groupVarTuple):
+    '''
+    Set or update group vars for a given tuple (groupName, groupPath, varDict), a missing group is created.
+    Group vars live in the group znode and are set with a version check, retried when changed meanwhile.
+
+    Return string (ADDED ... || UPDATED ...) or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    zk = zkSession.rw()
+
+    groupName, groupPath, varDict = groupVarTuple
+
+    if len(varDict) == 0:
+        return ArgError('NO_VARS', "ERROR  ==> no group vars given for group: {0} !!! [groupname,var1:value1,var2:value2]".format(groupName)).format()
+
+    for attempt in range(3):
+        try:
+            data, stat = zk.get(groupPath)
+
+        except NoNodeError:
+            if commitWrite(zk, [('create', groupPath, packHostVars(varDict))], {'op': 'groupvars', 'group': groupName, 'vars': varDict}) is None:
+                return "ADDED  ==> group: {0} with group vars {1}".format(groupName, varDict)
+            continue
+
+        mergedVars = groupVars(data)
+        mergedVars.update(varDict)
+
+        if commitWrite(zk, [('set_data', groupPath, packHostVars(mergedVars), stat.version)],
+                       {'op': 'groupvars', 'group': groupName, 'vars': varDict}) is None:
+            return "UPDATED  ==> group: {0} with new group vars {1}".format(groupName, varDict)
+
+    return ArgError('CONFLICT', "ERROR  ==> group: {0} keeps changing during update, nothing updated !!!".format(groupName)).format()
+
+
+def showGroupVars(groupName):
+    '''
+    Show group vars for a given groupname.
+
+    Return dict or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    zk = zkSession.ro()
+
+    try:
+        return groupVars(zk.get("{0}/groups/{1}".format(cfg.aPath, groupName))[0])
+
+    except NoNodeError:
+        return ArgError('GROUP_DOES_NOT_EXIST', "ERROR  ==> no such groupname: {0} !!!".format(groupName)).format()
+
+
+def showHostVars(znodeStringSplited):
+    '''
+    Show hostvars for a given hosts:hostname or groupname.
+    
+    Return dict or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    zk = zkSession.ro()
+
+    if len(znodeStringSplited[0]) == 2:    ## check for groupname only
+
+        groupName, groupPath = znodeStringSplited[0]
+
+        if zk.exists(groupPath) is None:
+            return ArgError('GROUP_DOES_NOT_EXIST', "ERROR  ==> no such groupname: {0} !!!".format(groupName)).format()
+
+        else:
+            hostList    = groupHosts(zk, groupName)  ## hosts of child groups included
+            varDict     = {}
+
+            for host in hostList:             ## build a dict with host variables
+                tmpHostPath    = "{0}/hosts/{1}".format(cfg.aPath, host)
+                varDict[host]  = readHostVars(zk, tmpHostPath) or {}
+
+            return varDict
+                
+    elif len(znodeStringSplited[0]) == 3:     ## check for hostname only   
+
+        hostName, hostPath, notUsedValue =  znodeStringSplited[0]
+
+        valDict = readHostVars(zk, hostPath)  ## one get for packed hosts
+
+        if valDict is None:
+            return ArgError('HOST_DOES_NOT_EXIST', "ERROR  ==> no such host: {0} !!!".format(hostName)).format()
+
+        else:
+            return {hostName: valDict}
+
+    else:
+        return ArgError('SYNTAX_ERROR', "ERROR with processing znodeStrings !!!").format()
+
+
+def inventoryDump(dumpMode):
+    '''
+    User friendly inventory dump for all|groups modes.
+    
+    Return dict or list.
+    '''
+
+    zk = zkSession.ro()
+
+    # from ipdb import set_trace; set_trace()
+    hostsList  = sorted(zk.get_children("{}/hosts".format(cfg.aPath)))
+    groupsList = sorted(zk.get_children("{}/groups".format(cfg.aPath)))
+    dumpDict   = {"hosts": hostsList}
+
+    tmpList = []
+
+    if dumpMode == 'hosts':
+        return hostsList
+
+    elif dumpMode == 'groups':
+        return groupsList
+
+    elif dumpMode == 'all':
+        ## groups list hosts of their child groups too, every group is expanded once
+        groupRequests = ((group, 'children', "{0}/groups/{1}".format(cfg.aPath, group)) for group in groupsList)
+        groupDict     = dict((group, hostList) for group, path, hostList in pipelinedFetch(zk, groupRequests)
+                             if hostList is not None)
+        flatDict      = flattenGroups(groupDict, groupChildren(zk)[0])
+
+        for group in groupsList:
+            if group in flatDict:
+                tmpList.append({group: flatDict[group]})
             
+            dumpDict["groups"] = tmpList
+
+        return dumpDict
+
+
+def pipelinedFetch(zk, requests, window=None):
+    '''
+    Pipeline async zookeeper reads for an iterable of (tag, method, path) requests,
+    where method is children|childrenStat|data, keeping at most window requests in flight.
+    Method None sends nothing and just passes the tag through in request order.
+
+    Return generator of tuples (tag, path, result) in request order, result is None for vanished znodes.
+    '''
+
+    from collections import deque
+    from kazoo.exceptions import NoNodeError
+
+    ## results are collected oldest first, so the output order is deterministic while
+    ## up to window requests are waiting for their responses from the ensemble
+
+    window   = window or cfg.asyncWindow
+    inFlight = deque()
+
+    def collect():
+        tag, path, asyncResult = inFlight.popleft()
+        if asyncResult is None:
+            return tag, path, None
+
+        try:
+            return tag, path, asyncResult.get()
+
+        except NoNodeError:  ## znode deleted between listing and fetching
+            return tag, path, None
+
+    for tag, method, path in requests:
+        if method is None:
+            inFlight.append((tag, path, None))
+        elif method == 'children':
+            inFlight.append((tag, path, zk.get_children_async(path)))
+        elif method == 'childrenStat':
+            inFlight.append((tag, path, zk.get_children_async(path, include_data=True)))
+        else:
+            inFlight.append((tag, path, zk.get_async(path)))
+
+        if len(inFlight) >= window:
+            yield collect()
+
+    while inFlight:
+        yield collect()
+
+
+def splitLimitPattern(limitPattern):
+    '''
+    Parse ansible style --limit pattern: terms separated by commas (or colons when there is no comma),
+    &term intersects, !term excludes, a term is all, a group, a host, a glob or ~regex.
+
+    Return list of tuples (operator, term) or string (SYNTAX ERROR).
+    '''
+
+    ## example string: dc1-kafka:&dc1:!kafka03*
+    ## desired list  : [("", "dc1-kafka"), ("&", "dc1"), ("!", "kafka03*")]
+
+    separator = ',' if ',' in limitPattern else ':'
+    termList  = []
+
+    for term in [term.strip() for term in limitPattern.split(separator) if term.strip()]:
+        operator = term[0] if term[0] in '&!' else ''
+        term     = term[len(operator):]
+
+        if term.startswith('~'):
+            try:
+                re.compile(term[1:])
+            except re.error as error:
+                return "SYNTAX ERROR --> {0} <-- bad regex: {1}".format(limitPattern, error)
+
+        if term == '':
+            return "SYNTAX ERROR --> {0} <-- empty pattern after {1}".format(limitPattern, operator)
+
+        termList.append((operator, term))
+
+    if len(termList) == 0:
+        return "SYNTAX ERROR --> {0} <-- no pattern given".format(limitPattern)
+
+    return termList
+
+
+def matchLimitTerm(term, flatDict, hostList):
+    '''
+    Hosts matched by one --limit term, groups are matched with hosts of their child groups (flatDict).
+
+    Return set.
+    '''
+
+    import fnmatch
+
+    if term in ('all', '*'):
+        return set(hostList)
+
+    if term in flatDict:
+        return set(flatDict[term])
+
+    if term.startswith('~'):
+        match = re.compile(term[1:]).match
+    elif any(char in term for char in '*?['):
+        match = lambda name: fnmatch.fnmatchcase(name, term)
+    else:
+        return set([term]) & set(hostList)
+
+    hostSet = set(host for host in hostList if match(host))
+    for group in flatDict:
+        if match(group):
+            hostSet.update(flatDict[group])
+
+    return hostSet
+
+
+def limitSelection(limitPattern, groupDict, childDict, hostList):
+    '''
+    Resolve --limit pattern like ansible does: union of plain terms (all when there is none),
+    intersected with every &term, minus every !term. Groups without a selected host in them or below them
+    are left out, kept groups list only selected hosts and kept children.
+
+    Return tuple (set of hostnames, dict {groupname: [hostname, ...]}, dict {groupname: [child groupname, ...]}).
+    '''
+
+    termList = splitLimitPattern(limitPattern)
+    if isinstance(termList, basestring):
+        raise ValueError(termList)
+
+    flatDict  = flattenGroups(groupDict, childDict)
+    plainList = [term for operator, term in termList if operator == ''] or ['all']
+    hostSet   = set().union(*[matchLimitTerm(term, flatDict, hostList) for term in plainList])
+
+    for operator, term in termList:
+        if operator == '&':
+            hostSet &= matchLimitTerm(term, flatDict, hostList)
+        elif operator == '!':
+            hostSet -= matchLimitTerm(term, flatDict, hostList)
+
+    ## group all stays for its group vars
+    keptSet   = set(group for group in groupDict if group == 'all' or hostSet.intersection(flatDict[group]))
+    keptDict  = dict((group, [host for host in groupDict[group] if host in hostSet]) for group in keptSet)
+    childDict = dict((group, [child for child in childDict[group] if child in keptSet])
+                     for group in keptSet if group in childDict and keptSet.intersection(childDict[group]))
+
+    return hostSet, keptDict, childDict
+
+
+def limitAnsibleInventory(inventory, limitPattern):
+    '''
+    Cut an ansible compliant inventory dict down to hosts matching --limit pattern.
+
+    Return dict.
+    '''
+
+    groupDict = dict((group, entry['hosts']) for group, entry in inventory.items() if group != '_meta')
+    childDict = dict((group, entry['children']) for group, entry in inventory.items() if group != '_meta' and 'children' in entry)
+    hostVars  = inventory['_meta']['hostvars']
+
+    hostSet, keptDict, childDict = limitSelection(limitPattern, groupDict, childDict, list(hostVars))
+
+    limitDict = dict((group, {'hosts': keptDict[group], 'vars': inventory[group]['vars']}) for group in keptDict)
+    for group in childDict:
+        limitDict[group]['children'] = childDict[group]
+
+    limitDict['_meta'] = {'hostvars': dict((host, hostVars[host]) for host in hostSet if host in hostVars)}
+    return limitDict
+
+
+def limitGroupResults(zk, limitPattern, groupList, hostList, childDict, window=None):
+    '''
+    Resolve --limit pattern against group membership listed with pipelined requests,
+    so that group vars and hostvars are fetched only for matching groups and hosts afterwards.
+
+    Return tuple (list of tuples (groupname, groupPath, (hostList, stat)) of kept groups, list of selected hosts,
+    dict {groupname: [child groupname, ...]}).
+    '''
+
+    groupRequests = ((group, 'childrenStat', "{0}/groups/{1}".format(cfg.aPath, group)) for group in groupList)
+    resultDict    = dict((group, result) for group, path, result in pipelinedFetch(zk, groupRequests, window)
+                         if result is not None)
+
+    hostSet, keptDict, childDict = limitSelection(limitPattern, dict((group, result[0]) for group, result in resultDict.items()),
+                                                  childDict, hostList)
+
+    groupResults = [(group, "{0}/groups/{1}".format(cfg.aPath, group), (keptDict[group], resultDict[group][1]))
+                    for group in groupList if group in keptDict]
+
+    return groupResults, [host for host in hostList if host in hostSet], childDict
+
+
+def ansibleInventoryDump(window=None, limit=None):
+    '''
+    Ansible compliant inventory dump for a given list of zookeeper servers and ansible-keeper path,
+    with a --limit pattern only matching groups and hosts are fetched and emitted.
+    
+    Return dict.
+    '''
+
+    ## The stock inventory script system detailed above works for all versions of Ansible, but calling --host for
+    ## every host can be rather expensive, especially if it involves expensive API calls to a remote subsystem.
+    ## In Ansible 1.3 or later, if the inventory script returns a top level element called “_meta”,
+    ## it is possible to return all of the host variables in one inventory script call. When this meta element
+    ## contains a value for “hostvars”, the inventory script will not be invoked with --host for each host.
+    ## This results in a significant performance increase for large numbers of hosts, and also makes client side
+    ## caching easier to implement for the inventory script.
+    ##
+    ## Source: http://docs.ansible.com/ansible/dev_guide/developing_inventory.html#tuning-the-external-inventory-script
+
+    zk = zkSession.ro()
+
+    with zkStats.phase('list'):
+        groupsAsync = zk.get_children_async("{}/groups".format(cfg.aPath))
+        hostsAsync  = zk.get_children_async("{}/hosts".format(cfg.aPath))
+        groupList   = groupsAsync.get()
+        hostList    = hostsAsync.get()
+        hostFormat  = storageFormat(zk)
+        childDict   = groupChildren(zk, window)[0]
+
+    if limit is not None:
+        with zkStats.phase('group walk'):
+            limitResults, hostList, childDict = limitGroupResults(zk, limit, groupList, hostList, childDict, window)
+
+    ## building ansible compliant hostvars dict:
+    ##
+    ## {"_meta": {
+    ##     "hostvars": {
+    ##         "moocow.example.com": {"asdf" : 1234, "var2": 111 },
+    ##         "llama.example.com": {"asdf": 5678, "var2": 222 }
+    ##     }
+    ## }}
+
+    groupDict   = {}
+    hostVarDict = {}
+    varDict     = {}
+
+    ## one request per host: get the packed blob or list legacy hostvar znodes
+    hostMethod = 'data' if hostFormat == 'packed' else 'childrenStat'
+
+    def hostVarRequests():
+        ## read every host, then request each legacy hostvar as soon as its host is listed
+        hostRequests = ((host, hostMethod, "{0}/hosts/{1}".format(cfg.aPath, host)) for host in hostList)
+
+        for host, hostPath, result in pipelinedFetch(zk, hostRequests, window):
+            if result is None:
+                continue
+
+            varDict[host], varList = hostVarsFromResult(zk, hostPath, result)
+            for var in varList:
+                yield ('var', host, var), 'data', '{0}/{1}'.format(hostPath, var)
+
+    def groupVarRequests():
+        ## list members of every group, then request group vars of groups which have any
+        groupRequests = ((group, 'childrenStat', "{0}/groups/{1}".format(cfg.aPath, group)) for group in groupList)
+        groupResults  = pipelinedFetch(zk, groupRequests, window) if limit is None else limitResults
+
+        for group, groupPath, result in groupResults:
+            if result is None:
+                continue
+
+            groupDict[group] = {'hosts': result[0], 'vars': {}}
+            if group in childDict:
+                groupDict[group]['children'] = childDict[group]
+            if result[1].dataLength:
+                yield ('group', group), 'data', groupPath
+
+    fetchPhase = lambda item: 'group walk' if item[0][0] == 'group' else 'hostvar fetch'
+
+    for tag, path, result in zkStats.timedIter(fetchPhase, pipelinedFetch(zk, chain(groupVarRequests(), hostVarRequests()), window)):
+        if result is None:
+            continue
+
+        if tag[0] == 'group':
+            groupDict[tag[1]]['vars'] = groupVars(result[0])
+
+        else:
+            varDict[tag[1]][tag[2]] = result[0]
+
+    resolveValues(zk, varDict.values(), window)
+
+    ## modify output dict to be compliant with ansible >= 1.3 version
+    hostVarDict['hostvars'] = varDict
+    groupDict['_meta']      = hostVarDict
+    return groupDict
+
+
+def ansibleInventoryChunks(window=None, limit=None):
+    '''
+    Streaming ansible compliant inventory dump, every group and every host is emitted as soon as it is fetched.
+    Chunks joined are byte-identical to json.dumps(ansibleInventoryDump(window, limit), sort_keys=True),
+    memory stays flat as only hosts with hostvars still in flight are held.
+
+    Return generator of strings.
+    '''
+
+    from collections import deque
+
+    zk = zkSession.ro()
+
+    with zkStats.phase('list'):
+        groupsAsync = zk.get_children_async("{}/groups".format(cfg.aPath))
+        hostsAsync  = zk.get_children_async("{}/hosts".format(cfg.aPath))
+        groupList   = sorted(group for group in groupsAsync.get() if group != '_meta')
+        hostList    = sorted(hostsAsync.get())
+        hostMethod  = 'data' if storageFormat(zk) == 'packed' else 'childrenStat'
+        childDict   = groupChildren(zk, window)[0]
+
+    if limit is not None:
+        with zkStats.phase('group walk'):
+            limitResults, hostList, childDict = limitGroupResults(zk, limit, groupList, hostList, childDict, window)
+            limitResults = dict((group, (path, result)) for group, path, result in limitResults)
+            groupList    = [group for group in groupList if group in limitResults]
+
+    encode = zkStats.timed('json encode', json.dumps)
+
+    ## json.dumps(sort_keys=True) puts _meta between upper and lower case group names
+    def groupChunks(groups, sep):
+        groupRequests = ((group, 'childrenStat', "{0}/groups/{1}".format(cfg.aPath, group)) for group in groups)
+
+        if limit is None:
+            groupResults = pipelinedFetch(zk, groupRequests, window)
+        else:
+            groupResults = ((group,) + limitResults[group] for group in groups)
+
+        def groupVarRequests():
+            ## groups with vars need one more request, the others are just let through in order
+            for group, groupPath, result in groupResults:
+                if result is None:
+                    continue
+                yield (group, result[0]), 'data' if result[1].dataLength else None, groupPath
+
+        for (group, hostList), path, result in zkStats.timedIter('group walk', pipelinedFetch(zk, groupVarRequests(), window)):
+            groupEntry = {'hosts': hostList, 'vars': groupVars(result[0]) if result is not None else {}}
+            if group in childDict:
+                groupEntry['children'] = childDict[group]
+            yield '{0}{1}: {2}'.format(sep, encode(group), encode(groupEntry, sort_keys=True))
+            sep = ', '
+
+    pending = deque()  ## [hostname, hostvars dict, hostvars still in flight] in host order
+
+    def hostVarRequests():
+        hostRequests = ((host, hostMethod, "{0}/hosts/{1}".format(cfg.aPath, host)) for host in hostList)
+
+        for host, hostPath, result in pipelinedFetch(zk, hostRequests, window):
+            if result is None:
+                continue
+
+            varDict, varList = hostVarsFromResult(zk, hostPath, result)
+            pending.append([host, varDict, len(varList)])
+
+            if len(varList) == 0:  ## packed or empty host is complete, just let it through in order
+                yield (pending[-1], None), None, hostPath
+
+            for var in varList:
+                yield (pending[-1], var), 'data', '{0}/{1}'.format(hostPath, var)
+
+    def hostChunks():
+        sep = ''
+        for (entry, var), path, result in zkStats.timedIter('hostvar fetch', pipelinedFetch(zk, hostVarRequests(), window)):
+            if var is not None:
+                if result is not None:
+                    entry[1][var] = result[0]
+                entry[2] -= 1
+
+            while pending and pending[0][2] == 0:
+                host, varDict, notUsedValue = pending.popleft()
+                resolveValues(zk, [varDict], window)
+                yield '{0}{1}: {2}'.format(sep, encode(host), encode(varDict, sort_keys=True))
+                sep = ', '
+
+    yield '{'
+
+    sep = ''
+    for chunk in groupChunks([group for group in groupList if group < '_meta'], ''):
+        sep = ', '
+        yield chunk
+
+    yield sep + '"_meta": {"hostvars": {'
+    for chunk in hostChunks():
+        yield chunk
+    yield '}}'
+
+    for chunk in groupChunks([group for group in groupList if group > '_meta'], ', '):
+        yield chunk
+
+    yield '}'
+
+
+def ansibleInventoryDumpSerial():
+    '''
+    Ansible compliant inventory dump fetching znodes one blocking request at a time.
+    Kept as a reference for ansibleInventoryDump() and for --fetch-speedup.
+
+    Return dict.
+    '''
+
+    zk = zkSession.ro()
+
+    groupList = zk.get_children("{}/groups".format(cfg.aPath))
+    childDict = groupChildren(zk, window=1)[0]
+    groupDict = {}
+    
+    for group in groupList:
+        path            = "{0}/groups/{1}".format(cfg.aPath, group)
+        children, stat  = zk.get_children(path, include_data=True)
+        tmpDict  = {}
+        tmpDict['hosts'] = children
+        tmpDict['vars']  = groupVars(zk.get(path)[0]) if stat.dataLength else {}
+        if group in childDict:
+            tmpDict['children'] = childDict[group]
+        groupDict[group] = tmpDict
+        
+    ## building ansible compliant hostvars dict:
+    ##
+    ## {"_meta": {
+    ##     "hostvars": {
+    ##         "moocow.example.com": {"asdf" : 1234, "var2": 111 },
+    ##         "llama.example.com": {"asdf": 5678, "var2": 222 }
+    ##     }
+    ## }}
+
+    hostList    = zk.get_children("{}/hosts".format(cfg.aPath))
+    hostVarDict = {}
+    varDict     = {}
+
+    for host in hostList:             ## build a dict with host variables
+        tmpHostPath    = "{0}/hosts/{1}".format(cfg.aPath, host)
+        varDict[host]  = readHostVars(zk, tmpHostPath, window=1) or {}
+
+    resolveValues(zk, varDict.values(), window)
+
+    ## modify output dict to be compliant with ansible >= 1.3 version
+    hostVarDict['hostvars'] = varDict
+    groupDict['_meta']      = hostVarDict
+    return groupDict
+
+
+def fetchSpeedup(window=None):
+    '''
+    Time serial and pipelined ansible inventory dumps against the same inventory.
+
+    Return string (ERROR ... || SPEEDUP ...).
+    '''
+
+    window = window or cfg.asyncWindow
+
+    startTime     = time.time()
+    serialDump    = ansibleInventoryDumpSerial()
+    serialTime    = time.time() - startTime
+
+    startTime     = time.time()
+    pipelinedDump = ansibleInventoryDump(window)
+    pipelinedTime = time.time() - startTime
+
+    if serialDump != pipelinedDump:
+        return "ERROR  ==> serial and pipelined inventory dumps differ !!!"
+
+    return "SPEEDUP  ==> hosts: {0} serial: {1:.3f}s pipelined (window {2}): {3:.3f}s speedup: {4:.1f}x".format(
+        len(serialDump['_meta']['hostvars']), serialTime, window, pipelinedTime, serialTime / max(pipelinedTime, 1e-6))
+
+
+def ansibleHostAccess(hostName, window=None):
+    '''
+    Ansible pre 1.3 compliant hostvars dump.
+
+    Return dict or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    ## Before version 1.0, each group could only have a list of hostnames/IP addresses, like the webservers,
+    ## marietta, and 5points groups above.
+    ##
+    ## When called with the arguments --host <hostname> (where <hostname> is a host from above), the script
+    ## must print either an empty JSON hash/dictionary, or a hash/dictionary of variables to make available
+    ## to templates and playbooks. Printing variables is optional, if the script does not wish to do this,
+    ## printing an empty hash/dictionary is the way to go
+    ##
+    ## Source: http://docs.ansible.com/ansible/dev_guide/developing_inventory.html#script-conventions
+    
+    zk = zkSession.ro()
+
+    hostPath = "{0}/hosts/{1}".format(cfg.aPath, hostName)
+
+    varDict = readHostVars(zk, hostPath, window)  ## one get for packed hosts
+
+    if varDict is None:
+        return ArgError('HOST_DOES_NOT_EXIST', "ERROR  ==> no such host: {0} !!!".format(hostName)).format()
+
+    else:
+        return varDict
+
+        
+    
+def hostVarString(val):
+    '''
+    Convert hostvar value read from an inventory file into a znode string,
+    non string values (numbers, booleans, lists, dicts) are stored as JSON.
+
+    Return string.
+    '''
+
+    if isinstance(val, unicode):
+        return val.encode('utf-8')
+
+    if isinstance(val, str):
+        return val
+
+    return json.dumps(val, sort_keys=True)
+
+
+def parseIniInventory(text):
+    '''
+    Parse ansible static INI inventory, hosts out of any section go to ungrouped group,
+    [group:children] members become child groups of their parent group.
+
+    Return tuple (groupDict {group: [hosts]}, hostVarDict {host: {var: val}}, groupVarDict {group: {var: val}},
+    childDict {group: [child groups]}).
+    '''
+
+    import shlex
+
+    groupDict, hostVarDict, groupVarDict, childDict = {}, {}, {}, {}
+    section = 'ungrouped'
+
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '' or line[0] in '#;':
+            continue
+
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip()
+            continue
+
+        if section.endswith(':vars'):
+            var, val = line.split('=', 1) if '=' in line else (line, '')
+            groupVarDict.setdefault(section[:-len(':vars')], {})[var.strip()] = " ".join(shlex.split(val, comments=True))
+            continue
+
+        if section.endswith(':children'):
+            childList = childDict.setdefault(section[:-len(':children')], [])
+            if line.split()[0] not in childList:
+                childList.append(line.split()[0])
+            continue
+
+        tokenList = shlex.split(line, comments=True)
+        hostName  = tokenList[0]
+        varDict   = hostVarDict.setdefault(hostName, {})
+
+        for token in tokenList[1:]:
+            var, val = token.split('=', 1)
+            varDict[var] = val
+
+        groupDict.setdefault(section, [])
+        if hostName not in groupDict[section]:
+            groupDict[section].append(hostName)
+
+    ## groups known only from children sections have no hosts of their own
+    for group in set(childDict).union(*childDict.values()):
+        groupDict.setdefault(group, [])
+
+    return groupDict, hostVarDict, groupVarDict, childDict
+
+
+def parseYamlInventory(data):
+    '''
+    Parse ansible YAML inventory already loaded into dicts, hosts of all group go to ungrouped group,
+    children become child groups of their parent group (children of all are just groups).
+
+    Return tuple (groupDict {group: [hosts]}, hostVarDict {host: {var: val}}, groupVarDict {group: {var: val}},
+    childDict {group: [child groups]}).
+    '''
+
+    groupDict, hostVarDict, groupVarDict, childDict = {}, {}, {}, {}
+
+    def walk(group, body):
+        body     = body or {}
+        hostList = []
+
+        for hostName, varDict in (body.get('hosts') or {}).items():
+            hostVars = hostVarDict.setdefault(hostName, {})
+            for var, val in (varDict or {}).items():
+                hostVars[var] = hostVarString(val)
+            hostList.append(hostName)
+
+        if body.get('vars'):
+            groupVarDict.setdefault(group, {}).update((var, hostVarString(val)) for var, val in body['vars'].items())
+
+        for child, childBody in (body.get('children') or {}).items():
+            walk(child, childBody)
+            if group != 'all' and child not in childDict.setdefault(group, []):
+                childDict[group].append(child)
+
+        if group != 'all':
+            groupDict[group] = sorted(set(groupDict.get(group, []) + hostList))
+
+    for group, body in (data or {}).items():
+        walk(group, body)
+
+    ## hosts listed directly under all
+    ungrouped = [host for host in (((data or {}).get('all') or {}).get('hosts') or {})
+                 if not any(host in hostList for hostList in groupDict.values())]
+    if len(ungrouped) > 0:
+        groupDict['ungrouped'] = sorted(set(groupDict.get('ungrouped', []) + ungrouped))
+
+    return groupDict, hostVarDict, groupVarDict, childDict
+
+
+def parseJsonInventory(data):
+    '''
+    Parse ansible dynamic inventory JSON (-I ansible output), groups may be lists of hosts.
+
+    Return tuple (groupDict {group: [hosts]}, hostVarDict {host: {var: val}}, groupVarDict {group: {var: val}},
+    childDict {group: [child groups]}).
+    '''
+
+    groupDict, hostVarDict, groupVarDict, childDict = {}, {}, {}, {}
+
+    for hostName, varDict in data.get('_meta', {}).get('hostvars', {}).items():
+        hostVarDict[hostName] = dict((var, hostVarString(val)) for var, val in (varDict or {}).items())
+
+    for group, body in data.items():
+        if group == '_meta':
+            continue
+
+        hostList = body if isinstance(body, list) else body.get('hosts', [])
+        if isinstance(body, dict) and body.get('vars'):
+            groupVarDict[group] = dict((var, hostVarString(val)) for var, val in body['vars'].items())
+        if isinstance(body, dict) and body.get('children'):
+            childDict[group] = list(body['children'])
+
+        groupDict[group] = list(hostList)
+        for hostName in hostList:
+            hostVarDict.setdefault(hostName, {})
+
+    for group in set(childDict).union(*childDict.values()):
+        groupDict.setdefault(group, [])
+
+    return groupDict, hostVarDict, groupVarDict, childDict
+
+
+def parseInventoryFile(inventoryPath):
+    '''
+    Parse static INI, YAML or JSON ansible inventory file or inventory snapshot,
+    format is guessed from file extension and content.
+
+    Return tuple (groupDict, hostVarDict, groupVarDict, childDict) or string (in case of ERROR).
+    '''
+
+    try:
+        with open(inventoryPath) as inventoryFile:
+            text = inventoryFile.read()
+
+    except IOError as error:
+        return "ERROR  ==> could not read inventory file: {0} ({1}) !!!".format(inventoryPath, error.strerror)
+
+    if text.startswith(SNAPSHOT_MAGIC):
+        snapshot = openSnapshot(inventoryPath)
+        if isinstance(snapshot, basestring):
+            return snapshot
+        return parseJsonInventory(snapshot.ansibleInventory())
+
+    if inventoryPath.endswith(('.yml', '.yaml')):
+        try:
+            import yaml
+        except ImportError:
+            return "ERROR  ==> YAML inventory needs PyYAML: pip install pyyaml !!!"
+
+        return parseYamlInventory(yaml.safe_load(text))
+
+    if text.lstrip().startswith('{'):
+        try:
+            return parseJsonInventory(json.loads(text))
+        except ValueError as error:
+            return "ERROR  ==> could not parse JSON inventory file: {0} ({1}) !!!".format(inventoryPath, error)
+
+    return parseIniInventory(text)
+
+
+def importInventory(inventoryPath):
+    '''
+    Import hosts, groups, hostvars, group vars and child groups from an ansible inventory file: diff it against
+    zookeeper and apply only missing hosts, memberships, child group edges and changed hostvars and group vars
+    in batched transactions. Nothing is deleted, so a rerun of the same import is a cheap no-op.
+    Child group edges closing a cycle with the edges in zookeeper are rejected before anything is written.
+
+    Return string (ERROR ... || IMPORTED ...).
+    '''
+
+    startTime = time.time()
+    parsed    = parseInventoryFile(inventoryPath)
+
+    if isinstance(parsed, basestring):
+        return parsed
+
+    groupDict, hostVarDict, groupVarDict, importChildDict = parsed
+
+    zk = zkSession.rw()
+    indexed = membershipIndexed(zk)
+    zk.ensure_path("{}/hosts".format(cfg.aPath))
+    zk.ensure_path("{}/groups".format(cfg.aPath))
+    zk.ensure_path(digestPath())
+    if indexed:
+        zk.ensure_path("{}/memberships".format(cfg.aPath))
+
+    ## child group edges are checked against the edges already in zookeeper, like --child does
+    childDict, rootStat = groupChildren(zk)
+    edgeList   = sorted((parent, child) for parent in importChildDict for child in importChildDict[parent]
+                        if child not in childDict.get(parent, []))
+    mergedDict = dict((parent, list(childList)) for parent, childList in childDict.items())
+
+    for parent, child in edgeList:
+        mergedDict.setdefault(parent, []).append(child)
+
+    for parent, child in edgeList:
+        if parent == child or parent in descendantGroups(mergedDict, child):
+            return "ERROR  ==> import of {0}: adding group: {1} to group: {2} would create a cycle !!! nothing imported".format(
+                inventoryPath, child, parent)
+
+    current = ansibleInventoryDump()
+    packed  = storageFormat(zk) == 'packed'
+    ops     = []
+    counts  = {'new': 0, 'updated': 0, 'unchanged': 0, 'groups': 0, 'memberships': 0, 'groupVars': 0, 'children': len(edgeList)}
+
+    ## journalled as one change record, the import may have been partly applied before
+    changedHosts  = set()
+    changedGroups = set()
+
+    ## existing packed hosts are rewritten as a whole, read their blobs and versions first
+    changedPacked = {}
+    hostRequests  = (
+        (host, 'data', "{0}/hosts/{1}".format(cfg.aPath, host)) for host in sorted(hostVarDict)
+        if host in current['_meta']['hostvars'] and
+        any(current['_meta']['hostvars'][host].get(var) != val for var, val in hostVarDict[host].items()))
+
+    for host, hostPath, result in pipelinedFetch(zk, hostRequests):
+        if result is not None and unpackHostVars(result[0]) is not None:
+            changedPacked[host] = result
+
+    ## digest index entries of changed hosts are set version checked, missing ones are created
+    digestRequests = (
+        (host, 'data', digestPath(host)) for host in sorted(hostVarDict)
+        if host in current['_meta']['hostvars'] and
+        any(current['_meta']['hostvars'][host].get(var) != val for var, val in hostVarDict[host].items()))
+    changedDigests = dict((host, result) for host, path, result in pipelinedFetch(zk, digestRequests))
+
+    ## group vars are merged into the group znode with a version check, like --group-vars does
+    changedGroupVars = {}
+    groupRequests    = (
+        (group, 'data', "{0}/groups/{1}".format(cfg.aPath, group)) for group in sorted(groupVarDict)
+        if group in current and any(current[group]['vars'].get(var) != val for var, val in groupVarDict[group].items()))
+
+    for group, groupPath, result in pipelinedFetch(zk, groupRequests):
+        if result is not None:
+            changedGroupVars[group] = result
+
+    for host in sorted(hostVarDict):
+        hostPath = "{0}/hosts/{1}".format(cfg.aPath, host)
+        varDict  = hostVarDict[host]
+
+        if host not in current['_meta']['hostvars']:
+            counts['new'] += 1
+            changedHosts.add(host)
+            if packed:
+                ops.append(('create', hostPath, packHostVars(varDict)))
+            else:
+                ops.append(('create', hostPath, ''))
+                ops.extend(('create', "{0}/{1}".format(hostPath, var), varDict[var]) for var in sorted(varDict))
+            ops.append(('create', digestPath(host), packDigests(varDigests(varDict))))
+            if indexed:
+                ops.append(('create', membershipPath(host), ''))
+            continue
+
+        currentVars = current['_meta']['hostvars'][host]
+        changedList = sorted(var for var in varDict if currentVars.get(var) != varDict[var])
+
+        if len(changedList) == 0:
+            counts['unchanged'] += 1
+
+        elif host in changedPacked:
+            counts['updated'] += 1
+            changedHosts.add(host)
+            data, stat = changedPacked[host]
+            mergedVars = unpackHostVars(data)
+            mergedVars.update(varDict)
+            ops.append(('set_data', hostPath, packHostVars(mergedVars), stat.version))
+
+        else:
+            counts['updated'] += 1
+            changedHosts.add(host)
+            for var in changedList:
+                if var in currentVars:
+                    ops.append(('set_data', "{0}/{1}".format(hostPath, var), varDict[var]))
+                else:
+                    ops.append(('create', "{0}/{1}".format(hostPath, var), varDict[var]))
+
+        if len(changedList) > 0:
+            mergedVars = dict(currentVars)
+            mergedVars.update(varDict)
+            if changedDigests.get(host) is not None:
+                ops.append(('set_data', digestPath(host), packDigests(varDigests(mergedVars)), changedDigests[host][1].version))
+            else:
+                ops.append(('create', digestPath(host), packDigests(varDigests(mergedVars))))
+
+    for group in sorted(set(groupDict) | set(groupVarDict)):
+        groupPath = "{0}/groups/{1}".format(cfg.aPath, group)
+
+        if group not in current:
+            counts['groups'] += 1
+            ops.append(('create', groupPath, packHostVars(groupVarDict[group]) if group in groupVarDict else ''))
+            counts['groupVars'] += 1 if group in groupVarDict else 0
+
+        elif group in changedGroupVars:
+            counts['groupVars'] += 1
+            changedGroups.add(group)
+            data, stat = changedGroupVars[group]
+            mergedVars = groupVars(data)
+            mergedVars.update(groupVarDict[group])
+            ops.append(('set_data', groupPath, packHostVars(mergedVars), stat.version))
+
+        for host in sorted(set(groupDict.get(group, [])) - set(current.get(group, {}).get('hosts', []))):
+            counts['memberships'] += 1
+            changedGroups.add(group)
+            ops.append(('create', "{0}/{1}".format(groupPath, host), ''))
+            if indexed:
+                ops.append(('create', membershipPath(host, group), ''))
+
+    ## edges go last, their first transaction checks version of <aPath>/children against concurrent --child
+    edgeOps = []
+    if len(edgeList) > 0:
+        edgeOps.append(('create', childrenPath(), '') if rootStat is None else ('set_data', childrenPath(), '', rootStat.version))
+    for parent in sorted(set(parent for parent, child in edgeList)):
+        changedGroups.add(parent)
+        if parent not in childDict:
+            edgeOps.append(('create', childrenPath(parent), ''))
+        edgeOps.extend(('create', childrenPath(parent, child), '') for edgeParent, child in edgeList if edgeParent == parent)
+
+    ## batches are committed in order, so parents are always created before their children
+    transactions = 0
+    for batch in chain(opBatches(ops), opBatches(edgeOps)):
+        failed = commitOps(zk, batch)
+        if failed is not None:
+            if transactions > 0:
+                commitWrite(zk, [], {'op': 'import', 'source': os.path.basename(inventoryPath),
+                                     'hosts': sorted(changedHosts), 'groups': sorted(changedGroups)})
+            else:
+                bumpGeneration(zk)
+            return "ERROR  ==> import of {0} stopped after {1} transactions: {2} {3} !!! rerun to continue".format(
+                inventoryPath, transactions, type(failed[1]).__name__, failed[0][1])
+        transactions += 1
+
+    if transactions > 0:
+        commitWrite(zk, [], {'op': 'import', 'source': os.path.basename(inventoryPath),
+                             'hosts': sorted(changedHosts), 'groups': sorted(changedGroups)})
+
+    elapsedTime = time.time() - startTime
+    importMsg   = "IMPORTED  ==> hosts: {0} (new: {1}, updated: {2}, unchanged: {3}) new groups: {4} new memberships: {5} " \
+                  "group vars: {6} child groups: {7} in {8} transactions, {9:.0f} hosts/sec".format(
+                      len(hostVarDict), counts['new'], counts['updated'], counts['unchanged'], counts['groups'],
+                      counts['memberships'], counts['groupVars'], counts['children'], transactions,
+                      len(hostVarDict) / max(elapsedTime, 1e-6))
+
+    return importMsg
+
+
+## inventory snapshot file, version 3:
+##   header ==> magic, version, index offset, index length (SNAPSHOT_HEADER)
+##   records ==> zlib compressed JSON, one per group (list of hosts), one per group with group vars
+##               and one per host (hostvars)
+##   index ==> zlib compressed JSON {hosts: {host: [offset, length]}, groups: {group: [offset, length]},
+##             groupVars: {group: [offset, length]}, children: {group: [child, ...]}, ...}
+## readers load the index only and seek to the records they need,
+## version 1 files have no groupVars and version 1 and 2 files have no children
+
+SNAPSHOT_MAGIC    = 'AKSNAP'
+SNAPSHOT_VERSION  = 3
+SNAPSHOT_VERSIONS = (1, 2, 3)  ## versions readers accept
+SNAPSHOT_HEADER  = struct.Struct('>6sHQQ')
+
+
+def writeSnapshot(snapshotPath, inventory, metaDict=None):
+    '''
+    Atomically write ansible compliant inventory dict into a snapshot file.
+
+    Return int (snapshot size in bytes).
+    '''
+
+    snapshotDir    = os.path.dirname(os.path.abspath(snapshotPath))
+    from tempfile import mkstemp
+
+    tmpFd, tmpPath = mkstemp(dir=snapshotDir, prefix='.snapshot-')
+    indexDict      = dict(metaDict or {}, version=SNAPSHOT_VERSION, groups={}, groupVars={}, children={}, hosts={})
+
+    try:
+        with os.fdopen(tmpFd, 'wb') as snapshotFile:
+            snapshotFile.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, 0))
+
+            def writeRecord(value):
+                record = zlib.compress(json.dumps(value, sort_keys=True))
+                offset = snapshotFile.tell()
+                snapshotFile.write(record)
+                return [offset, len(record)]
+
+            for group in sorted(group for group in inventory if group != '_meta'):
+                indexDict['groups'][group] = writeRecord(inventory[group]['hosts'])
+                if inventory[group].get('vars'):
+                    indexDict['groupVars'][group] = writeRecord(inventory[group]['vars'])
+                if inventory[group].get('children'):
+                    indexDict['children'][group] = inventory[group]['children']
+
+            hostVarDict = inventory['_meta']['hostvars']
+            for host in sorted(hostVarDict):
+                indexDict['hosts'][host] = writeRecord(hostVarDict[host])
+
+            index       = zlib.compress(json.dumps(indexDict, sort_keys=True))
+            indexOffset = snapshotFile.tell()
+            snapshotFile.write(index)
+            snapshotSize = snapshotFile.tell()
+
+            snapshotFile.seek(0)
+            snapshotFile.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, indexOffset, len(index)))
+
+        os.rename(tmpPath, snapshotPath)
+        return snapshotSize
+
+    except:
+        os.unlink(tmpPath)
+        raise
+
+
+def exportSnapshot(snapshotPath, window=None):
+    '''
+    Export groups, hosts and hostvars of cfg.aPath into a snapshot file.
+
+    Return string (EXPORTED ... || ERROR ...).
+    '''
+
+    zk = zkSession.ro()
+
+    generationStat = zk.exists("{}/generation".format(cfg.aPath))
+    inventory      = ansibleInventoryDump(window)
+
+    metaDict = {'aPath': cfg.aPath, 'created': time.time(), 'format': storageFormat(zk),
+                'generation': generationStat.mzxid if generationStat is not None else None}
+
+    try:
+        snapshotSize = writeSnapshot(snapshotPath, inventory, metaDict)
+
+    except (IOError, OSError) as error:
+        return "ERROR  ==> could not write snapshot: {0} ({1}) !!!".format(snapshotPath, error.strerror)
+
+    return "EXPORTED  ==> hosts: {0} groups: {1} to snapshot: {2} ({3} bytes)".format(
+        len(inventory['_meta']['hostvars']), len(inventory) - 1, snapshotPath, snapshotSize)
+
+
+def isSnapshot(snapshotPath):
+    '''
+    Check snapshot magic at the start of a file.
+
+    Return bool.
+    '''
+
+    try:
+        with open(snapshotPath, 'rb') as snapshotFile:
+            return snapshotFile.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+    except IOError:
+        return False
+
+
+def openSnapshot(snapshotPath):
+    '''
+    Open snapshot file for offline reads.
+
+    Return InventorySnapshot or string (in case of ERROR).
+    '''
+
+    try:
+        return InventorySnapshot(snapshotPath)
+
+    except IOError as error:
+        return "ERROR  ==> could not read snapshot: {0} ({1}) !!!".format(snapshotPath, error.strerror)
+
+    except (ValueError, struct.error, zlib.error) as error:
+        return "ERROR  ==> {0} is not a valid snapshot: {1} !!!".format(snapshotPath, error)
+
+
+def importSnapshot(snapshotPath):
+    '''
+    Restore snapshot into cfg.aPath with batched transactions, like --import nothing is deleted.
+
+    Return string (ERROR ... || IMPORTED ...).
+    '''
+
+    if not isSnapshot(snapshotPath):
+        snapshot = openSnapshot(snapshotPath)
+        return snapshot if isinstance(snapshot, basestring) else \
+            "ERROR  ==> {0} is not a valid snapshot !!!".format(snapshotPath)
+
+    return importInventory(snapshotPath)
+
+
+HASHES_VERSION = 2  ## host digest: digest of {hostvar: digest of its value}, as kept in <aPath>/digests
+
+
+def contentDigest(value):
+    '''
+    Return string (md5 hex digest of a JSON value, independent of dict order and of str/unicode strings).
+    '''
+
+    return hashlib.md5(json.dumps(value, sort_keys=True, separators=(',', ':'))).hexdigest()
+
+
+def groupContent(groupEntry):
+    '''
+    Return dict (what a group digest covers: sorted direct hosts, group vars and sorted child groups).
+    '''
+
+    return {'hosts': sorted(groupEntry.get('hosts') or []), 'vars': groupEntry.get('vars') or {},
+            'children': sorted(groupEntry.get('children') or [])}
+
+
+def digestRoots(hostDigests, groupDigests):
+    '''
+    Return dict {"root", "hostsRoot", "groupsRoot"} (roll-ups of host and group digests).
+    '''
+
+    hostsRoot, groupsRoot = contentDigest(hostDigests), contentDigest(groupDigests)
+    return {'root': contentDigest([hostsRoot, groupsRoot]), 'hostsRoot': hostsRoot, 'groupsRoot': groupsRoot}
+
+
+def inventoryDigests(inventory):
+    '''
+    Content digests of an ansible inventory dict (dump, local cache or snapshot), equal to those
+    inventoryHashes() gives for the same inventory in zookeeper.
+
+    Return dict {"root", "hostsRoot", "groupsRoot", "hosts": {host: digest}, "groups": {group: digest}}.
+    '''
+
+    hostDigests  = dict((host, contentDigest(varDigests(varDict))) for host, varDict in inventory['_meta']['hostvars'].items())
+    groupDigests = dict((group, contentDigest(groupContent(entry))) for group, entry in inventory.items() if group != '_meta')
+
+    digests = digestRoots(hostDigests, groupDigests)
+    digests.update(hosts=hostDigests, groups=groupDigests)
+    return digests
+
+
+def groupWalk(zk, window=None):
+    '''
+    Read every group with its direct hosts, group vars and child groups with pipelined requests,
+    laid out as groups of an ansible inventory dump.
+
+    Return dict {group: {"hosts": [...], "vars": {...}[, "children": [...]]}}.
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    try:
+        groupList = zk.get_children("{}/groups".format(cfg.aPath))
+    except NoNodeError:
+        return {}
+
+    childDict = groupChildren(zk, window)[0]
+    groupDict = {}
+
+    def groupVarRequests():
+        groupRequests = ((group, 'childrenStat', "{0}/groups/{1}".format(cfg.aPath, group)) for group in groupList)
+
+        for group, groupPath, result in pipelinedFetch(zk, groupRequests, window):
+            if result is None:
+                continue
+
+            groupDict[group] = {'hosts': result[0], 'vars': {}}
+            if group in childDict:
+                groupDict[group]['children'] = childDict[group]
+            if result[1].dataLength:
+                yield group, 'data', groupPath
+
+    for group, groupPath, result in pipelinedFetch(zk, groupVarRequests(), window):
+        if result is not None:
+            groupDict[group]['vars'] = groupVars(result[0])
+
+    return groupDict
+
+
+def readVarDigests(zk, hostList, window=None):
+    '''
+    Digest hostvars of given hosts, read with pipelined requests, vanished hosts are left out.
+
+    Return dict {host: {hostvar: digest}}.
+    '''
+
+    varDict = {}
+
+    def hostVarRequests():
+        hostRequests = ((host, 'data', "{0}/hosts/{1}".format(cfg.aPath, host)) for host in sorted(hostList))
+
+        for host, hostPath, result in pipelinedFetch(zk, hostRequests, window):
+            if result is None:
+                continue
+
+            varDict[host], varList = hostVarsFromResult(zk, hostPath, result)
+            for var in varList:
+                yield (host, var), 'data', "{0}/{1}".format(hostPath, var)
+
+    for (host, var), path, result in pipelinedFetch(zk, hostVarRequests(), window):
+        if result is not None:
+            varDict[host][var] = result[0]
+
+    resolveValues(zk, varDict.values(), window)
+
+    return dict((host, varDigests(hostVars)) for host, hostVars in varDict.items())
+
+
+def inventoryHashes(window=None, store=False):
+    '''
+    Content digests of every host (hostvars) and group (direct hosts, group vars, child groups) of cfg.aPath
+    with their roll-ups, stamped with the generation znode and the journal position. Host digests come from
+    the digest index writes keep in <aPath>/digests, hosts without an entry (written by an older client) are
+    digested from their hostvars. Group digests and roll-ups are computed in memory, nothing is written
+    unless store is given: then missing index entries are created. Reads are repeated while the generation
+    moves under them.
+
+    Return dict {"version", "generation", "token", "root", "hostsRoot", "groupsRoot", "hosts", "groups"}.
+    '''
+
+    from kazoo.exceptions import NoNodeError
+
+    zk = zkSession.ro()
+
+    def position():
+        journal        = changesSince('now', window)
+        generationStat = zk.exists("{}/generation".format(cfg.aPath))
+        return (journal['token'] if isinstance(journal, dict) else None,
+                [generationStat.czxid, generationStat.version] if generationStat is not None else [0, -1])
+
+    token, generation = position()
+
+    for attempt in range(3):
+        try:
+            hostList = zk.get_children("{}/hosts".format(cfg.aPath))
+        except NoNodeError:
+            hostList = []
+
+        entryRequests = ((host, 'data', digestPath(host)) for host in hostList)
+        entryDict     = dict((host, unpackDigests(result[0])) for host, path, result in pipelinedFetch(zk, entryRequests, window)
+                             if result is not None)
+        missingDict   = readVarDigests(zk, [host for host in hostList if entryDict.get(host) is None], window)
+        groupDigests  = dict((group, contentDigest(groupContent(entry))) for group, entry in groupWalk(zk, window).items())
+
+        lastGeneration    = generation
+        token, generation = position()
+        if generation == lastGeneration:
+            break
+
+    varDigestDict = dict((host, entry) for host, entry in entryDict.items() if entry is not None)
+    varDigestDict.update(missingDict)
+    hostDigests   = dict((host, contentDigest(entry)) for host, entry in varDigestDict.items())
+
+    if store and len(missingDict) > 0:
+        storeVarDigests(zkSession.rw(), missingDict)
+
+    hashes = digestRoots(hostDigests, groupDigests)
+    hashes.update(version=HASHES_VERSION, generation=generation, token=token, hosts=hostDigests, groups=groupDigests)
+
+    return hashes
+
+
+def storeVarDigests(zk, varDigestDict):
+    '''
+    Create missing host digest index entries, an entry a writer created meanwhile is kept.
+
+    Return int (entries created).
+    '''
+
+    zk.ensure_path(digestPath())
+
+    ops     = [('create', digestPath(host), packDigests(varDigestDict[host])) for host in sorted(varDigestDict)]
+    created = 0
+
+    for batch in opBatches(ops):
+        if commitOps(zk, batch) is None:
+            created += len(batch)
+            continue
+
+        for op in batch:
+            if commitOps(zk, [op]) is None:
+                created += 1
+
+    return created
+
+
+def hashesSummary(hashes):
+    '''
+    Return dict (content hashes without per host and per group digests).
+    '''
+
+    summary = dict((key, val) for key, val in hashes.items() if key not in ('hosts', 'groups'))
+    summary.update(hosts=len(hashes['hosts']), groups=len(hashes['groups']))
+    return summary
+
+
+def validateInventory(inventory, window=None):
+    '''
+    Validate an inventory held by a cache layer (dump, cached or snapshot inventory dict) against content
+    hashes of cfg.aPath, so only stale hosts and groups have to be fetched again.
+
+    Return dict {"valid", "root", "generation", "token", "hosts": [stale host, ...], "groups": [stale group, ...]}.
+    '''
+
+    digests = inventoryDigests(inventory)
+    hashes  = inventoryHashes(window)
+
+    def stale(kind):
+        ## differing, missing in the inventory or gone from zookeeper
+        return sorted(name for name in set(digests[kind]) | set(hashes[kind])
+                      if digests[kind].get(name) != hashes[kind].get(name))
+
+    return {'valid': digests['root'] == hashes['root'], 'root': hashes['root'], 'generation': hashes['generation'],
+            'token': hashes['token'], 'hosts': stale('hosts'), 'groups': stale('groups')}
+
+
+@contextmanager
+def inventoryRoot(aPath):
+    '''
+    Point cfg.aPath to another ansible-keeper path within a with block.
+    '''
+
+    oldPath, cfg.aPath = cfg.aPath, aPath
+
+    try:
+        yield
+    finally:
+        cfg.aPath = oldPath
+
+
+def diffSource(source, window=None):
+    '''
+    Open one side of --diff: a snapshot file, an ansible-keeper path in zookeeper (/path), live (cfg.aPath)
+    or cache (local inventory cache of cfg.aPath). Zookeeper paths give content hashes rolled up from
+    their host digest index (read only), the others are hashed in memory.
+
+    Return dict {"hashes", "hostVars": function, "groups": function} or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    if source == 'live' or source.startswith('/') and not isSnapshot(source):
+        aPath = cfg.aPath if source == 'live' else source.rstrip('/')
+
+        with inventoryRoot(aPath):
+            if zkSession.ro().exists("{}/hosts".format(cfg.aPath)) is None:
+                return ArgError('NO_INVENTORY', "ERROR  ==> no inventory at: {0} !!!".format(aPath)).format()
+            hashes = inventoryHashes(window)
+
+        def hostVars(host):
+            with inventoryRoot(aPath):
+                return readHostVars(zkSession.ro(), "{0}/hosts/{1}".format(cfg.aPath, host), window)
+
+        def groups():
+            with inventoryRoot(aPath):
+                return groupWalk(zkSession.ro(), window)
+
+        return {'hashes': hashes, 'hostVars': hostVars, 'groups': groups}
+
+    if source == 'cache':
+        cache = readInventoryCache()[0]
+        if cache is None:
+            return ArgError('NO_INVENTORY', "ERROR  ==> no inventory cache of: {0} in: {1} !!!".format(cfg.aPath, cfg.cacheDir)).format()
+        inventory = cache['inventory']
+
+    elif isSnapshot(source):
+        snapshot = openSnapshot(source)
+        if isinstance(snapshot, basestring):
+            return ArgError('BAD_SNAPSHOT', snapshot).format()
+        inventory = snapshot.ansibleInventory()
+        snapshot.close()
+
+    else:
+        return ArgError('BAD_DIFF_SOURCE', "ERROR  ==> bad diff source: {0} !!! [/ansible-keeper/path|live|cache|snapshot file]".format(source)).format()
+
+    return {'hashes': inventoryDigests(inventory), 'hostVars': inventory['_meta']['hostvars'].get,
+            'groups': lambda: dict((group, entry) for group, entry in inventory.items() if group != '_meta')}
+
+
+def diffLists(listA, listB):
+    '''
+    Return dict {"added": [...], "removed": [...]}.
+    '''
+
+    return {'added': sorted(set(listB) - set(listA)), 'removed': sorted(set(listA) - set(listB))}
+
+
+def diffDicts(dictA, dictB):
+    '''
+    Return dict {"added": {key: value}, "removed": [key, ...], "changed": {key: [value in A, value in B]}}.
+    '''
+
+    return {'added': dict((key, dictB[key]) for key in set(dictB) - set(dictA)),
+            'removed': sorted(set(dictA) - set(dictB)),
+            'changed': dict((key, [dictA[key], dictB[key]]) for key in set(dictA) & set(dictB) if dictA[key] != dictB[key])}
+
+
+def diffDigests(digestsA, digestsB, detail):
+    '''
+    Compare digests of hosts or groups, detail(name) describes a name present on both sides with differing digests.
+
+    Return dict {"added": [...], "removed": [...], "changed": {name: detail}}.
+    '''
+
+    diff = diffLists(digestsA, digestsB)
+    diff['changed'] = dict((name, detail(name)) for name in sorted(set(digestsA) & set(digestsB))
+                           if digestsA[name] != digestsB[name])
+    return diff
+
+
+def diffInventories(sourceA, sourceB, window=None):
+    '''
+    Compare two inventories (see diffSource) by content hashes: roots first, then host and group digests,
+    hostvars and groups are read only where digests differ.
+
+    Return dict {"equal", "root": [A, B], "hosts": {"added", "removed", "changed"}, "groups": {...}} or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    sideList = [diffSource(source, window) for source in (sourceA, sourceB)]
+    for side in sideList:
+        if type(side) is tuple:
+            return side
+
+    hashesA, hashesB = sideList[0]['hashes'], sideList[1]['hashes']
+    diff = {'equal': hashesA['root'] == hashesB['root'], 'root': [hashesA['root'], hashesB['root']],
+            'hosts': {'added': [], 'removed': [], 'changed': {}}, 'groups': {'added': [], 'removed': [], 'changed': {}}}
+
+    if hashesA['hostsRoot'] != hashesB['hostsRoot']:
+        hostVars      = lambda host: diffDicts(*[side['hostVars'](host) or {} for side in sideList])
+        diff['hosts'] = diffDigests(hashesA['hosts'], hashesB['hosts'], hostVars)
+
+    if hashesA['groupsRoot'] != hashesB['groupsRoot']:
+        groupsA, groupsB = [side['groups']() for side in sideList]
+
+        def groupDiff(group):
+            contentA, contentB = groupContent(groupsA.get(group, {})), groupContent(groupsB.get(group, {}))
+            return dict((key, diffDicts(contentA[key], contentB[key]) if key == 'vars' else diffLists(contentA[key], contentB[key]))
+                        for key in ('hosts', 'vars', 'children') if contentA[key] != contentB[key])
+
+        diff['groups'] = diffDigests(hashesA['groups'], hashesB['groups'], groupDiff)
+
+    return diff
+
+
+def inventoryCacheKey(zk):
+    '''
+    Cheap inventory version key: pzxid, cversion and mzxid of /hosts, /groups and generation znodes,
+    fetched with three pipelined exists calls.
+
+    Return list.
+    '''
+
+    asyncList = [zk.exists_async(path.format(cfg.aPath)) for path in ("{}/hosts", "{}/groups", "{}/generation")]
+    cacheKey  = [cfg.zkServers, cfg.aPath]
+
+    for asyncResult in asyncList:
+        stat = asyncResult.get()
+        cacheKey.extend([stat.pzxid, stat.cversion, stat.mzxid] if stat is not None else [0, 0, 0])
+
+    return cacheKey
+
+
+def inventoryCachePath():
+    '''
+    Path of the inventory cache file for configured zookeeper servers and ansible-keeper path.
+
+    Return string.
+    '''
+
+    cacheName = hashlib.md5("{0}{1}".format(cfg.zkServers, cfg.aPath)).hexdigest()[:16]
+    return os.path.join(cfg.cacheDir, "inventory-{}.json".format(cacheName))
+
+
+def readInventoryCache():
+    '''
+    Read inventory cache file, file mtime is the time of its last validation against zookeeper.
+
+    Return tuple (cache dict or None, age in seconds).
+    '''
+
+    cachePath = inventoryCachePath()
+
+    try:
+        with open(cachePath) as cacheFile:
+            return json.load(cacheFile), time.time() - os.path.getmtime(cachePath)
+
+    except (IOError, OSError, ValueError):  ## missing, being replaced or torn file is a cache miss
+        return None, None
+
+
+def writeInventoryCache(cacheKey, inventory):
+    '''
+    Atomically replace inventory cache file, readers see either the old or the new file.
+
+    Return None.
+    '''
+
+    if not os.path.isdir(cfg.cacheDir):
+        try:
+            os.makedirs(cfg.cacheDir, 0700)
+        except OSError:  ## created by a concurrent ansible run
+            pass
+
+    from tempfile import mkstemp
+
+    tmpFd, tmpPath = mkstemp(dir=cfg.cacheDir, prefix='.inventory-')
+
+    try:
+        with os.fdopen(tmpFd, 'w') as tmpFile:
+            json.dump({'key': cacheKey, 'inventory': inventory}, tmpFile)
+        os.rename(tmpPath, inventoryCachePath())
+
+    except:
+        os.unlink(tmpPath)
+        raise
+
+    writeHostIndex(cacheKey, inventory.get('_meta', {}).get('hostvars', {}))
+
+
+def teeInventoryCache(cacheKey, chunks):
+    '''
+    Pass streamed inventory chunks through while writing them to a new inventory cache file,
+    which replaces the old one only when the stream is complete.
+
+    Return generator of strings.
+    '''
+
+    from tempfile import mkstemp
+
+    tmpFd, tmpPath = mkstemp(dir=cfg.cacheDir, prefix='.inventory-')
+
+    try:
+        with os.fdopen(tmpFd, 'w') as tmpFile:
+            tmpFile.write('{"inventory": ')
+            for chunk in chunks:
+                tmpFile.write(chunk)
+                yield chunk
+            tmpFile.write(', "key": {0}}}'.format(json.dumps(cacheKey)))
+        os.rename(tmpPath, inventoryCachePath())
+
+    except:  ## includes GeneratorExit of an abandoned stream
+        os.unlink(tmpPath)
+        raise
+
+    ## the streamed inventory is not kept in memory, hostvars for the index are read back once per refresh
+    cache, age = readInventoryCache()
+    if cache is not None:
+        writeHostIndex(cache['key'], cache['inventory'].get('_meta', {}).get('hostvars', {}))
+
+
+INDEX_MAGIC  = 'AKHIDX01'
+INDEX_HEADER = struct.Struct('>8sIIQQQ16s')  ## magic, hosts, directory crc32, file length, cache inode, cache size, key digest
+INDEX_ENTRY  = struct.Struct('>QIQII')      ## name offset, name length, record offset, record length, record crc32
+
+
+def inventoryIndexPath():
+    '''
+    Path of the host lookup index written next to the inventory cache file.
+
+    Return string.
+    '''
+
+    return inventoryCachePath()[:-len('.json')] + '.idx'
+
+
+def cacheKeyDigest(cacheKey):
+    '''
+    Return string (16 bytes md5 digest of an inventory cache key).
+    '''
+
+    return hashlib.md5(json.dumps(cacheKey)).digest()
+
+
+def touchInventoryCache():
+    '''
+    Restart ttl of the inventory cache and of its host index after a successful validation.
+
+    Return None.
+    '''
+
+    for path in (inventoryCachePath(), inventoryIndexPath()):
+        try:
+            os.utime(path, None)
+        except OSError:  ## no index (yet)
+            pass
+
+
+def writeHostIndex(cacheKey, hostVars):
+    '''
+    Atomically replace host lookup index: header, fixed size directory entries of hosts sorted by name,
+    names and hostvars records (compact JSON). The header carries the cache key digest and identity
+    (inode, size) of the inventory cache file it was built for, so an index left behind by a newer cache is stale.
+    A failed write leaves the old index, which is stale then.
+
+    Return None.
+    '''
+
+    from tempfile import mkstemp
+
+    nameList   = sorted((host.encode('utf-8') if isinstance(host, unicode) else host, host) for host in hostVars)
+    recordList = [json.dumps(hostVars[host], sort_keys=True, separators=(',', ':')) for name, host in nameList]
+
+    nameOffset   = INDEX_HEADER.size + INDEX_ENTRY.size * len(nameList)
+    recordOffset = nameOffset + sum(len(name) for name, host in nameList)
+    entryList    = []
+
+    for (name, host), record in zip(nameList, recordList):
+        entryList.append(INDEX_ENTRY.pack(nameOffset, len(name), recordOffset, len(record), zlib.crc32(record) & 0xffffffff))
+        nameOffset   += len(name)
+        recordOffset += len(record)
+
+    directory = ''.join(entryList)
+
+    try:
+        cacheStat = os.stat(inventoryCachePath())
+        tmpFd, tmpPath = mkstemp(dir=cfg.cacheDir, prefix='.inventory-')
+
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(tmpFd, 'w') as tmpFile:
+            tmpFile.write(INDEX_HEADER.pack(INDEX_MAGIC, len(nameList), zlib.crc32(directory) & 0xffffffff, recordOffset,
+                                            cacheStat.st_ino, cacheStat.st_size, cacheKeyDigest(cacheKey)))
+            tmpFile.write(directory)
+            tmpFile.write(''.join(name for name, host in nameList))
+            tmpFile.write(''.join(recordList))
+        os.rename(tmpPath, inventoryIndexPath())
+
+    except (IOError, OSError):
+        os.unlink(tmpPath)
+
+
+def readHostIndex(hostName):
+    '''
+    Look up one host in the host lookup index with mmap and binary search, only the record of that host is decoded.
+    A missing, torn or stale index (built for another inventory cache file) is a miss.
+
+    Return tuple (dict with hostvars or None (no such host), key digest, age in seconds) or None (index miss).
+    '''
+
+    import mmap
+
+    name = hostName.encode('utf-8') if isinstance(hostName, unicode) else hostName
+
+    try:
+        with open(inventoryIndexPath(), 'rb') as indexFile:
+            indexStat = os.fstat(indexFile.fileno())
+            cacheStat = os.stat(inventoryCachePath())
+            if indexStat.st_size < INDEX_HEADER.size:
+                return None
+            indexMap = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    except (IOError, OSError, ValueError):
+        return None
+
+    try:
+        magic, hostCount, directoryCrc, length, cacheIno, cacheSize, keyDigest = INDEX_HEADER.unpack_from(indexMap, 0)
+        directoryEnd = INDEX_HEADER.size + INDEX_ENTRY.size * hostCount
+
+        if (magic != INDEX_MAGIC or length != indexStat.st_size or directoryEnd > length or
+                (cacheIno, cacheSize) != (cacheStat.st_ino, cacheStat.st_size) or
+                zlib.crc32(indexMap[INDEX_HEADER.size:directoryEnd]) & 0xffffffff != directoryCrc):
+            return None
+
+        def entry(position):
+            return INDEX_ENTRY.unpack_from(indexMap, INDEX_HEADER.size + INDEX_ENTRY.size * position)
+
+        low, high = 0, hostCount
+        while low < high:
+            middle = (low + high) // 2
+            nameOffset, nameLength = entry(middle)[:2]
+            if indexMap[nameOffset:nameOffset + nameLength] < name:
+                low = middle + 1
             else:
-                nonExistList.append(var)
-           
-        if len(nonExistList) > 0 and len(updatedDict) == 0:
-            return "NOT UPDATED  ==> host: {0} with no existing hostvars {1} ===> NOT UPDATED hostvars {2} which do not exist".format(hostName, updatedDict, nonExistList)
+                high = middle
+
+        age = time.time() - indexStat.st_mtime
+
+        if low == hostCount:
+            return None, keyDigest, age
+
+        nameOffset, nameLength, recordOffset, recordLength, recordCrc = entry(low)
+        if indexMap[nameOffset:nameOffset + nameLength] != name:
+            return None, keyDigest, age
+
+        record = indexMap[recordOffset:recordOffset + recordLength]
+        if zlib.crc32(record) & 0xffffffff != recordCrc:
+            return None
+
+        return json.loads(record), keyDigest, age
+
+    finally:
+        indexMap.close()
+
+
+def cachedAnsibleInventoryDump(window=None, ttl=None):
+    '''
+    Ansible compliant inventory dump served from local cache while inventory cache key is unchanged.
+    Within ttl seconds since the last validation the cache is served without zookeeper connection.
+
+    Return dict.
+    '''
+
+    ttl = cfg.cacheTtl if ttl is None else ttl
+
+    cache, age = readInventoryCache()
+    if cache is not None and age < ttl:
+        return cache['inventory']
+
+    zk = zkSession.ro()
+    cacheKey = inventoryCacheKey(zk)
+
+    if cache is not None and cache['key'] == cacheKey:
+        touchInventoryCache()  ## restart ttl
+        return cache['inventory']
+
+    ## serialize refreshes of parallel ansible runs, only the first one reads the whole tree
+    if not os.path.isdir(cfg.cacheDir):
+        try:
+            os.makedirs(cfg.cacheDir, 0700)
+        except OSError:
+            pass
+
+    with open(inventoryCachePath() + '.lock', 'a') as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        try:
+            cache, age = readInventoryCache()
+            if cache is not None and cache['key'] == cacheKey:
+                return cache['inventory']
+
+            ## key is read before the dump, a write racing with the dump just makes the next run refresh again
+            inventory = ansibleInventoryDump(window)
+            writeInventoryCache(cacheKey, inventory)
+            return inventory
+
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+
+def cachedAnsibleInventoryChunks(window=None, ttl=None, limit=None):
+    '''
+    Streaming variant of cachedAnsibleInventoryDump(), on a cache miss the inventory is streamed
+    from zookeeper and written to the cache at the same time. With a --limit pattern a valid cache
+    is cut down locally, on a cache miss only matching groups and hosts are fetched and nothing is cached.
+
+    Return generator of strings.
+    '''
+
+    ttl = cfg.cacheTtl if ttl is None else ttl
+
+    def cachedInventory(inventory):
+        return json.dumps(inventory if limit is None else limitAnsibleInventory(inventory, limit), sort_keys=True)
+
+    cache, age = readInventoryCache()
+    if cache is not None and age < ttl:
+        yield cachedInventory(cache['inventory'])
+        return
+
+    zk = zkSession.ro()
+    cacheKey = inventoryCacheKey(zk)
+
+    if cache is not None and cache['key'] == cacheKey:
+        touchInventoryCache()  ## restart ttl
+        yield cachedInventory(cache['inventory'])
+        return
+
+    if limit is not None:
+        for chunk in ansibleInventoryChunks(window, limit):
+            yield chunk
+        return
+
+    if not os.path.isdir(cfg.cacheDir):
+        try:
+            os.makedirs(cfg.cacheDir, 0700)
+        except OSError:
+            pass
+
+    with open(inventoryCachePath() + '.lock', 'a') as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        try:
+            cache, age = readInventoryCache()
+            if cache is not None and cache['key'] == cacheKey:
+                yield json.dumps(cache['inventory'], sort_keys=True)
+                return
+
+            for chunk in teeInventoryCache(cacheKey, ansibleInventoryChunks(window)):
+                yield chunk
+
+        finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+
+def cachedHostVars(hostName, window=None, ttl=None):
+    '''
+    Hostvars of one host from the host lookup index (or the inventory cache file when there is no usable index)
+    written by -I ansible: within ttl seconds since its last validation without zookeeper connection,
+    later while inventory cache key is unchanged. Otherwise only the host itself is read from zookeeper,
+    the cache is left to the next -I ansible run.
+
+    Return dict or None (no such host).
+    '''
+
+    ttl     = cfg.hostCacheTtl if ttl is None else ttl
+    indexed = readHostIndex(hostName)
+
+    if indexed is not None:
+        varDict, keyDigest, age = indexed
+    else:
+        cache, age = readInventoryCache()
+        if cache is not None:
+            varDict, keyDigest = cache['inventory']['_meta']['hostvars'].get(hostName), cacheKeyDigest(cache['key'])
+
+    if age is not None and age >= ttl:
+        if keyDigest != cacheKeyDigest(inventoryCacheKey(zkSession.ro())):
+            age = None
+        else:
+            touchInventoryCache()  ## restart ttl
+
+    if age is None:
+        return readHostVars(zkSession.ro(), "{0}/hosts/{1}".format(cfg.aPath, hostName), window)
+
+    return varDict
+
+
+def cachedAnsibleHostAccess(hostName, window=None, ttl=None):
+    '''
+    Ansible pre 1.3 compliant hostvars dump served from local cache, within cfg.hostCacheTtl seconds
+    since the last validation of the cache without zookeeper connection.
+
+    Return dict or string (in case of ERROR).
+    '''
+
+    varDict = cachedHostVars(hostName, window, cfg.hostCacheTtl if ttl is None else ttl)
+
+    if varDict is None:
+        return "ERROR  ==> no such host: {0} !!!".format(hostName)
+
+    return varDict
+
+
+def cachedShowHostVars(znodeStringSplited, window=None, ttl=None):
+    '''
+    Show hostvars like showHostVars(), hosts:hostname is served from local cache, within cfg.cacheTtl seconds
+    since the last validation of the cache without zookeeper connection.
+
+    Return dict or tuple (ArgError: message type, ERROR ...).
+    '''
+
+    if len(znodeStringSplited) != 1 or len(znodeStringSplited[0]) != 3:  ## groups are read from zookeeper
+        return showHostVars(znodeStringSplited)
+
+    hostName = znodeStringSplited[0][0]
+    varDict  = cachedHostVars(hostName, window, cfg.cacheTtl if ttl is None else ttl)
+
+    if varDict is None:
+        return ArgError('HOST_DOES_NOT_EXIST', "ERROR  ==> no such host: {0} !!!".format(hostName)).format()
+
+    return {hostName: varDict}
+
+
+def hostFastPath(argList):
+    '''
+    Answer the ansible call <script> --host <hostname> without option parsing and, on a fresh cache,
+    without importing kazoo (exceptions included, module imports are left to the functions using them)
+    or connecting to zookeeper.
+
+    Return bool (False when argList is not such a call).
+    '''
+
+    if len(argList) != 2 or argList[0] != '--host':
+        return False
+
+    try:
+        sys.stdout.write(json.dumps(cachedAnsibleHostAccess(argList[1])) + '\n')
+    finally:
+        zkSession.close()
+
+    return True
+
+
+class InventoryView(object):
+    '''
+    Read-only inventory answering requests in the commandline syntax,
+    subclasses provide ansibleInventory(), inventory(), showHostVars(), showGroupVars() and ansibleHost().
+    '''
+
+    def answer(self, request):
+        '''
+        Answer one request line in the commandline syntax: -I ansible|all|groups|hosts, -I ansible --limit <pattern>,
+        -S <arg>, --show-group-vars <groupname>, --host <hostname>.
+
+        Return string (JSON).
+        '''
+
+        import shlex
+
+        try:
+            argList = shlex.split(request)
+            opt, arg = argList[:2]
+
+        except ValueError:
+            return json.dumps("ERROR  ==> bad request: {0} !!! [-I mode|-S arg|--host hostname]".format(request))
+
+        if opt == '-I' and arg == 'ansible' and argList[2:3] == ['--limit'] and len(argList) == 4:
+            limitPattern = splitLimitPattern(argList[3])
+            if isinstance(limitPattern, basestring):
+                return json.dumps(limitPattern)
+            return json.dumps(limitAnsibleInventory(self.ansibleInventory(), argList[3]), sort_keys=True)
+
+        elif len(argList) != 2:
+            return json.dumps("ERROR  ==> bad request: {0} !!! [-I mode|-S arg|--host hostname]".format(request))
+
+        elif opt == '-I' and arg == 'ansible':
+            return json.dumps(self.ansibleInventory(), sort_keys=True)
+
+        elif opt == '-I' and arg in ('all', 'groups', 'hosts'):
+            return json.dumps(self.inventory(arg))
+
+        elif opt == '-S':
+            return json.dumps(self.showHostVars(splitZnodeString(arg)))
+
+        elif opt == '--show-group-vars':
+            return json.dumps(self.showGroupVars(arg))
+
+        elif opt == '--host':
+            return json.dumps(self.ansibleHost(arg))
+
+        return json.dumps("ERROR  ==> bad request: {0} !!! [-I mode|-S arg|--host hostname]".format(request))
+
+
+class InventoryWatcher(InventoryView):
+    '''
+    In-memory copy of the inventory kept current with zookeeper ChildrenWatch/DataWatch
+    on /groups, every group, /children, every parent group, /hosts, every host znode
+    and every legacy hostvar znode. Callbacks only update state, they never read the tree.
+    '''
+
+    def __init__(self, zk):
+        import threading
+        self.zk           = zk
+        self.lock         = threading.RLock()
+        self.groups       = {}     ## {groupname: [hostname, ...]}
+        self.groupVars    = {}     ## {groupname: {var: val}} from /groups/<group> data
+        self.children     = {}     ## {groupname: [child groupname, ...]} from /children/<parent>
+        self.parents      = set()  ## parent groups with a ChildrenWatch on /children/<parent>
+        self.edgesWatched = False  ## ChildrenWatch on /children registered
+        self.legacyVars   = {}     ## {hostname: {var: val}} from /hosts/<host>/<var> znodes
+        self.packedVars   = {}     ## {hostname: {var: val} or None} from packed /hosts/<host> blob
+
+        ## watches fire their callbacks once when registered, so the inventory is fully loaded here
+        zk.ChildrenWatch("{}/groups".format(cfg.aPath), self.onGroups)
+        zk.ChildrenWatch("{}/hosts".format(cfg.aPath), self.onHosts)
+        zk.DataWatch(childrenPath(), self.onChildren)  ## only notices /children being created or removed, edges come from ChildrenWatch
+
+    def onGroups(self, groupList):
+        with self.lock:
+            for group in set(groupList) - set(self.groups):
+                self.groups[group]    = []
+                self.groupVars[group] = {}
+                self.zk.ChildrenWatch("{0}/groups/{1}".format(cfg.aPath, group), self.groupWatcher(group))
+                self.zk.DataWatch("{0}/groups/{1}".format(cfg.aPath, group), self.groupDataWatcher(group))
+
+            for group in set(self.groups) - set(groupList):
+                del self.groups[group]
+                del self.groupVars[group]
+
+    def groupWatcher(self, group):
+        def onGroupChildren(hostList):
+            with self.lock:
+                if group not in self.groups:
+                    return False  ## group deleted, stop watching
+                self.groups[group] = hostList
+        return onGroupChildren
+
+    def groupDataWatcher(self, group):
+        def onGroupData(data, stat):
+            with self.lock:
+                if group not in self.groupVars or stat is None:
+                    return False
+                self.groupVars[group] = groupVars(data)
+        return onGroupData
+
+    def onChildren(self, data, stat):
+        with self.lock:
+            if stat is None:  ## no /children yet or removed, its ChildrenWatch stopped on NoNodeError
+                self.children     = {}
+                self.parents      = set()
+                self.edgesWatched = False
+            elif not self.edgesWatched:
+                self.edgesWatched = True
+                self.zk.ChildrenWatch(childrenPath(), self.onParents)
+
+    def onParents(self, parentList):
+        with self.lock:
+            for parent in set(parentList) - self.parents:
+                self.parents.add(parent)
+                self.zk.ChildrenWatch(childrenPath(parent), self.parentWatcher(parent))
+
+            for parent in self.parents - set(parentList):
+                self.parents.discard(parent)
+                self.children.pop(parent, None)
+
+    def parentWatcher(self, parent):
+        def onParentChildren(childList):
+            with self.lock:
+                if parent not in self.parents:
+                    return False  ## parent has no edges anymore, stop watching
+                if childList:
+                    self.children[parent] = sorted(childList)
+                else:
+                    self.children.pop(parent, None)
+        return onParentChildren
+
+    def onHosts(self, hostList):
+        with self.lock:
+            for host in set(hostList) - set(self.legacyVars):
+                hostPath = "{0}/hosts/{1}".format(cfg.aPath, host)
+                self.legacyVars[host] = {}
+                self.packedVars[host] = None
+                self.zk.DataWatch(hostPath, self.hostDataWatcher(host))
+                self.zk.ChildrenWatch(hostPath, self.hostChildrenWatcher(host))
+
+            for host in set(self.legacyVars) - set(hostList):
+                del self.legacyVars[host]
+                del self.packedVars[host]
+
+    def hostDataWatcher(self, host):
+        def onHostData(data, stat):
+            with self.lock:
+                if host not in self.packedVars or stat is None:
+                    return False  ## host deleted, stop watching
+                self.packedVars[host] = unpackHostVars(data)
+        return onHostData
+
+    def hostChildrenWatcher(self, host):
+        def onHostChildren(varList):
+            with self.lock:
+                if host not in self.legacyVars:
+                    return False
+                for var in set(varList) - set(self.legacyVars[host]):
+                    self.legacyVars[host][var] = None
+                    self.zk.DataWatch("{0}/hosts/{1}/{2}".format(cfg.aPath, host, var), self.varWatcher(host, var))
+        return onHostChildren
+
+    def varWatcher(self, host, var):
+        def onVarData(data, stat):
+            with self.lock:
+                if host not in self.legacyVars or var not in self.legacyVars[host]:
+                    return False
+                if stat is None:  ## hostvar deleted
+                    del self.legacyVars[host][var]
+                    return False
+                self.legacyVars[host][var] = data
+        return onVarData
+
+    def hostVars(self, host):
+        if self.packedVars[host] is not None:
+            return resolveValues(self.zk, [dict(self.packedVars[host])])[0]
+        return resolveValues(self.zk, [dict(self.legacyVars[host])])[0]
+
+    def ansibleInventory(self):
+        with self.lock:
+            groupDict = dict((group, {'hosts': list(hostList), 'vars': dict(self.groupVars[group])})
+                             for group, hostList in self.groups.items())
+            for group in set(self.children) & set(groupDict):
+                groupDict[group]['children'] = list(self.children[group])
+            groupDict['_meta'] = {'hostvars': dict((host, self.hostVars(host)) for host in self.legacyVars)}
+            return groupDict
+
+    def inventory(self, dumpMode):
+        with self.lock:
+            if dumpMode == 'hosts':
+                return sorted(self.legacyVars)
+
+            elif dumpMode == 'groups':
+                return sorted(self.groups)
+
+            dumpDict = {"hosts": sorted(self.legacyVars)}
+            if len(self.groups) > 0:
+                flatDict = flattenGroups(self.groups, self.children)
+                dumpDict["groups"] = [{group: flatDict[group]} for group in sorted(self.groups)]
+            return dumpDict
+
+    def showHostVars(self, znodeStringSplited):
+        with self.lock:
+            if len(znodeStringSplited[0]) == 2:  ## check for groupname only
+                groupName = znodeStringSplited[0][0]
+                if groupName not in self.groups:
+                    return "ERROR  ==> no such groupname: {0} !!!".format(groupName)
+                hostList = flattenGroups(self.groups, self.children)[groupName]
+                return dict((host, self.hostVars(host) if host in self.legacyVars else {}) for host in hostList)
+
+            hostName = znodeStringSplited[0][0]
+            if hostName not in self.legacyVars:
+                return "ERROR  ==> no such host: {0} !!!".format(hostName)
+            return {hostName: self.hostVars(hostName)}
+
+    def showGroupVars(self, groupName):
+        with self.lock:
+            if groupName not in self.groups:
+                return "ERROR  ==> no such groupname: {0} !!!".format(groupName)
+            return dict(self.groupVars[groupName])
+
+    def ansibleHost(self, hostName):
+        with self.lock:
+            if hostName not in self.legacyVars:
+                return "ERROR  ==> no such host: {0} !!!".format(hostName)
+            return self.hostVars(hostName)
+
+
+class InventorySnapshot(InventoryView):
+    '''
+    Inventory served from a snapshot file without zookeeper, only the index is loaded,
+    groups and hostvars are read from their records on demand.
+    '''
+
+    def __init__(self, snapshotPath):
+        self.snapshotFile = open(snapshotPath, 'rb')
+
+        magic, version, indexOffset, indexLength = SNAPSHOT_HEADER.unpack(self.snapshotFile.read(SNAPSHOT_HEADER.size))
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("bad magic")
+        if version not in SNAPSHOT_VERSIONS:
+            raise ValueError("unsupported version {0}".format(version))
+
+        self.snapshotFile.seek(indexOffset)
+        self.index = json.loads(zlib.decompress(self.snapshotFile.read(indexLength)))
+        self.index.setdefault('groupVars', {})
+        self.index.setdefault('children', {})
+
+    def record(self, entry):
+        self.snapshotFile.seek(entry[0])
+        return json.loads(zlib.decompress(self.snapshotFile.read(entry[1])))
+
+    def hostVars(self, host):
+        return self.record(self.index['hosts'][host])
+
+    def groupVars(self, group):
+        return self.record(self.index['groupVars'][group]) if group in self.index['groupVars'] else {}
+
+    def ansibleInventory(self):
+        groupDict = dict((group, {'hosts': self.record(entry), 'vars': self.groupVars(group)})
+                         for group, entry in self.index['groups'].items())
+        for group in set(self.index['children']) & set(groupDict):
+            groupDict[group]['children'] = self.index['children'][group]
+        groupDict['_meta'] = {'hostvars': dict((host, self.record(entry)) for host, entry in self.index['hosts'].items())}
+        return groupDict
+
+    def inventory(self, dumpMode):
+        if dumpMode == 'hosts':
+            return sorted(self.index['hosts'])
+
+        elif dumpMode == 'groups':
+            return sorted(self.index['groups'])
+
+        dumpDict = {"hosts": sorted(self.index['hosts'])}
+        if len(self.index['groups']) > 0:
+            flatDict = self.flatGroups(self.index['groups'])
+            dumpDict["groups"] = [{group: flatDict[group]} for group in sorted(self.index['groups'])]
+        return dumpDict
+
+    def flatGroups(self, groupList):
+        groupDict = dict((group, self.record(self.index['groups'][group])) for group in groupList)
+        return flattenGroups(groupDict, self.index['children'])
+
+    def showHostVars(self, znodeStringSplited):
+        if len(znodeStringSplited[0]) == 2:  ## check for groupname only
+            groupName = znodeStringSplited[0][0]
+            if groupName not in self.index['groups']:
+                return "ERROR  ==> no such groupname: {0} !!!".format(groupName)
+            groupList = [group for group in descendantGroups(self.index['children'], groupName) if group in self.index['groups']]
+            return dict((host, self.hostVars(host) if host in self.index['hosts'] else {})
+                        for host in self.flatGroups(groupList)[groupName])
+
+        hostName = znodeStringSplited[0][0]
+        if hostName not in self.index['hosts']:
+            return "ERROR  ==> no such host: {0} !!!".format(hostName)
+        return {hostName: self.hostVars(hostName)}
+
+    def showGroupVars(self, groupName):
+        if groupName not in self.index['groups']:
+            return "ERROR  ==> no such groupname: {0} !!!".format(groupName)
+        return self.groupVars(groupName)
+
+    def ansibleHost(self, hostName):
+        if hostName not in self.index['hosts']:
+            return "ERROR  ==> no such host: {0} !!!".format(hostName)
+        return self.hostVars(hostName)
+
+    def close(self):
+        self.snapshotFile.close()
+
+
+def queryInventoryDaemon(request, socketPath=None):
+    '''
+    Send one request line to a running --serve daemon.
+
+    Return string (JSON) or None (daemon is not running).
+    '''
+
+    import socket
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        client.connect(socketPath or cfg.socketPath)
+        client.sendall(request + '\n')
+
+        chunkList = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunkList.append(chunk)
+
+        return ''.join(chunkList).rstrip('\n') or None
+
+    except socket.error:
+        return None
+
+    finally:
+        client.close()
+
+
+def serveInventory(socketPath=None):
+    '''
+    Load inventory once, keep it current with zookeeper watches and answer
+    -I, -S and --host requests on a local unix socket until terminated.
+
+    Return string (ERROR ... || STOPPED ...).
+    '''
+
+    import signal
+
+    import SocketServer
+
+    class InventoryRequestHandler(SocketServer.StreamRequestHandler):
+        ''' One request line in, one JSON line out '''
+
+        def handle(self):
+            request = self.rfile.readline().strip()
+            self.wfile.write(self.server.watcher.answer(request) + '\n')
+
+    class InventoryServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+        ''' Unix socket server for InventoryWatcher '''
+
+        daemon_threads = True
+
+    socketPath = socketPath or cfg.socketPath
+
+    if os.path.exists(socketPath):
+        if queryInventoryDaemon('-I groups', socketPath) is not None:
+            return "ERROR  ==> inventory daemon already running on: {0} !!!".format(socketPath)
+        os.unlink(socketPath)  ## stale socket of a killed daemon
+
+    if not os.path.isdir(os.path.dirname(socketPath)):
+        os.makedirs(os.path.dirname(socketPath), 0700)
+
+    zk = zkSession.ro()
+
+    watcher = InventoryWatcher(zk)
+
+    oldUmask = os.umask(0177)  ## socket is for the owner only
+    try:
+        server = InventoryServer(socketPath, InventoryRequestHandler)
+    finally:
+        os.umask(oldUmask)
 
-        elif len(nonExistList) and len(updatedDict) > 0:
-            return "UPDATED  ==> host: {0} with new hostvars {1} ===> NOT UPDATED hostvars {2} which do not exist".format(hostName, updatedDict, nonExistList)
-    
-        else:
-            return "UPDATED  ==> host: {0} with new hostvars {1}".format(hostName, updatedDict)
+    server.watcher = watcher
+
+    def onTerm(signum, frame):
+        raise KeyboardInterrupt()
+
+    try:
+        signal.signal(signal.SIGTERM, onTerm)
+    except ValueError:  ## not in the main thread, library callers stop the server themselves
+        pass
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
 
     finally:
-        zk.stop()    
-        
-        
-def renameZnode(znodeRenameStringSplited):
+        server.server_close()
+        os.unlink(socketPath)
+
+    return "STOPPED  ==> inventory daemon on: {0}".format(socketPath)
+
+
+BATCH_READS = ('-S', '-I', '--host', '--show-group-vars')
+
+
+def batchArgs(line):
     '''
-    Rename znode for a given tuple of ((oldName, oldPath), (newName, newPath)).
+    Parse one --batch line: an operation in the commandline syntax or a JSON list of its arguments,
+    blank lines and lines starting with # are skipped.
 
-    Return string (ERROR ... || RENAMED ... || NOT RENAMED ...).
+    Return list or None (nothing to run), ValueError is raised on a line which can not be parsed.
     '''
-    
-    zk = zkStartRw()
 
-    oldName, oldPath  = znodeRenameStringSplited[0]
-    newName, newPath  = znodeRenameStringSplited[1]
-    
-    def renameHostInGroup(oldName, newName):
-        '''
-        Find a corresponding group in groups for oldName, rename host with newName
-        and delete that host.
+    import shlex
 
-        Return string (ERROR ...||RENAMED ...).
-        '''
+    line = line.strip()
+    if line == '' or line.startswith('#'):
+        return None
 
-        ## find a group where host resides and create newPath in that group
-        for child in zk.get_children('{}/groups'.format(cfg.aPath)):
-            if oldName in zk.get_children('{0}/groups/{1}'.format(cfg.aPath, child)):
-                print 'found ==> {0}/groups/{1}/{2}'.format(cfg.aPath, child, oldName)
-                tmpOldHostGroupPath = '{0}/groups/{1}/{2}'.format(cfg.aPath, child, oldName)
-                tmpNewHostGroupPath = '{0}/groups/{1}/{2}'.format(cfg.aPath, child, newName)
-                zk.ensure_path(tmpNewHostGroupPath)
-                        
-                ## delete oldPath from groups/group_to_find/host     
-                zk.delete(tmpOldHostGroupPath)
-                return "RENAMED host {0} in group {1} --> {2}".format(oldName, child, newName)
+    argList = json.loads(line) if line.startswith('[') else shlex.split(line)
 
-            else:
-                return "ERROR ---> NO GROUP FOUND !!!"
+    if len(argList) < 2 or not all(isinstance(arg, basestring) for arg in argList):
+        raise ValueError("not an operation with an argument")
 
-    try:
-        if zk.exists(oldPath) is None:
-            return "ERROR  ==> could not rename nonexistent path: {0} !!!".format(oldPath)
+    return [arg.encode('utf-8') if isinstance(arg, unicode) else arg for arg in argList]
 
-        if zk.exists(newPath) is not None:
-            return "ERROR  ==> new path already exist: {0} !!!".format(newPath)
-    
-        ## rename only when newPath does not exist
-        if zk.exists(newPath) is None:
-            if 'hosts' in oldPath:
-                ## check for hostvars, if none create newPath and delete oldPath
-                if len(zk.get_children(oldPath)) == 0:
-                    zk.ensure_path(newPath)
-                
-                    ## find, rename and delete host with no hostvars in a corresponding group
-                    renameHostInGroup(oldName, newName)
-                    zk.delete(oldPath)
-                    return "RENAMED {0} --> {1}".format(oldName, newName)
 
-                else:
-                    ## create newPath in hosts copy hostvars from oldPath 
-                    varDict = {}
-                    for child in zk.get_children(oldPath):
-                        varDict[child] = zk.get('{0}/{1}'.format(oldPath,child))[0]
-                    
-                    zk.ensure_path(newPath)
-                    for var in varDict:
-                        zk.create('{0}/{1}'.format(newPath,var),varDict[var])
+def cliOperation(argList, window=None):
+    '''
+    Run one operation given as argument list in the commandline syntax:
+    -A, -G, -U [--limit <pattern>], -D [--dry-run], -R, -S, -I, --host, --group-vars, --show-group-vars,
+    --child, --delete-child.
+
+    Return result of the operation (string, tuple (message type, message), dict or list of strings and tuples).
+    '''
 
-                    ## find, rename and delete host with no hostvars in a corresponding group
-                    renameHostInGroup(oldName, newName)
+    opt, arg, extraList = argList[0], argList[1], argList[2:]
 
-                    ## delete oldPath from hosts
-                    zk.delete(oldPath, recursive=True)
-                    return "RENAMED {0} --> {1}".format(oldName, newName)
+    if len(extraList) > 0 and not ((opt == '-U' and extraList[:1] == ['--limit'] and len(extraList) == 2) or
+                                   (opt == '-D' and extraList == ['--dry-run'])):
+        return ArgError('BAD_OPERATION', "ERROR  ==> bad operation: {0} !!! [-U arg --limit pattern|-D arg --dry-run]".format(" ".join(argList))).format()
 
-            elif 'groups' in oldPath:
-            ## look for hosts in the group, create new group
-            ## delete theirs znode in that group ONLY and create new ones in the group
+    if opt == '-A':
+        result = addHostWithHostvars(splitZnodeVarString(arg))
 
-                oldChildren = zk.get_children(oldPath)
-                zk.ensure_path(newPath)
+    elif opt == '-G':
+        result = addHostToGroup(splitZnodeString(arg))
 
-                for child in oldChildren:
-                    zk.ensure_path('{0}/{1}'.format(newPath, child))
+    elif opt == '-U' and ':' not in arg.split(',')[0]:
+        limit  = extraList[1] if len(extraList) > 0 else None
+        result = splitLimitPattern(limit) if limit is not None else None
+        if isinstance(result, basestring):
+            result = ArgError('SYNTAX_ERROR', result).format()
+        else:
+            result = updateGroupHosts(splitGroupVarString(arg), limit, window)
 
-                ## delete old group with its members
-                zk.delete(oldPath, recursive=True)
-                return "RENAMED group {0} --> {1}".format(oldName, newName)
+    elif opt == '-U':
+        result = updateZnode(splitZnodeVarString(arg))
 
-            else:
-                return "ERROR no valid keywords <groups|hosts> found"
+    elif opt == '-D':
+        result = deleteZnodeRecur(splitZnodeString(arg), extraList == ['--dry-run'])
 
-    finally:
-        zk.stop()
-            
-            
-def showHostVars(znodeStringSplited):
-    '''
-    Show hostvars for a given hosts:hostname or groupname.
-    
-    Return dict or string (in case of ERROR).
+    elif opt == '-R':
+        result = splitRenameZnodeString(arg)
+        if type(result) is list:
+            result = renameZnode(result)
+
+    elif opt == '-S':
+        result = showHostVars(splitZnodeString(arg))
+
+    elif opt == '-I' and arg == 'ansible':
+        result = ansibleInventoryDump(window)
+
+    elif opt == '-I' and arg in ('all', 'groups', 'hosts'):
+        result = inventoryDump(arg)
+
+    elif opt == '--host':
+        result = ansibleHostAccess(arg)
+
+    elif opt == '--group-vars':
+        result = updateGroupVars(splitGroupVarString(arg))
+
+    elif opt == '--show-group-vars':
+        result = showGroupVars(arg)
+
+    elif opt in ('--child', '--delete-child'):
+        groupPair = splitChildGroupString(arg)
+        if isinstance(groupPair, basestring):
+            result = ArgError('SYNTAX_ERROR', groupPair).format()
+        else:
+            result = addChildGroup(groupPair) if opt == '--child' else deleteChildGroup(groupPair)
+
+    else:
+        return ArgError('BAD_OPERATION', "ERROR  ==> bad operation: {0} !!! [-A|-G|-U|-D|-R|-S|-I|--host|--group-vars|--show-group-vars|--child|--delete-child]".format(
+            " ".join(argList))).format()
+
+    return result
+
+
+def batchOperation(argList, window=None):
     '''
+    Run one --batch operation, exceptions are reported as the result of the operation.
 
-    zk = zkStartRo()
+    Return result of the operation (string, dict or list of strings).
+    '''
 
     try:
-        if len(znodeStringSplited[0]) == 2:    ## check for groupname only
+        result = cliOperation(argList, window)
+    except Exception as error:
+        return "ERROR  ==> batch operation: {0} failed with {1}: {2} !!!".format(" ".join(argList), type(error).__name__, error)
 
-            groupName, groupPath = znodeStringSplited[0]
+    ## group-wide -U: summary last
+    if isinstance(result, list):
+        return [resultMessage(message) for message in result]
 
-            if zk.exists(groupPath) is None:
-                return "ERROR  ==> no such groupname: {0} !!!".format(groupName)
+    return resultMessage(result)
 
-            else:
-                hostList    = zk.get_children(groupPath)
-                varDict     = {}
 
-                for host in hostList:             ## build a dict with host variables
-                    tmpHostPath    = "{0}/hosts/{1}".format(cfg.aPath, host)
-                    varDict[host]  = zk.get_children('{0}'.format(tmpHostPath))
+def batchResult(lineNumber, line, result):
+    '''
+    Return string (JSON line {"line": number, "request": line, "result": result, "ok": false for ERROR results}).
+    '''
 
-                    valDict = {}
-                    for var in varDict[host]:
-                        valDict[var] = zk.get('{0}/{1}'.format(tmpHostPath, var))[0]
+    message = result[-1] if isinstance(result, list) and len(result) > 0 else result  ## group-wide -U: summary last
+    failed  = isinstance(message, basestring) and (message.startswith('ERROR') or message.startswith('SYNTAX ERROR'))
 
-                    varDict[host] = valDict
-                return varDict
-                    
-        elif len(znodeStringSplited[0]) == 3:     ## check for hostname only   
+    return json.dumps({'line': lineNumber, 'request': line.strip(), 'result': result, 'ok': not failed}, sort_keys=True)
 
-            hostName, hostPath, notUsedValue =  znodeStringSplited[0]
 
-            if zk.exists(hostPath) is None:
-                return "ERROR  ==> no such host: {0} !!!".format(hostName)
+def runBatch(lines, window=None, parallel=None):
+    '''
+    Run --batch operations, one per line, over one read-write zookeeper session.
+    Reads following each other run concurrently with up to parallel of them in flight, a write waits
+    for everything before it and runs alone, so results are the same as of a serial run.
 
-            else:
-                varDict  = {}
-                varDict[hostName]  = zk.get_children('{0}'.format(hostPath))
+    Return generator of strings (one JSON result per operation, in line order).
+    '''
 
-                valDict = {}
-                for var in varDict[hostName]:
-                    valDict[var]  = zk.get('{0}/{1}'.format(hostPath, var))[0]
+    from collections import deque
 
-                varDict[hostName] = valDict
-                return varDict
+    from multiprocessing.pool import ThreadPool
 
-        else:
-            return "ERROR with processing znodeStrings !!!"
+    parallel = parallel or cfg.batchParallel
+    pool     = ThreadPool(parallel)
+    pending  = deque()  ## (line number, line, function returning the result) in line order
+
+    zkSession.rw()
+
+    try:
+        for lineNumber, line in enumerate(lines, 1):
+            try:
+                argList = batchArgs(line)
+            except ValueError as error:
+                message = "ERROR  ==> bad batch line: {0} ({1}) !!!".format(line.strip(), error)
+                pending.append((lineNumber, line, lambda message=message: message))
+                continue
+
+            if argList is None:
+                continue
+
+            if argList[0] in BATCH_READS:
+                pending.append((lineNumber, line, pool.apply_async(batchOperation, (argList, window)).get))
+                if len(pending) >= parallel:
+                    lineNumber, line, result = pending.popleft()
+                    yield batchResult(lineNumber, line, result())
+                continue
+
+            while pending:
+                readNumber, readLine, result = pending.popleft()
+                yield batchResult(readNumber, readLine, result())
+            yield batchResult(lineNumber, line, batchOperation(argList, window))
+
+        while pending:
+            lineNumber, line, result = pending.popleft()
+            yield batchResult(lineNumber, line, result())
 
     finally:
-        zk.stop()
+        pool.close()
+        pool.join()
 
 
-def inventoryDump(dumpMode):
+class KeeperResult(object):
     '''
-    User friendly inventory dump for all|groups modes.
-    
-    Return dict or list.
+    Result of a successful library operation: code (ADDED, UPDATED, NOT_UPDATED, DRY_RUN, ..., OK for reads),
+    message as printed by the commandline and data (hostvars, inventory, per host messages of group-wide updates).
     '''
 
-    zk = zkStartRo()
+    def __init__(self, code, message=None, data=None):
+        self.code    = code
+        self.message = message
+        self.data    = data
 
-    # from ipdb import set_trace; set_trace()
-    hostsList  = sorted(zk.get_children("{}/hosts".format(cfg.aPath)))
-    groupsList = sorted(zk.get_children("{}/groups".format(cfg.aPath)))
-    dumpDict   = {"hosts": hostsList}
+    def __repr__(self):
+        return "KeeperResult({0!r}, {1!r})".format(self.code, self.message if self.message is not None else self.data)
 
-    tmpList = []
 
-    try:
-        if dumpMode == 'hosts':
-            return hostsList
+class KeeperError(Exception):
+    '''
+    Failed library operation, attributes as of KeeperResult.
+    '''
 
-        elif dumpMode == 'groups':
-            return groupsList
-
-        elif dumpMode == 'all':
-            for group in groupsList:
-                tmpDict  = {}
-                path     = "{0}/groups/{1}".format(cfg.aPath, group)
-                children = sorted(zk.get_children(path))
-                tmpDict[group] = children
-                tmpList.append(tmpDict)
-                
-                dumpDict["groups"] = tmpList
+    def __init__(self, code, message, data=None):
+        Exception.__init__(self, message)
+        self.code    = code
+        self.message = message
+        self.data    = data
 
-            return dumpDict
 
-    finally:
-        zk.stop()
+class NoSuchZnodeError(KeeperError):
+    ''' Host or group the operation needs does not exist '''
+    pass
+
+
+class ZnodeExistsError(KeeperError):
+    ''' Host, group membership or child group the operation creates exists already '''
+    pass
+
+
+class ConflictError(KeeperError):
+    ''' Znodes kept changing under concurrent writers, nothing was written '''
+    pass
+
+
+class KeeperSyntaxError(KeeperError):
+    ''' Operation or its arguments could not be parsed '''
+    pass
 
 
-def ansibleInventoryDump():
+## ArgError message types of failed operations, KeeperResult codes of the others
+KEEPER_ERROR_TYPES = {
+    'HOST_EXISTS'                   : ZnodeExistsError,
+    'HOST_EXISTS_IN_GROUP'          : ZnodeExistsError,
+    'CHILD_EXISTS'                  : ZnodeExistsError,
+    'CHILD_CYCLE'                   : ZnodeExistsError,
+    'NEW_PATH_EXISTS'               : ZnodeExistsError,
+    'HOST_DOES_NOT_EXIST'           : NoSuchZnodeError,
+    'HOST_DOES_NOT_EXISTS_IN_GROUP' : NoSuchZnodeError,
+    'GROUP_DOES_NOT_EXIST'          : NoSuchZnodeError,
+    'CHILD_DOES_NOT_EXIST'          : NoSuchZnodeError,
+    'PATH_DOES_NOT_EXIST'           : NoSuchZnodeError,
+    'NO_INVENTORY'                  : NoSuchZnodeError,
+    'CONFLICT'                      : ConflictError,
+    'NO_VALID_KEYWORDS_NUMBER'      : KeeperSyntaxError,
+    'NO_VALID_KEYWORDS_STRING'      : KeeperSyntaxError,
+    'SYNTAX_ERROR'                  : KeeperSyntaxError,
+    'BAD_OPERATION'                 : KeeperSyntaxError,
+    'BAD_TOKEN'                     : KeeperSyntaxError,
+    'BAD_DIFF_SOURCE'               : KeeperSyntaxError,
+    'NO_VARS'                       : KeeperSyntaxError,
+    'CHILD_OF_ITSELF'               : KeeperError,
+    'ADD_FAILED'                    : KeeperError,
+    'HOSTS_FAILED'                  : KeeperError,
+    'RENAME_HALF_DONE'              : KeeperError,
+    'COMPACTED'                     : KeeperError,
+    'BAD_SNAPSHOT'                  : KeeperError,
+}
+
+
+def keeperResult(result):
     '''
-    Ansible compliant inventory dump for a given list of zookeeper servers and ansible-keeper path.
-    
-    Return dict.
+    Turn what an operation function returns (message string, ArgError or CommonInformer tuple,
+    dict of a read or list of per host messages with the summary last) into a structured result.
+    Failed operations return ArgError tuples, their message type picks the exception.
+
+    Return KeeperResult, a KeeperError subclass is raised for failed operations.
     '''
 
-    ## The stock inventory script system detailed above works for all versions of Ansible, but calling --host for
-    ## every host can be rather expensive, especially if it involves expensive API calls to a remote subsystem.
-    ## In Ansible 1.3 or later, if the inventory script returns a top level element called “_meta”,
-    ## it is possible to return all of the host variables in one inventory script call. When this meta element
-    ## contains a value for “hostvars”, the inventory script will not be invoked with --host for each host.
-    ## This results in a significant performance increase for large numbers of hosts, and also makes client side
-    ## caching easier to implement for the inventory script.
-    ##
-    ## Source: http://docs.ansible.com/ansible/dev_guide/developing_inventory.html#tuning-the-external-inventory-script
+    code, data = None, None
 
-    zk = zkStartRo()
+    if isinstance(result, list):
+        result, data = (result[-1], result[:-1]) if len(result) > 0 else ('', [])
 
-    groupList = zk.get_children("{}/groups".format(cfg.aPath))
-    groupDict = {}
-    
-    for group in groupList:
-        path     = "{0}/groups/{1}".format(cfg.aPath, group)
-        children = zk.get_children(path)
-        tmpDict  = {}
-        tmpDict['hosts'] = children
-        tmpDict['vars']  = {} ## not yet implemented
-        groupDict[group] = tmpDict
-        
-    ## building ansible compliant hostvars dict:
-    ##
-    ## {"_meta": {
-    ##     "hostvars": {
-    ##         "moocow.example.com": {"asdf" : 1234, "var2": 111 },
-    ##         "llama.example.com": {"asdf": 5678, "var2": 222 }
-    ##     }
-    ## }}
+    if type(result) is tuple:
+        code, message = result
 
-    hostList    = zk.get_children("{}/hosts".format(cfg.aPath))
-    hostVarDict = {}
-    varDict     = {}
+    elif isinstance(result, basestring):
+        message = result
 
-    for host in hostList:             ## build a dict with host variables
-        tmpHostPath    = "{0}/hosts/{1}".format(cfg.aPath, host)
-        varDict[host]  = zk.get_children('{0}'.format(tmpHostPath))
+    else:
+        return KeeperResult('OK', None, result)
 
-        valDict = {}
-        for var in varDict[host]:
-            valDict[var] = zk.get('{0}/{1}'.format(tmpHostPath, var))[0]
+    if code in KEEPER_ERROR_TYPES:
+        errorClass = KEEPER_ERROR_TYPES[code]
+        if not message.startswith('ERROR') and not message.startswith('SYNTAX ERROR'):
+            message = ("SYNTAX ERROR --> " if errorClass is KeeperSyntaxError else "ERROR  ==> ") + message
+        raise errorClass(code, message, data)
 
-        varDict[host] = valDict
+    if code is None:
+        code = message.split('==>')[0].strip().replace(' ', '_') if '==>' in message else 'OK'
 
-    ## modify output dict to be compliant with ansible >= 1.3 version
-    hostVarDict['hostvars'] = varDict
-    groupDict['_meta']      = hostVarDict
-    
-    zk.stop()
-    return groupDict
+    return KeeperResult(code, message, data)
 
 
-def ansibleHostAccess(hostName):
+class KeeperFuture(object):
+    '''
+    Pending library operation submitted with AnsibleKeeper.submit().
     '''
-    Ansible pre 1.3 compliant hostvars dump.
 
-    Return dict.
+    def __init__(self, asyncResult):
+        self.asyncResult = asyncResult
+
+    def done(self):
+        return self.asyncResult.ready()
+
+    def result(self, timeout=None):
+        '''
+        Wait for the operation.
+
+        Return KeeperResult, KeeperError of a failed operation is raised.
+        '''
+
+        if timeout is None:
+            timeout = 365 * 24 * 3600.0  ## get() without timeout can not be interrupted in python 2
+        return self.asyncResult.get(timeout)
+
+
+## open AnsibleKeeper clients, all of them use the module cfg and zkSession
+keeperClients = []
+keeperSaved   = []  ## (cfg.zkServers, cfg.aPath, zkSession) before the first client, restored after the last one
+keeperLock    = thread.allocate_lock()
+
+
+class AnsibleKeeper(object):
+    '''
+    Library client: operations of the commandline as methods over one zookeeper session, with structured
+    results (KeeperResult) and exceptions (KeeperError subclasses) instead of message strings.
+    submit() runs operations concurrently on a pool of threads sharing the session (kazoo is thread safe),
+    gather() waits for them, so a service adds hundreds of hosts without spawning processes.
+
+    Operation functions of this module use the module zookeeper session and cfg: the first client installs
+    its servers, path and session there, more clients share them and one asking for others is refused
+    with KeeperError (CONFIG_CONFLICT) until all open clients are closed. The last one closing puts back
+    what was there before the first one.
     '''
 
-    ## Before version 1.0, each group could only have a list of hostnames/IP addresses, like the webservers,
-    ## marietta, and 5points groups above.
-    ##
-    ## When called with the arguments --host <hostname> (where <hostname> is a host from above), the script
-    ## must print either an empty JSON hash/dictionary, or a hash/dictionary of variables to make available
-    ## to templates and playbooks. Printing variables is optional, if the script does not wish to do this,
-    ## printing an empty hash/dictionary is the way to go
-    ##
-    ## Source: http://docs.ansible.com/ansible/dev_guide/developing_inventory.html#script-conventions
-    
-    zk = zkStartRo()
+    def __init__(self, servers=None, path=None, client=None, parallel=None, window=None):
+        global zkSession
+
+        with keeperLock:
+            if len(keeperClients) > 0:
+                conflictList = [name for name, wanted, current in (('servers', servers, cfg.zkServers), ('path', path, cfg.aPath))
+                                if wanted is not None and wanted != current]
+                if client is not None and client is not zkSession.client:
+                    conflictList.append('client')
+                if len(conflictList) > 0:
+                    raise KeeperError('CONFIG_CONFLICT', "ERROR  ==> another AnsibleKeeper with other {0} is open in this process !!! close it first".format(
+                        ", ".join(conflictList)))
+            else:
+                keeperSaved.append((cfg.zkServers, cfg.aPath, zkSession))
+                if servers is not None:
+                    cfg.zkServers = servers
+                if path is not None:
+                    cfg.aPath = path
+                if client is not None:
+                    zkSession = ZkSession(client)
+
+            keeperClients.append(self)
+
+        self.session  = zkSession
+        self.window   = window
+        self.parallel = parallel or cfg.batchParallel
+        self.pool     = None
+
+        ## connect before threads share the session, concurrent first writes would each open one
+        try:
+            self.session.rw()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        global zkSession
+
+        ## the session is shared, the last client closes it and restores servers, path and session
+        with keeperLock:
+            if self not in keeperClients:
+                return
+            keeperClients.remove(self)
+            if len(keeperClients) == 0:
+                self.session.close()
+                cfg.zkServers, cfg.aPath, zkSession = keeperSaved.pop()
+
+    def submit(self, method, *args, **kwargs):
+        '''
+        Run a method of this client on the thread pool.
 
-    hostPath = "{0}/hosts/{1}".format(cfg.aPath, hostName)
+        Return KeeperFuture.
+        '''
+
+        if self.pool is None:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(self.parallel)
+        return KeeperFuture(self.pool.apply_async(method, args, kwargs))
+
+    def gather(self, futureList):
+        '''
+        Wait for submitted operations.
+
+        Return list (KeeperResult or KeeperError of every operation, in the order of futureList).
+        '''
+
+        resultList = []
+        for future in futureList:
+            try:
+                resultList.append(future.result())
+            except KeeperError as error:
+                resultList.append(error)
+        return resultList
+
+    def run(self, argList):
+        '''
+        Run one operation given in the commandline syntax, as of --batch: ['-A', 'group:host,var:value'].
+        Unexpected exceptions are raised as KeeperError with code FAILED.
+
+        Return KeeperResult.
+        '''
+
+        try:
+            result = cliOperation(argList, self.window)
+        except KeeperError:
+            raise
+        except Exception as error:
+            raise KeeperError('FAILED', "ERROR  ==> operation: {0} failed with {1}: {2} !!!".format(
+                " ".join(argList), type(error).__name__, error))
+
+        return keeperResult(result)
+
+    ## writes
+
+    def addHost(self, groupName, hostName, varDict=None):
+        return keeperResult(addHostWithHostvars({groupName: {hostName: dict(varDict or {})}}))
+
+    def addHostToGroup(self, groupName, hostName):
+        return keeperResult(addHostToGroup(splitZnodeString("{0}:{1}".format(groupName, hostName))))
+
+    def updateHost(self, hostName, varDict):
+        return keeperResult(updateZnode({'hosts': {hostName: dict(varDict)}}))
+
+    def updateGroupHosts(self, groupName, varDict, limit=None):
+        '''
+        Return KeeperResult (data: list of per host messages), KeeperError is raised when any host failed.
+        '''
+
+        if limit is not None and isinstance(splitLimitPattern(limit), basestring):
+            return keeperResult(ArgError('SYNTAX_ERROR', splitLimitPattern(limit)).format())
+
+        groupVarTuple = (groupName, "{0}/groups/{1}".format(cfg.aPath, groupName), dict(varDict))
+        return keeperResult(updateGroupHosts(groupVarTuple, limit, self.window))
+
+    def deleteHost(self, hostName, dryRun=False):
+        return keeperResult(deleteZnodeRecur(splitZnodeString("hosts:" + hostName), dryRun))
+
+    def deleteGroup(self, groupName, dryRun=False):
+        return keeperResult(deleteZnodeRecur(splitZnodeString(groupName), dryRun))
+
+    def deleteHostFromGroup(self, groupName, hostName):
+        return keeperResult(deleteZnodeRecur(splitZnodeString("{0}:{1}".format(groupName, hostName))))
+
+    def renameHost(self, oldName, newName):
+        return self.run(['-R', "hosts:{0}:{1}".format(oldName, newName)])
+
+    def renameGroup(self, oldName, newName):
+        return self.run(['-R', "groups:{0}:{1}".format(oldName, newName)])
+
+    def setGroupVars(self, groupName, varDict):
+        return keeperResult(updateGroupVars((groupName, "{0}/groups/{1}".format(cfg.aPath, groupName), dict(varDict))))
+
+    def addChildGroup(self, parentGroup, childGroup):
+        return keeperResult(addChildGroup((parentGroup, childGroup)))
+
+    def deleteChildGroup(self, parentGroup, childGroup):
+        return keeperResult(deleteChildGroup((parentGroup, childGroup)))
+
+    ## reads, KeeperResult.data is the answer
+
+    def hostVars(self, hostName):
+        return keeperResult(ansibleHostAccess(hostName, self.window))
+
+    def groupHostVars(self, groupName):
+        return keeperResult(showHostVars(splitZnodeString(groupName)))
+
+    def groupVars(self, groupName):
+        return keeperResult(showGroupVars(groupName))
+
+    def inventory(self, limit=None):
+        if limit is not None and isinstance(splitLimitPattern(limit), basestring):
+            return keeperResult(ArgError('SYNTAX_ERROR', splitLimitPattern(limit)).format())
+        return keeperResult(ansibleInventoryDump(self.window, limit))
+
+    def changesSince(self, token):
+        return keeperResult(changesSince(token, self.window))
+
+    def hashes(self, store=False):
+        return keeperResult(inventoryHashes(self.window, store))
+
+    def diff(self, sourceA, sourceB):
+        return keeperResult(diffInventories(sourceA, sourceB, self.window))
+
+    def validate(self, inventory):
+        return keeperResult(validateInventory(inventory, self.window))
+
+
+def cliRun(keeper, argList):
+    '''
+    Run one commandline operation with the library client and print what it returned, failures included.
+
+    Return None.
+    '''
 
     try:
-        if zk.exists(hostPath) is None:
-            return "ERROR  ==> no such host: {0} !!!".format(hostName)
+        result = keeper.run(argList)
+    except KeeperError as error:
+        result = error
 
-        else:
-            varList = zk.get_children('{0}'.format(hostPath))
-      
-            varDict = {}
-            for var in varList:
-                varDict[var]  = zk.get('{0}/{1}'.format(hostPath, var))[0]
+    for message in result.data if isinstance(result.data, list) else []:
+        print message
+
+    print result.message if result.message is not None else json.dumps(result.data)
 
-            return varDict
 
-    finally:
-        zk.stop()   
-        
-    
 def main():
     '''
     Main logic
     '''
 
-    zk  = zkStartRw()
+    ## ansible calls --host for every host, answer it before anything else is set up
+    if hostFastPath(sys.argv[1:]):
+        return
+
+    opts = oParser()
+    cfg.debug = opts['debug']
+    cfg.stats = cfg.stats or opts['stats']
+    encode    = zkStats.timed('json encode', json.dumps)
+
+    if opts['limit'] is not None and isinstance(splitLimitPattern(opts['limit']), basestring):
+        print splitLimitPattern(opts['limit'])
+        return
+
+    ## writes need a read-write connection, open it right away instead of upgrading a read-only one
+    if (opts['addMode'] or opts['groupMode'] or opts['updateMode'] or opts['deleteMode'] or
+        opts['renameMode'] or opts['migrateMode'] or opts['importFile'] or opts['reindex'] or opts['chunkGc'] or
+        opts['snapshotImport'] or opts['groupVars'] or opts['childGroup'] or opts['deleteChild'] or
+        opts['batchFile']) is not None:
+        keeper = AnsibleKeeper(window=opts['window'])
+    else:
+        keeper = None
+
     try:
-        assert type(zk).__name__ == 'KazooClient'
+        ## offline mode: reads are answered from a snapshot file, no zookeeper connection at all
+        if opts['fromSnapshot'] is not None:
+            snapshot = openSnapshot(opts['fromSnapshot'])
 
-    finally:
-        zk.stop()
+            if isinstance(snapshot, basestring):
+                print snapshot
+                return
 
-   
-    ## options for ansible only 
-    if oParser()['ansibleHost'] is not None:
-        print json.dumps(ansibleHostAccess(oParser()['ansibleHost']))
+            if opts['ansibleHost'] is not None:
+                print encode(snapshot.ansibleHost(opts['ansibleHost']))
 
-    if oParser()['inventoryMode'] == 'ansible':
-        print json.dumps(ansibleInventoryDump())
+            if opts['inventoryMode'] == 'ansible' and opts['limit'] is not None:
+                print encode(limitAnsibleInventory(snapshot.ansibleInventory(), opts['limit']), sort_keys=True)
 
-    ## options for users
-    if oParser()['inventoryMode'] == 'all':
-        print json.dumps(inventoryDump('all'))
+            elif opts['inventoryMode'] == 'ansible':
+                print encode(snapshot.ansibleInventory(), sort_keys=True)
 
-    if oParser()['inventoryMode'] == 'groups':
-        print json.dumps(inventoryDump('groups'))
+            elif opts['inventoryMode'] is not None:
+                print encode(snapshot.inventory(opts['inventoryMode']))
 
-    if oParser()['inventoryMode'] == 'hosts':
-        print json.dumps(inventoryDump('hosts'))
+            if opts['showMode'] is not None:
+                print encode(snapshot.showHostVars(splitZnodeString(opts['showMode'])))
 
-    if oParser()['addMode'] is not None:
-        znodeDict = splitZnodeVarString(oParser()['addMode'])
-        print addHostWithHostvars(znodeDict)
+            if opts['showGroupVars'] is not None:
+                print encode(snapshot.showGroupVars(opts['showGroupVars']))
 
-    if oParser()['groupMode'] is not None:
-        znodeStringSplited = splitZnodeString(oParser()['groupMode'])
-        print addHostToGroup(znodeStringSplited)
- 
-    if oParser()['updateMode'] is not None:
-        znodeDict = splitZnodeVarString(oParser()['updateMode'])
-        print updateZnode(znodeDict)
-        
-    if oParser()['deleteMode'] is not None:
-        znodeStringSplited = splitZnodeString(oParser()['deleteMode'])
-        print deleteZnodeRecur(znodeStringSplited)
-
-    if oParser()['renameMode'] is not None:
-        znodeRenameStringSplited = splitRenameZnodeString(oParser()['renameMode'])
-        if type(znodeRenameStringSplited) is list:
-            print renameZnode(znodeRenameStringSplited)
-        else:
-            print znodeRenameStringSplited
-            
-    if oParser()['showMode'] is not None:
-        znodeStringSplited = splitZnodeString(oParser()['showMode'])
-        print json.dumps(showHostVars(znodeStringSplited))
+            return
+
+        ## options for ansible only 
+        if opts['ansibleHost'] is not None:
+            if opts['noCache']:
+                print encode(resultMessage(ansibleHostAccess(opts['ansibleHost'])))
+            else:
+                print encode(cachedAnsibleHostAccess(opts['ansibleHost'], opts['window'], opts['cacheTtl']))
+
+        if opts['inventoryMode'] == 'ansible':
+            if opts['noCache']:
+                chunks = ansibleInventoryChunks(opts['window'], opts['limit'])
+            else:
+                chunks = cachedAnsibleInventoryChunks(opts['window'], opts['cacheTtl'], opts['limit'])
+
+            ## stream groups and hosts as they are fetched instead of building the whole inventory first
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            sys.stdout.write('\n')
+
+        if opts['fetchSpeedup']:
+            print fetchSpeedup(opts['window'])
+
+        ## options for users
+        if opts['inventoryMode'] == 'all':
+            print encode(inventoryDump('all'))
+
+        if opts['inventoryMode'] == 'groups':
+            print encode(inventoryDump('groups'))
+
+        if opts['inventoryMode'] == 'hosts':
+            print encode(inventoryDump('hosts'))
+
+        ## writes go through the library client, one operation per option in commandline syntax
+        if opts['addMode'] is not None:
+            cliRun(keeper, ['-A', opts['addMode']])
+
+        if opts['groupMode'] is not None:
+            cliRun(keeper, ['-G', opts['groupMode']])
+
+        if opts['updateMode'] is not None:
+            ## no host given: every host of the group (or all, narrowed by --limit)
+            limitList = ['--limit', opts['limit']] if opts['limit'] is not None and ':' not in opts['updateMode'].split(',')[0] else []
+            cliRun(keeper, ['-U', opts['updateMode']] + limitList)
+
+        if opts['deleteMode'] is not None:
+            cliRun(keeper, ['-D', opts['deleteMode']] + (['--dry-run'] if opts['dryRun'] else []))
+
+        if opts['renameMode'] is not None:
+            cliRun(keeper, ['-R', opts['renameMode']])
+
+        if opts['showMode'] is not None:
+            znodeStringSplited = splitZnodeString(opts['showMode'])
+            if opts['noCache']:
+                print encode(resultMessage(showHostVars(znodeStringSplited)))
+            else:
+                print encode(resultMessage(cachedShowHostVars(znodeStringSplited, opts['window'], opts['cacheTtl'])))
+
+        if opts['groupVars'] is not None:
+            cliRun(keeper, ['--group-vars', opts['groupVars']])
+
+        if opts['showGroupVars'] is not None:
+            print encode(resultMessage(showGroupVars(opts['showGroupVars'])))
+
+        if opts['childGroup'] is not None:
+            cliRun(keeper, ['--child', opts['childGroup']])
+
+        if opts['deleteChild'] is not None:
+            cliRun(keeper, ['--delete-child', opts['deleteChild']])
+
+        if opts['migrateMode'] is not None:
+            print migrateStorageFormat(opts['migrateMode'])
+
+        if opts['importFile'] is not None:
+            print importInventory(opts['importFile'])
+
+        if opts['changesSince'] is not None:
+            print encode(resultMessage(changesSince(opts['changesSince'], opts['window'])), sort_keys=True)
+
+        if opts['reindex']:
+            print rebuildMembershipIndex()
+            print rebuildDigestIndex(opts['window'])
+
+        if opts['valueStats']:
+            print encode(valueStats(opts['window'], bool(opts['chunkGc'])), sort_keys=True)
+
+        if opts['hashes']:
+            print encode(hashesSummary(inventoryHashes(opts['window'])), sort_keys=True)
+
+        if opts['diff'] is not None:
+            print encode(resultMessage(diffInventories(opts['diff'][0], opts['diff'][1], opts['window'])), sort_keys=True)
+
+        if opts['snapshotExport'] is not None:
+            print exportSnapshot(opts['snapshotExport'], opts['window'])
+
+        if opts['snapshotImport'] is not None:
+            print importSnapshot(opts['snapshotImport'])
+
+        if opts['serveMode']:
+            print serveInventory()
+
+        if opts['batchFile'] is not None:
+            try:
+                batchLines = sys.stdin if opts['batchFile'] == '-' else open(opts['batchFile'])
+            except IOError as error:
+                print "ERROR  ==> could not read batch file: {0} ({1}) !!!".format(opts['batchFile'], error.strerror)
+                return
+
+            ## readline instead of file iteration: results of a pipe are answered line by line
+            for result in runBatch(iter(batchLines.readline, ''), opts['window']):
+                print result
+                sys.stdout.flush()
+
+    finally:
+        zkSession.close()
+
+        if cfg.debug:
+            sys.stderr.write("DEBUG  ==> zookeeper connections: {0} setup time: {1:.3f}s\n".format(
+                zkSession.connects, zkSession.connectTime))
+
+        if opts['stats']:
+            sys.stderr.write(zkStats.report() + "\n")
                                   
         
 if __name__ == "__main__":
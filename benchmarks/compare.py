@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compare two benchmark results files written by benchmarks/run.py.
+'''
+
+__author__     = "Jan Kogut"
+__copyright__  = "Jan Kogut"
+__license__    = "MIT"
+__version__    = "0.0.1"
+__maintainer__ = "Jan Kogut"
+__status__     = "Beta"
+
+
+import sys
+import json
+
+
+def compareResults(base, new):
+    '''
+    Compare operations present in both results.
+
+    Return list of tuples (name, base wall, new wall, speedup, base requests, new requests, base RSS, new RSS).
+    '''
+
+    rowList = []
+
+    for name in sorted(set(base['operations']) & set(new['operations'])):
+        baseOp, newOp = base['operations'][name], new['operations'][name]
+        if 'error' in baseOp or 'error' in newOp:
+            continue
+
+        rowList.append((name, baseOp['wall'], newOp['wall'], baseOp['wall'] / max(newOp['wall'], 1e-9),
+                        baseOp['requestsTotal'], newOp['requestsTotal'], baseOp['peakRssKb'], newOp['peakRssKb']))
+
+    return rowList
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.stderr.write("usage: compare.py base.json new.json\n")
+        exit(-1)
+
+    with open(sys.argv[1]) as baseFile, open(sys.argv[2]) as newFile:
+        base, new = json.load(baseFile), json.load(newFile)
+
+    for results in (base, new):
+        print "{0}: {1} backend, shape: {2}".format(results['meta']['commit'], results['meta']['backend'],
+                                                    json.dumps(results['meta']['shape'], sort_keys=True))
+
+    print "{0:<36} {1:>10} {2:>10} {3:>8} {4:>9} {5:>9} {6:>9} {7:>9}".format(
+        'operation', 'base s', 'new s', 'speedup', 'base req', 'new req', 'base kB', 'new kB')
+
+    for row in compareResults(base, new):
+        print "{0:<36} {1:>10.4f} {2:>10.4f} {3:>7.2f}x {4:>9} {5:>9} {6:>9} {7:>9}".format(*row)
+
+
+if __name__ == "__main__":
+    main()
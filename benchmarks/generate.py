@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Synthetic inventory generator for benchmarks.
+'''
+
+__author__     = "Jan Kogut"
+__copyright__  = "Jan Kogut"
+__license__    = "MIT"
+__version__    = "0.0.1"
+__maintainer__ = "Jan Kogut"
+__status__     = "Beta"
+
+
+import random
+import ansibleKeeper as ak
+
+
+DEFAULT_SHAPE = {'hosts': 1000, 'groups': 50, 'memberships': 2, 'vars': 10, 'valueSize': 32,
+                 'format': 'legacy', 'seed': 1}
+
+
+def inventoryShape(**kwargs):
+    '''
+    Inventory shape with defaults for missing keys.
+
+    Return dict.
+    '''
+
+    shape = dict(DEFAULT_SHAPE)
+    shape.update((key, value) for key, value in kwargs.items() if value is not None)
+    return shape
+
+
+def syntheticInventory(shape):
+    '''
+    Build a deterministic inventory of a given shape: every host is a member of `memberships`
+    random groups and has `vars` hostvars with values of `valueSize` characters.
+
+    Return tuple (dict {groupname: [hostname, ...]}, dict {hostname: {var: value}}).
+    '''
+
+    rand      = random.Random(shape['seed'])
+    groupList = ["group{0:04d}".format(i) for i in range(shape['groups'])]
+    groupDict = dict((group, []) for group in groupList)
+    varDict   = {}
+
+    for i in range(shape['hosts']):
+        host = "host{0:06d}.bench".format(i)
+        varDict[host] = dict(("var{0:03d}".format(j), "".join(rand.choice('abcdefghijklmnopqrstuvwxyz0123456789')
+                                                               for k in range(shape['valueSize'])))
+                             for j in range(shape['vars']))
+
+        for group in rand.sample(groupList, min(shape['memberships'], len(groupList))):
+            groupDict[group].append(host)
+
+    return groupDict, varDict
+
+
+def generateInventory(zk, shape):
+    '''
+    Write synthetic inventory of a given shape under cfg.aPath with batched multi requests,
+    in the storage format of the shape, with host to groups index and generation stamp.
+
+    Return tuple (dict {groupname: [hostname, ...]}, dict {hostname: {var: value}}).
+    '''
+
+    groupDict, varDict = syntheticInventory(shape)
+
+    for path in ("hosts", "groups", "memberships", "journal"):
+        zk.ensure_path("{0}/{1}".format(ak.cfg.aPath, path))
+
+    ops = []
+    if shape['format'] == 'packed':
+        ops.append(('create', "{}/format".format(ak.cfg.aPath), ak.FORMAT_VERSIONS['packed']))
+
+    for host in sorted(varDict):
+        hostPath = "{0}/hosts/{1}".format(ak.cfg.aPath, host)
+        if shape['format'] == 'packed':
+            ops.append(('create', hostPath, ak.packHostVars(varDict[host])))
+        else:
+            ops.append(('create', hostPath, ''))
+            ops.extend(('create', "{0}/{1}".format(hostPath, var), value) for var, value in sorted(varDict[host].items()))
+        ops.append(('create', ak.membershipPath(host), ''))
+
+    for group in sorted(groupDict):
+        ops.append(('create', "{0}/groups/{1}".format(ak.cfg.aPath, group), ''))
+        for host in groupDict[group]:
+            ops.append(('create', "{0}/groups/{1}/{2}".format(ak.cfg.aPath, group, host), ''))
+            ops.append(('create', ak.membershipPath(host, group), ''))
+
+    for batch in ak.opBatches(ops):
+        failed = ak.commitOps(zk, batch)
+        if failed is not None:
+            raise failed[1]
+
+    ak.bumpGeneration(zk)
+    return groupDict, varDict
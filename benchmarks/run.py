@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark suite for ansibleKeeper.py: generates a synthetic inventory under a scratch cfg.aPath,
+runs CLI operations and library functions against it and records wall time, zookeeper
+request counts and peak RSS to a JSON results file.
+
+Every measured operation runs in its own forked process, so peak RSS belongs to that operation
+and writes of one operation are not seen by the others on the in-process backend.
+'''
+
+__author__     = "Jan Kogut"
+__copyright__  = "Jan Kogut"
+__license__    = "MIT"
+__version__    = "0.0.1"
+__maintainer__ = "Jan Kogut"
+__status__     = "Beta"
+
+
+import os
+import re
+import sys
+import json
+import time
+import platform
+import resource
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ansibleKeeper as ak
+from benchmarks.generate import inventoryShape, generateInventory
+
+
+def cliMain(argv):
+    '''
+    Run ansibleKeeper.py main() in-process with a given command line.
+
+    Return None.
+    '''
+
+    oldArgv  = sys.argv
+    sys.argv = ['ansibleKeeper.py'] + argv
+
+    try:
+        ak.main()
+    finally:
+        sys.argv = oldArgv
+
+
+def benchmarkOperations(ctx):
+    '''
+    Operations to measure, tuples (name, setup, run, cleanup); setup and cleanup are not measured,
+    cleanup restores the inventory on a shared zookeeper.
+
+    Return list of tuples.
+    '''
+
+    host, group, window = ctx['host'], ctx['group'], str(ctx['window'])
+    renamed = host + '-renamed'
+    noop    = lambda: None
+
+    def consume(chunks):
+        for chunk in chunks:
+            pass
+
+    return [
+        ('lib ansibleInventoryDump', noop, lambda: ak.ansibleInventoryDump(ctx['window']), noop),
+        ('lib ansibleInventoryChunks', noop, lambda: consume(ak.ansibleInventoryChunks(ctx['window'])), noop),
+        ('lib ansibleInventoryDumpSerial', noop, ak.ansibleInventoryDumpSerial, noop),
+        ('lib inventoryDump all', noop, lambda: ak.inventoryDump('all'), noop),
+        ('lib showHostVars group', noop, lambda: ak.showHostVars(ak.splitZnodeString(group)), noop),
+        ('lib showHostVars host', noop, lambda: ak.showHostVars(ak.splitZnodeString('hosts:' + host)), noop),
+        ('lib renameZnode host', noop,
+         lambda: ak.renameZnode(ak.splitRenameZnodeString('hosts:{0}:{1}'.format(host, renamed))),
+         lambda: ak.renameZnode(ak.splitRenameZnodeString('hosts:{0}:{1}'.format(renamed, host)))),
+        ('lib updateZnode', noop, lambda: ak.updateZnode(ak.splitZnodeVarString(
+            '{0}:{1},var000:{2}'.format(group, host, 'x' * ctx['shape']['valueSize']))), noop),
+        ('cli -I ansible --no-cache', noop, lambda: cliMain(['-I', 'ansible', '--no-cache', '--window', window]), noop),
+        ('cli -I ansible cached', lambda: cliMain(['-I', 'ansible']), lambda: cliMain(['-I', 'ansible']), noop),
+        ('cli -I all', noop, lambda: cliMain(['-I', 'all']), noop),
+        ('cli -S group', noop, lambda: cliMain(['-S', group]), noop),
+        ('cli --host --no-cache', noop, lambda: cliMain(['--host', host, '--no-cache']), noop),
+        ('cli --host cached', lambda: cliMain(['-I', 'ansible']), lambda: cliMain(['--host', host]), noop),
+        ('cli -R hosts', noop, lambda: cliMain(['-R', 'hosts:{0}:{1}'.format(host, renamed)]),
+         lambda: cliMain(['-R', 'hosts:{0}:{1}'.format(renamed, host)])),
+    ]
+
+
+def runIsolated(func):
+    '''
+    Run function in a forked process.
+
+    Return dict returned by the function or {'error': ...}.
+    '''
+
+    readFd, writeFd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(readFd)
+        try:
+            result = func()
+        except BaseException as error:
+            result = {'error': repr(error)}
+
+        with os.fdopen(writeFd, 'w') as resultFile:
+            json.dump(result, resultFile)
+        os._exit(0)
+
+    os.close(writeFd)
+    with os.fdopen(readFd) as resultFile:
+        output = resultFile.read()
+    os.waitpid(pid, 0)
+
+    try:
+        return json.loads(output)
+    except ValueError:
+        return {'error': 'benchmark process died'}
+
+
+def measure(clientFactory, setup, run, cleanup):
+    '''
+    Measure one run of an operation with a fresh zookeeper session and fresh ansibleKeeper.py stats.
+
+    Return dict (wall time, requests by method, latency percentiles, phases, peak RSS in kB).
+    '''
+
+    sys.stdout = open(os.devnull, 'w')  ## forked process, output of measured operations is not needed
+
+    ak.cfg.stats   = True
+    ak.KazooClient = clientFactory
+    ak.zkStats, ak.zkSession = ak.ZkStats(), ak.ZkSession()
+
+    setup()
+    ak.zkStats, ak.zkSession = ak.ZkStats(), ak.ZkSession()  ## setup is not part of the measured operation
+
+    startTime = time.time()
+    run()
+    wallTime  = time.time() - startTime
+
+    summary = ak.zkStats.summary()
+    cleanup()
+    ak.zkSession.close()
+
+    return {'wall': wallTime, 'requests': summary['requests'], 'phases': summary['phases'],
+            'latency': dict((method, dict((key, latency[key]) for key in ('mean', 'p50', 'p99', 'max')))
+                            for method, latency in summary['latency'].items()),
+            'peakRssKb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def gitCommit():
+    '''
+    Return string (short commit hash of the benchmarked tree or None).
+    '''
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runBenchmarks(opts):
+    '''
+    Generate inventory, measure all selected operations and clean up the scratch path.
+
+    Return dict (results).
+    '''
+
+    shape = inventoryShape(hosts=opts.hosts, groups=opts.groups, memberships=opts.memberships,
+                           vars=opts.vars, valueSize=opts.valueSize, format=opts.format, seed=opts.seed)
+
+    ak.cfg.aPath    = opts.aPath or "/ansible-keeper-bench-{0}".format(os.getpid())
+    ak.cfg.cacheDir = tempfile.mkdtemp(prefix='ansible-keeper-bench-')
+
+    if opts.zkServers:
+        ak.cfg.zkServers = opts.zkServers
+        clientFactory    = ak.kazooClientClass()
+        backend          = 'zookeeper'
+    else:
+        clientFactory    = ak.memoryClientFactory(ak.MemoryTree(opts.latency))
+        backend          = 'memory'
+
+    ak.KazooClient = clientFactory
+    ak.zkSession   = ak.ZkSession()
+
+    startTime = time.time()
+    groupDict, varDict = generateInventory(ak.zkSession.rw(), shape)
+    generateTime = time.time() - startTime
+    ak.zkSession.close()  ## forked processes open their own sessions
+
+    ctx = {'shape': shape, 'window': opts.window, 'host': sorted(varDict)[0],
+           'group': sorted(group for group in groupDict if groupDict[group])[0]}
+
+    results = {'meta': {'commit': gitCommit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'python': platform.python_version(), 'backend': backend, 'zkServers': opts.zkServers,
+                        'latency': opts.latency if backend == 'memory' else None, 'shape': shape,
+                        'window': opts.window, 'repeat': opts.repeat, 'generateTime': generateTime},
+               'operations': {}}
+
+    try:
+        for name, setup, run, cleanup in benchmarkOperations(ctx):
+            if opts.only and not re.search(opts.only, name):
+                continue
+
+            runList = [runIsolated(lambda: measure(clientFactory, setup, run, cleanup)) for i in range(opts.repeat)]
+            errorList = [result['error'] for result in runList if 'error' in result]
+
+            if errorList:
+                results['operations'][name] = {'error': errorList[0]}
+            else:
+                wallList = sorted(result['wall'] for result in runList)
+                results['operations'][name] = {
+                    'wall': wallList[len(wallList) // 2], 'wallMin': wallList[0], 'wallMax': wallList[-1],
+                    'requests': runList[-1]['requests'], 'requestsTotal': sum(runList[-1]['requests'].values()),
+                    'latency': runList[-1]['latency'], 'phases': runList[-1]['phases'],
+                    'peakRssKb': max(result['peakRssKb'] for result in runList)}
+
+            sys.stderr.write("BENCH  ==> {0}: {1}\n".format(name, json.dumps(results['operations'][name], sort_keys=True)))
+
+    finally:
+        if backend == 'zookeeper' and not opts.keep:
+            ak.zkSession = ak.ZkSession()
+            ak.zkSession.rw().delete(ak.cfg.aPath, recursive=True)
+            ak.zkSession.close()
+
+    return results
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [opts]")
+    parser.add_option("--zk", dest="zkServers",
+                      help="benchmark against a zookeeper ensemble instead of the in-memory backend: --zk localhost:2181")
+    parser.add_option("--latency", type="float", default=0.0005,
+                      help="round trip latency of the in-memory backend in seconds: --latency 0.0005")
+    parser.add_option("--path", dest="aPath",
+                      help="scratch ansible-keeper path, deleted afterwards: --path /ansible-keeper-bench")
+    parser.add_option("--keep", action="store_true", default=False,
+                      help="keep generated inventory on zookeeper")
+    parser.add_option("--hosts", type="int", help="number of hosts: --hosts 1000")
+    parser.add_option("--groups", type="int", help="number of groups: --groups 50")
+    parser.add_option("--memberships", type="int", help="groups per host: --memberships 2")
+    parser.add_option("--vars", type="int", help="hostvars per host: --vars 10")
+    parser.add_option("--value-size", type="int", dest="valueSize", help="hostvar value length: --value-size 32")
+    parser.add_option("--format", help="hostvars storage format: --format legacy|packed")
+    parser.add_option("--seed", type="int", help="random seed of the generator: --seed 1")
+    parser.add_option("--window", type="int", default=ak.cfg.asyncWindow,
+                      help="async window of pipelined fetches: --window 128")
+    parser.add_option("--repeat", type="int", default=3, help="runs per operation, median is reported: --repeat 3")
+    parser.add_option("--only", help="regex selecting operations by name: --only 'ansibleInventory'")
+    parser.add_option("--output", "-o", help="results file: --output results.json (default stdout)")
+
+    opts, args = parser.parse_args()
+    results = runBenchmarks(opts)
+
+    if opts.output:
+        with open(opts.output, 'w') as resultsFile:
+            json.dump(results, resultsFile, indent=2, sort_keys=True)
+    else:
+        print json.dumps(results, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
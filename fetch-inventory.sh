@@ -2,8 +2,37 @@
 
 ## 
 ## ansible -i fetch-inventory.sh all --list-hosts
+## ANSIBLE_KEEPER_LIMIT='dc1:&kafka' ansible-playbook -i fetch-inventory.sh site.yml --limit 'dc1:&kafka'
 ##
 
 ZOO_ANSIBLE_PATH=path_to_ansibleKeeper
+ZOO_ANSIBLE_SOCKET=${ANSIBLE_KEEPER_SOCKET:-$HOME/.cache/ansible-keeper/inventory.sock}
 
-$ZOO_ANSIBLE_PATH/ansibleKeeper.py -I ansible
+## ANSIBLE_KEEPER_LIMIT: fetch only groups and hosts matching ansible host pattern
+if [ "$1" == "--host" ]; then
+    REQUEST=(--host "$2")
+elif [ -n "$ANSIBLE_KEEPER_LIMIT" ]; then
+    REQUEST=(-I ansible --limit "$ANSIBLE_KEEPER_LIMIT")
+else
+    REQUEST=(-I ansible)
+fi
+
+## ask ansibleKeeper.py --serve daemon first, fall back to direct mode when it is not running
+if [ -S "$ZOO_ANSIBLE_SOCKET" ]; then
+    REQUEST_LINE=$(printf '%q ' "${REQUEST[@]}")
+
+    if command -v socat > /dev/null; then
+        INVENTORY=$(echo "$REQUEST_LINE" | socat -t 60 - UNIX-CONNECT:"$ZOO_ANSIBLE_SOCKET" 2> /dev/null)
+    else
+        INVENTORY=$(echo "$REQUEST_LINE" | nc -U "$ZOO_ANSIBLE_SOCKET" 2> /dev/null)
+    fi
+
+    if [ $? -eq 0 ] && [ -n "$INVENTORY" ]; then
+        echo "$INVENTORY"
+        exit 0
+    fi
+fi
+
+## imported instead of run as a script, so python uses the compiled ansibleKeeper.pyc instead of compiling it every call
+exec python -c 'import sys; sys.path.insert(0, sys.argv.pop(1)); import ansibleKeeper; ansibleKeeper.main()' \
+    "$ZOO_ANSIBLE_PATH" "${REQUEST[@]}"
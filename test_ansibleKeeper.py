@@ -12,6 +12,7 @@ __status__     = "Beta"
 
 import pytest
 import socket
+import ansibleKeeper
 from ansibleKeeper import *
 from kazoo.client import KazooClient
 from kazoo.handlers.threading import *
@@ -155,272 +156,254 @@ class TestConfig(object):
 
             
             
-# class TestReadWrite(object):
-#     '''
-#     Suite of tests where read-write zookeeper client connection is required.
-#     '''
-
-#     @pytest.fixture
-#     def rw_zk(self):
-#         '''
-#         Fixture for zookeeper client connection in read-write mode. 
-#         '''
-
-#         ## example server list string 'zoo1.dmz:2181,zoo2.dmz:2181,zoo3.dmz:2181'    
-#         zk = KazooClient(hosts=cfg.zkServers)
-#         zk.start()
-        
-#         return zk
+@pytest.fixture
+def memory_zk(monkeypatch):
+    '''
+    Fixture installing a client of a fresh in-memory tree as the module zookeeper session.
+    '''
+
+    zk = MemoryZk(MemoryTree())
+    zk.start()
+    monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession(zk))
+
+    return zk
+
+
+@pytest.mark.usefixtures('memory_zk')
+class TestReadWrite(object):
+    '''
+    Suite of tests where read-write zookeeper client connection is required, run against the in-memory backend.
+    '''
+
+    @pytest.fixture
+    def rw_zk(self, memory_zk):
+        '''
+        Fixture for zookeeper client connection in read-write mode. 
+        '''
+
+        return memory_zk
 
                 
-#     def test_addHostWithHostvars(self, rw_zk):
-#         '''
-#         Test if hostname-znode added with addHostWithHostvars(var) exists.
-#         '''
-
-#         ## 1. check if Znode provided with test config exists
-#         ## 2. run addHostWithHostvars(var) function
-#         ## 3. check hostname value against tested values (from tst.testDict)
-#         ## 4. run twice deleteZnodeRecur(var) to remove hostname from groupname and hosts group 
-    
-#         if rw_zk.exists(tst.hostPath) is not None:
-#             rw_zk.delete(tst.hostPath, recursive=True)
-#             rw_zk.stop()
+    def test_addHostWithHostvars(self, rw_zk):
+        '''
+        Test if hostname-znode added with addHostWithHostvars(var) exists.
+        '''
 
-#         addHostWithHostvars(tst.oneDict)
+        ## 1. check if Znode provided with test config exists
+        ## 2. run addHostWithHostvars(var) function
+        ## 3. check hostname value against tested values (from tst.testDict)
+        ## 4. run twice deleteZnodeRecur(var) to remove hostname from groupname and hosts group 
+    
+        if rw_zk.exists(tst.hostPath) is not None:
+            rw_zk.delete(tst.hostPath, recursive=True)
 
-#         try:
-#             assert rw_zk.exists(tst.hostPath) ## is not None
+        addHostWithHostvars(tst.oneDict)
 
-#         finally:
-#             rw_zk.stop()
+        assert rw_zk.exists(tst.hostPath) ## is not None
             
-#         deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
-#         deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
 
         
-#     def test_addHostToGroup(self, rw_zk):
-#         '''
-#         Test if hostname-znode added with addHostToGroup(var) exists.
-#         '''
-
-#         ## 1. check if Znode provided with test config exists
-#         ## 2. run addHostWithHostvars(var) and addHostToGroup(var) functions
-#         ## 3. check if hostname added with addHostToGroup exists
-#         ## 4. run twice deleteZnodeRecur(var) to remove hostname from groupname and hosts group
-    
-#         if rw_zk.exists(tst.groupPath) is not None:
-#             rw_zk.delete(tst.groupPath, recursive=True)
-#             rw_zk.stop()
+    def test_addHostToGroup(self, rw_zk):
+        '''
+        Test if hostname-znode added with addHostToGroup(var) exists.
+        '''
 
-#         addHostWithHostvars(tst.oneDict)
-#         addHostToGroup(splitZnodeString(tst.groupHostStr))
+        ## 1. check if Znode provided with test config exists
+        ## 2. run addHostWithHostvars(var) and addHostToGroup(var) functions
+        ## 3. check if hostname added with addHostToGroup exists
+        ## 4. run twice deleteZnodeRecur(var) to remove hostname from groupname and hosts group
+    
+        if rw_zk.exists(tst.groupPath) is not None:
+            rw_zk.delete(tst.groupPath, recursive=True)
 
-#         try:
-#             assert rw_zk.exists(tst.hostGroupPath) ## is not None
+        addHostWithHostvars(tst.oneDict)
+        addHostToGroup(splitZnodeString(tst.groupHostStr))
 
-#         finally:
-#             rw_zk.stop()
+        assert rw_zk.exists(tst.hostGroupPath) ## is not None
             
-#         deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
-#         deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
 
                 
-#     def test_deleteZnodeRecur(self, rw_zk):
-#         '''
-#         Test that znode deleted with deleteZnodeRecur(var) does not exist.
-#         '''
-
-#         ## 1. run addHostWithHostvars(var) function to add example Znode provided in test config
-#         ## 2. run twice deleteZnodeRecur(var) function to delete given Znode provided in test config
-#         ## 3. check Znode path against that string 
+    def test_deleteZnodeRecur(self, rw_zk):
+        '''
+        Test that znode deleted with deleteZnodeRecur(var) does not exist.
+        '''
 
-#         addHostWithHostvars(tst.oneDict)
-#         deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
-#         deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
+        ## 1. run addHostWithHostvars(var) function to add example Znode provided in test config
+        ## 2. run twice deleteZnodeRecur(var) function to delete given Znode provided in test config
+        ## 3. check Znode path against that string 
 
-#         try:
-#             assert rw_zk.exists(tst.hostPath) is None
-#             assert rw_zk.exists(tst.hostGroupPath) is None
+        addHostWithHostvars(tst.oneDict)
+        deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
 
-#         finally:
-#             rw_zk.stop()
+        assert rw_zk.exists(tst.hostPath) is None
+        assert rw_zk.exists(tst.hostGroupPath) is None
 
 
-#     def test_deleteZnodeHostExistance(self):
-#         '''
-#         Test that deleteZnodeRecur() will inform us that we want to delete nonexistent Znode from hosts group.
-#         '''
+    def test_deleteZnodeHostExistance(self):
+        '''
+        Test that deleteZnodeRecur() will inform us that we want to delete nonexistent Znode from hosts group.
+        '''
 
-#         errStringHost  = 'ERROR  ==> could not delete host: {0} that does not exist !!!'.format(tst.hostName)
+        errStringHost  = 'ERROR  ==> could not delete host: {0} that does not exist !!!'.format(tst.hostName)
 
-#         assert deleteZnodeRecur(splitZnodeString(tst.hostHostStr)) == errStringHost
+        assert deleteZnodeRecur(splitZnodeString(tst.hostHostStr)) == ('HOST_DOES_NOT_EXIST', errStringHost)
 
 
-#     def test_deleteZnodeHostInGroupExistance(self):
-#         '''
-#         Test that deleteZnodeRecur() will inform us that we want to delete nonexistent Znode from groups/groupname group.
-#         '''
+    def test_deleteZnodeHostInGroupExistance(self):
+        '''
+        Test that deleteZnodeRecur() will inform us that we want to delete nonexistent Znode from groups/groupname group.
+        '''
 
-#         errStringGroup  = 'ERROR  ==> could not delete host: {0} that does not exist in group: {1} !!!'.format(tst.hostName, tst.groupName)
+        errStringGroup  = 'ERROR  ==> could not delete host: {0} that does not exist in group: {1} !!!'.format(tst.hostName, tst.groupName)
 
-#         addHostWithHostvars(tst.oneDict)
-#         deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
+        addHostWithHostvars(tst.oneDict)
+        deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
 
-#         assert deleteZnodeRecur(splitZnodeString(tst.groupHostStr)) == errStringGroup
+        assert deleteZnodeRecur(splitZnodeString(tst.groupHostStr)) == ('HOST_DOES_NOT_EXISTS_IN_GROUP', errStringGroup)
 
-#         deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
 
         
-#     def test_deleteZnodeRecurGroup(self, rw_zk):
-#         '''
-#         Test that znode deleted with deleteZnodeRecur(var) for groupname does not exist.
-#         '''
-
-#         ## 1. run addHostWithHostvars(var) function to create given Znode provided in tst.oneDict 
-#         ## 2. run deleteZnodeRecur(var) function to delete given Znode provided in tst.groupName
-#         ## 3. check Znode path against that string
-#         ## 4. delete hostname Znode in hosts group with deleteZnodeRecur(var)
+    def test_deleteZnodeRecurGroup(self, rw_zk):
+        '''
+        Test that znode deleted with deleteZnodeRecur(var) for groupname does not exist.
+        '''
 
-#         addHostWithHostvars(tst.oneDict)
-#         deleteZnodeRecur(splitZnodeString(tst.groupName))
+        ## 1. run addHostWithHostvars(var) function to create given Znode provided in tst.oneDict 
+        ## 2. run deleteZnodeRecur(var) function to delete given Znode provided in tst.groupName
+        ## 3. check Znode path against that string
+        ## 4. delete hostname Znode in hosts group with deleteZnodeRecur(var)
 
-#         try:
-#             assert rw_zk.exists(tst.groupPath) is None
+        addHostWithHostvars(tst.oneDict)
+        deleteZnodeRecur(splitZnodeString(tst.groupName))
 
-#         finally:
-#             rw_zk.stop()
+        assert rw_zk.exists(tst.groupPath) is None
             
-#         deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
 
         
-#     def test_showHostVarsOneHost(self):
-#         '''
-#         Test showHostVars() function for group with one host.
-#         '''
+    def test_showHostVarsOneHost(self):
+        '''
+        Test showHostVars() function for group with one host.
+        '''
 
-#         ## 1. run addHostWithHostvars(var) function to create given Znode with vars provided in tst.oneDict 
-#         ## 2. test showHostVars(var) against vars and values provided in tst.oneDict 
-#         ## 3. run twice deleteZnodeRecur(var) function to delete given Znodes provided in tst.hostHostStr 
+        ## 1. run addHostWithHostvars(var) function to create given Znode with vars provided in tst.oneDict 
+        ## 2. test showHostVars(var) against vars and values provided in tst.oneDict 
+        ## 3. run twice deleteZnodeRecur(var) function to delete given Znodes provided in tst.hostHostStr 
 
-#         addHostWithHostvars(tst.oneDict)
+        addHostWithHostvars(tst.oneDict)
 
-#         testList = [(tst.hostHostStr,{tst.hostName:tst.varDict}),(tst.groupName, tst.oneDict[tst.groupName])]
+        testList = [(tst.hostHostStr,{tst.hostName:tst.varDict}),(tst.groupName, tst.oneDict[tst.groupName])]
     
-#         for val in testList:
-#             assert showHostVars(splitZnodeString(val[0])) == val[1]
+        for val in testList:
+            assert showHostVars(splitZnodeString(val[0])) == val[1]
     
-#         deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
-#         deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.groupHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
 
 
-#     def test_showHostVarsMultipleHosts(self):
-#         '''
-#         Test showHostVars() function for group with multiple hosts.
-#         '''
+    def test_showHostVarsMultipleHosts(self):
+        '''
+        Test showHostVars() function for group with multiple hosts.
+        '''
 
-#         ## 1. run addHostWithHostvars(var) function to create given Znode with vars provided in tst.oneDict 
-#         ## 2. test showHostVars(var) against vars and values provided in tst.testDict 
-#         ## 3. run deleteZnodeRecur(var) function to delete test group provided in tst.hostHostStr 
-#         ## 4. run deleteZnodeRecur(var) function to delete all hosts provided in tst.testDict
+        ## 1. run addHostWithHostvars(var) function to create given Znode with vars provided in tst.oneDict 
+        ## 2. test showHostVars(var) against vars and values provided in tst.testDict 
+        ## 3. run deleteZnodeRecur(var) function to delete test group provided in tst.hostHostStr 
+        ## 4. run deleteZnodeRecur(var) function to delete all hosts provided in tst.testDict
         
-#         for hostname in tst.testDict[tst.groupName].keys():
-#             tmpDict = {tst.groupName : { hostname : tst.testDict[tst.groupName][hostname] }}
-#             addHostWithHostvars(tmpDict)
+        for hostname in tst.testDict[tst.groupName].keys():
+            tmpDict = {tst.groupName : { hostname : tst.testDict[tst.groupName][hostname] }}
+            addHostWithHostvars(tmpDict)
 
-#         testList = [(tst.hostHostStr, {tst.hostName:tst.varDict}),(tst.groupName, tst.testDict[tst.groupName])]
+        testList = [(tst.hostHostStr, {tst.hostName:tst.varDict}),(tst.groupName, tst.testDict[tst.groupName])]
     
-#         for val in testList:
-#             assert showHostVars(splitZnodeString(val[0])) == val[1]
-
-#         ## delete all hosts in group created with addHostWithHostvars(var)    
-#         deleteZnodeRecur(splitZnodeString(tst.groupName))
-#         for hostname in  tst.testDict[tst.groupName].keys():
-#             tmpHostStr = "hosts:{}".format(hostname)
-#             deleteZnodeRecur(splitZnodeString(tmpHostStr))
+        for val in testList:
+            assert showHostVars(splitZnodeString(val[0])) == val[1]
+
+        ## delete all hosts in group created with addHostWithHostvars(var)    
+        deleteZnodeRecur(splitZnodeString(tst.groupName))
+        for hostname in  tst.testDict[tst.groupName].keys():
+            tmpHostStr = "hosts:{}".format(hostname)
+            deleteZnodeRecur(splitZnodeString(tmpHostStr))
             
         
-#     def test_updateSingleZnode(self, rw_zk):
-#         '''
-#         Test updated Znode with updateZnode(var) for one host.
-#         '''
-
-#         ## 1. run addHostWithHostvars(var) function to create given Znode provided in tst.oneDict
-#         ## 2. run updateZnode(var) function to update given Znode provided in tst.updateDict
-#         ## 3. check updated results against tst.updateDict
-#         ## 4. run deleteZnodeRecur(var) function to delete test group provided in tst.hostHostStr 
-#         ## 5. run deleteZnodeRecur(var) function to delete all hosts provided in tst.testDict
-    
-#         addHostWithHostvars(tst.oneDict)
-#         updateZnode(tst.oneUpdateDict)
+    def test_updateSingleZnode(self, rw_zk):
+        '''
+        Test updated Znode with updateZnode(var) for one host.
+        '''
 
-#         for key in tst.updateDict[tst.groupName][tst.hostName].keys():
-#             zkGet       = rw_zk.get('{0}/{1}'.format(tst.hostPath, key))[0]
-#             updateValue = tst.updateDict[tst.groupName][tst.hostName][key]
+        ## 1. run addHostWithHostvars(var) function to create given Znode provided in tst.oneDict
+        ## 2. run updateZnode(var) function to update given Znode provided in tst.updateDict
+        ## 3. check updated results against tst.updateDict
+        ## 4. run deleteZnodeRecur(var) function to delete test group provided in tst.hostHostStr 
+        ## 5. run deleteZnodeRecur(var) function to delete all hosts provided in tst.testDict
+    
+        addHostWithHostvars(tst.oneDict)
+        updateZnode(tst.oneUpdateDict)
 
-#             assert zkGet == updateValue
+        for key in tst.updateDict[tst.groupName][tst.hostName].keys():
+            zkGet       = rw_zk.get('{0}/{1}'.format(tst.hostPath, key))[0]
+            updateValue = tst.updateDict[tst.groupName][tst.hostName][key]
 
-#         rw_zk.stop()
+            assert zkGet == updateValue
             
-#         ## delete all hosts in group created with addHostWithHostvars(var)    
-#         deleteZnodeRecur(splitZnodeString(tst.groupName))
-#         for hostname in  tst.testDict[tst.groupName].keys():
-#             tmpHostStr = "hosts:{}".format(hostname)
-#             deleteZnodeRecur(splitZnodeString(tmpHostStr))
-
-
-#     def test_renameHostname(self, rw_zk):
-#         '''
-#         Test if renameZnode(var) works properly for new hostname.
-#         '''
-
-#         ## 1. run addHostWithHostvars(var) function to create given Znode provided in tst.oneDict
-#         ## 2. run renameZnode(var) function to rename given hostname provided in tst.renameDict
-#         ## 3. check updated results against tst.renameDict
-#         ## 4. run deleteZnodeRecur(var) function to delete test group provided in tst.hostHostStr 
-#         ## 5. run deleteZnodeRecur(var) function to delete all hosts provided in tst.testDict
+        ## delete all hosts in group created with addHostWithHostvars(var)    
+        deleteZnodeRecur(splitZnodeString(tst.groupName))
+        for hostname in  tst.testDict[tst.groupName].keys():
+            tmpHostStr = "hosts:{}".format(hostname)
+            deleteZnodeRecur(splitZnodeString(tmpHostStr))
+
+
+    def test_renameHostname(self, rw_zk):
+        '''
+        Test if renameZnode(var) works properly for new hostname.
+        '''
+
+        ## 1. run addHostWithHostvars(var) function to create given Znode provided in tst.oneDict
+        ## 2. run renameZnode(var) function to rename given hostname provided in tst.renameDict
+        ## 3. check updated results against tst.renameDict
+        ## 4. run deleteZnodeRecur(var) function to delete test group provided in tst.hostHostStr 
+        ## 5. run deleteZnodeRecur(var) function to delete all hosts provided in tst.testDict
     
-#         addHostWithHostvars(tst.oneDict)
-#         renameZnode(splitRenameZnodeString(tst.renameHostStr))
+        addHostWithHostvars(tst.oneDict)
+        renameZnode(splitRenameZnodeString(tst.renameHostStr))
         
-#         try:
-#             assert rw_zk.exists('{}'.format(tst.hostPath)) is None
-#             assert rw_zk.exists('{}'.format(tst.renameHostPath)) is not None
-            
-#         finally:
-#             rw_zk.stop()
+        assert rw_zk.exists('{}'.format(tst.hostPath)) is None
+        assert rw_zk.exists('{}'.format(tst.renameHostPath)) is not None
             
-#         ## delete all hosts in group created with addHostWithHostvars(var)    
-#         deleteRenameHostStr = "hosts:{}".format(tst.renameHostName)
+        ## delete all hosts in group created with addHostWithHostvars(var)    
+        deleteRenameHostStr = "hosts:{}".format(tst.renameHostName)
 
-#         deleteZnodeRecur(splitZnodeString(tst.groupName))
-#         deleteZnodeRecur(splitZnodeString(deleteRenameHostStr))
+        deleteZnodeRecur(splitZnodeString(tst.groupName))
+        deleteZnodeRecur(splitZnodeString(deleteRenameHostStr))
 
 
-#     def test_renameGroupname(self, rw_zk):
-#         '''
-#         Test if renameZnode(var) works properly for new groupname.
-#         '''
+    def test_renameGroupname(self, rw_zk):
+        '''
+        Test if renameZnode(var) works properly for new groupname.
+        '''
 
-#         ## 1. run addHostWithHostvars(var) function to create given Znode provided in tst.oneDict
-#         ## 2. run renameZnode(var) function to rename given groupname provided in tst.renameDict
-#         ## 3. check updated results against tst.renameDict
-#         ## 4. run deleteZnodeRecur(var) function to delete test group provided in tst.hostHostStr 
-#         ## 5. run deleteZnodeRecur(var) function to delete all hosts provided in tst.testDict
+        ## 1. run addHostWithHostvars(var) function to create given Znode provided in tst.oneDict
+        ## 2. run renameZnode(var) function to rename given groupname provided in tst.renameDict
+        ## 3. check updated results against tst.renameDict
+        ## 4. run deleteZnodeRecur(var) function to delete test group provided in tst.hostHostStr 
+        ## 5. run deleteZnodeRecur(var) function to delete all hosts provided in tst.testDict
     
-#         addHostWithHostvars(tst.oneDict)
-#         renameZnode(splitRenameZnodeString(tst.renameGroupStr))
+        addHostWithHostvars(tst.oneDict)
+        renameZnode(splitRenameZnodeString(tst.renameGroupStr))
         
-#         try:
-#             assert rw_zk.exists('{}'.format(tst.groupPath)) is None
-#             assert rw_zk.exists('{}'.format(tst.renameGroupPath)) is not None
+        assert rw_zk.exists('{}'.format(tst.groupPath)) is None
+        assert rw_zk.exists('{}'.format(tst.renameGroupPath)) is not None
             
-#         finally:
-#             rw_zk.stop()
-            
-#         ## delete all hosts in group created with addHostWithHostvars(var)    
-#         deleteZnodeRecur(splitZnodeString(tst.renameGroupName))
-#         deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
+        ## delete all hosts in group created with addHostWithHostvars(var)    
+        deleteZnodeRecur(splitZnodeString(tst.renameGroupName))
+        deleteZnodeRecur(splitZnodeString(tst.hostHostStr))
 
         
             
@@ -462,6 +445,26 @@ class TestSplitters(object):
         for varDict in testTup:
             assert splitZnodeVarString(varDict['string']) == varDict['output']
 
+
+    def test_splitGroupVarString(self):
+        '''
+        Test for splitGroupVarString() parser, values keep their colons.
+        '''
+
+        assert splitGroupVarString("web,http_port:80,proxy:http://proxy:3128") == \
+            ("web", "{}/groups/web".format(cfg.aPath), {"http_port": "80", "proxy": "http://proxy:3128"})
+        assert splitGroupVarString("all") == ("all", "{}/groups/all".format(cfg.aPath), {})
+
+
+    def test_splitChildGroupString(self):
+        '''
+        Test for splitChildGroupString() parser.
+        '''
+
+        assert splitChildGroupString("dc1:dc1-kafka") == ("dc1", "dc1-kafka")
+        assert splitChildGroupString("dc1").startswith("SYNTAX ERROR")
+        assert splitChildGroupString("dc1:").startswith("SYNTAX ERROR")
+
             
     # def test_splitRenameZnodeVarString(self):
     #     '''
@@ -480,3 +483,1475 @@ class TestSplitters(object):
 
     #     for renameDict in testTup:
     #         assert splitRenameZnodeString(renameDict['string']) == renameDict['output']
+
+
+class TestPipelinedFetch(object):
+    '''
+    Suite of tests for pipelinedFetch() with a recording stand-in for async zookeeper calls.
+    '''
+
+    class AsyncResult(object):
+        def __init__(self, zk, value):
+            self.zk, self.value = zk, value
+
+        def get(self):
+            self.zk.inFlight -= 1
+            if self.value is None:
+                raise NoNodeError()
+            return self.value
+
+    class RecordingZk(object):
+        def __init__(self, tree):
+            self.tree, self.inFlight, self.maxInFlight = tree, 0, 0
+
+        def request(self, value):
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+            return TestPipelinedFetch.AsyncResult(self, value)
+
+        def get_children_async(self, path):
+            return self.request(self.tree.get(path))
+
+        def get_async(self, path):
+            return self.request((self.tree.get(path), None))
+
+
+    def test_pipelinedFetchOrderAndWindow(self):
+        '''
+        Test that results keep request order and no more than window requests are in flight.
+        '''
+
+        tree = dict(("/v{0}".format(i), "val{0}".format(i)) for i in range(20))
+        zk   = self.RecordingZk(tree)
+        requests = [(i, 'data', "/v{0}".format(i)) for i in range(20)]
+
+        results = list(pipelinedFetch(zk, requests, window=4))
+
+        assert [tag for tag, path, result in results] == range(20)
+        assert [result[0] for tag, path, result in results] == ["val{0}".format(i) for i in range(20)]
+        assert zk.maxInFlight == 4
+
+
+    def test_pipelinedFetchVanishedZnode(self):
+        '''
+        Test that a znode deleted between listing and fetching gives None instead of an exception.
+        '''
+
+        zk = self.RecordingZk({'/groups/g1': ['h1']})
+        requests = [('g1', 'children', '/groups/g1'), ('g2', 'children', '/groups/g2')]
+
+        assert list(pipelinedFetch(zk, requests)) == [('g1', '/groups/g1', ['h1']), ('g2', '/groups/g2', None)]
+
+
+class TestStorageFormat(object):
+    '''
+    Suite of tests for packed hostvars storage format helpers.
+    '''
+
+    def test_packUnpackHostVars(self):
+        '''
+        Test that packHostVars() blob decodes back into the same hostvars dict.
+        '''
+
+        packed = packHostVars(tst.varDict)
+
+        assert packed.startswith(PACKED_HEADER)
+        assert unpackHostVars(packed) == tst.varDict
+        assert unpackHostVars(packHostVars({})) == {}
+
+
+    def test_unpackLegacyHostZnode(self):
+        '''
+        Test that legacy host znode data is not mistaken for a packed blob.
+        '''
+
+        for data in ('', None, '{"var1": "val1"}'):
+            assert unpackHostVars(data) is None
+
+
+class TestInventoryCache(object):
+    '''
+    Suite of tests for local inventory cache file handling.
+    '''
+
+    @pytest.fixture
+    def cacheDir(self, tmpdir):
+        '''
+        Fixture pointing cfg.cacheDir to a temporary directory.
+        '''
+
+        oldCacheDir, cfg.cacheDir = cfg.cacheDir, str(tmpdir.join('cache'))
+        yield cfg.cacheDir
+        cfg.cacheDir = oldCacheDir
+
+
+    def test_writeReadInventoryCache(self, cacheDir):
+        '''
+        Test that inventory written with writeInventoryCache() is read back with its cache key.
+        '''
+
+        inventory = {tst.groupName: {'hosts': [tst.hostName], 'vars': {}},
+                     '_meta': {'hostvars': {tst.hostName: tst.varDict}}}
+        cacheKey  = [cfg.zkServers, cfg.aPath, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+        assert readInventoryCache() == (None, None)
+
+        writeInventoryCache(cacheKey, inventory)
+        cache, age = readInventoryCache()
+
+        assert cache == {'key': cacheKey, 'inventory': inventory}
+        assert 0 <= age < 60
+        assert sorted(os.listdir(cacheDir)) == sorted(os.path.basename(path) for path in (inventoryCachePath(), inventoryIndexPath()))
+
+
+    def test_tornInventoryCache(self, cacheDir):
+        '''
+        Test that a torn cache file is treated as a cache miss.
+        '''
+
+        writeInventoryCache([], {})
+        with open(inventoryCachePath(), 'w') as cacheFile:
+            cacheFile.write('{"key": [1, 2')
+
+        assert readInventoryCache() == (None, None)
+
+
+    def test_hostIndex(self, cacheDir):
+        '''
+        Test that hosts are found in the host index, a torn or stale index is a miss.
+        '''
+
+        hostVars = dict(("h{0:03d}".format(i), {'ip': str(i)}) for i in range(100))
+        writeInventoryCache([1], {'_meta': {'hostvars': hostVars}})
+
+        varDict, keyDigest, age = readHostIndex('h042')
+        assert varDict == {'ip': '42'}
+        assert keyDigest == cacheKeyDigest([1])
+        assert readHostIndex('h0420')[0] is None and readHostIndex('zzz')[0] is None
+
+        with open(inventoryIndexPath(), 'r+') as indexFile:
+            indexFile.truncate(os.path.getsize(inventoryIndexPath()) - 1)
+        assert readHostIndex('h042') is None
+
+        writeInventoryCache([1], {'_meta': {'hostvars': hostVars}})
+        with open(inventoryCachePath(), 'a') as cacheFile:  ## cache replaced, index left behind
+            cacheFile.write(' ')
+        assert readHostIndex('h042') is None
+
+
+    def test_fastPathImports(self):
+        '''
+        Test that importing the module for the --host fast path loads neither kazoo nor the daemon and thread modules.
+        '''
+
+        import subprocess
+
+        script = "import sys, ansibleKeeper; print(' '.join(sorted(set(sys.modules) & set(sys.argv[1:]))))"
+        loaded = subprocess.check_output([sys.executable, '-c', script, 'kazoo', 'threading', 'SocketServer', 'socket', 'collections'],
+                                         cwd=os.path.dirname(os.path.abspath(ansibleKeeper.__file__)))
+        assert loaded.strip() == ''
+
+
+    def test_hostFastPath(self, cacheDir, monkeypatch, capsys):
+        '''
+        Test that --host is answered from a fresh cache without zookeeper, and from the host alone on a stale cache.
+        '''
+
+        inventory = {'_meta': {'hostvars': {tst.hostName: tst.varDict}}}
+        writeInventoryCache([], inventory)
+        monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession())
+        monkeypatch.setattr(ansibleKeeper, 'zkStartRo', None)  ## any zookeeper connection fails
+
+        assert hostFastPath(['--host', tst.hostName]) is True
+        assert json.loads(capsys.readouterr()[0]) == tst.varDict
+        assert hostFastPath(['-I', 'ansible']) is False
+
+        monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession(MemoryZk(MemoryTree())))
+        addHostWithHostvars(splitZnodeVarString('web:w1,ip:1'))
+
+        assert cachedAnsibleHostAccess('w1', ttl=0) == {'ip': '1'}  ## cache key differs, host read alone
+        assert cachedAnsibleHostAccess(tst.hostName, ttl=60) == tst.varDict
+
+
+class TestInventoryDaemon(object):
+    '''
+    Suite of tests for inventory daemon client.
+    '''
+
+    def test_queryInventoryDaemonNotRunning(self, tmpdir):
+        '''
+        Test that queryInventoryDaemon() gives None when no daemon listens on the socket.
+        '''
+
+        assert queryInventoryDaemon('-I ansible', str(tmpdir.join('inventory.sock'))) is None
+
+
+    @pytest.fixture
+    def keeper_tree(self, monkeypatch):
+        '''
+        Fixture for an AnsibleKeeper client of a fresh in-memory tree holding host w1 in group web.
+        '''
+
+        monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession())
+        tree   = MemoryTree()
+        keeper = AnsibleKeeper(client=MemoryZk(tree))
+        keeper.addHost('web', 'w1', {'ip': '1'})
+
+        yield keeper, tree
+
+        keeper.close()
+
+
+    def test_watcherInitialLoad(self, keeper_tree):
+        '''
+        Test that a new InventoryWatcher answers with the inventory read from zookeeper, child groups and group vars included.
+        '''
+
+        keeper, tree = keeper_tree
+        keeper.addChildGroup('prod', 'web')
+        keeper.setGroupVars('web', {'port': '80'})
+
+        watcher = InventoryWatcher(MemoryZk(tree))
+
+        assert json.loads(watcher.answer('-I ansible')) == ansibleInventoryDump()
+        assert json.loads(watcher.answer('-I ansible'))['prod']['children'] == ['web']
+        assert json.loads(watcher.answer('--show-group-vars web')) == showGroupVars('web')
+        assert json.loads(watcher.answer('--host w1')) == {'ip': '1'}
+
+
+    def test_watcherHostAddDelete(self, keeper_tree):
+        '''
+        Test that hosts and child group edges added or deleted after the watcher started show up in its answers.
+        '''
+
+        keeper, tree = keeper_tree
+        watcher = InventoryWatcher(MemoryZk(tree))
+
+        keeper.addHost('db', 'd1', {'ip': '2'})
+        keeper.addChildGroup('prod', 'db')  ## first edge, creates /children
+
+        assert json.loads(watcher.answer('-I hosts')) == ['d1', 'w1']
+        assert json.loads(watcher.answer('-I ansible')) == ansibleInventoryDump()
+        assert json.loads(watcher.answer('--host d1')) == {'ip': '2'}
+
+        keeper.deleteChildGroup('prod', 'db')
+        keeper.deleteHost('d1')
+
+        assert json.loads(watcher.answer('-I hosts')) == ['w1']
+        assert json.loads(watcher.answer('-I ansible')) == ansibleInventoryDump()
+        assert 'children' not in json.loads(watcher.answer('-I ansible'))['prod']
+        assert json.loads(watcher.answer('--host d1')) == "ERROR  ==> no such host: d1 !!!"
+
+
+    def test_watcherHostVarChange(self, keeper_tree):
+        '''
+        Test that hostvars updated after the watcher started reach answer() without a new watcher.
+        '''
+
+        keeper, tree = keeper_tree
+        watcher = InventoryWatcher(MemoryZk(tree))
+
+        keeper.updateHost('w1', {'ip': '10'})
+
+        assert json.loads(watcher.answer('--host w1')) == {'ip': '10'} == keeper.hostVars('w1').data
+        assert json.loads(watcher.answer('-I ansible'))['_meta']['hostvars']['w1'] == {'ip': '10'}
+
+
+class TestZkSession(object):
+    '''
+    Suite of tests for shared zookeeper session.
+    '''
+
+    class Client(object):
+        stopped = False
+
+        def stop(self):
+            self.stopped = True
+
+
+    def test_injectedClient(self):
+        '''
+        Test that injected client serves reads and writes without new connections and is not stopped.
+        '''
+
+        client  = self.Client()
+        session = ZkSession(client)
+
+        assert session.ro() is client
+        assert session.rw() is client
+
+        session.close()
+
+        assert client.stopped is False
+        assert session.connects == 0
+
+
+    @pytest.mark.parametrize('state, connects', [('CONNECTED', 1), ('CONNECTED_RO', 2)])
+    def test_readThenWrite(self, monkeypatch, state, connects):
+        '''
+        Test that a write after reads keeps the read-only mode session unless it sits on a read-only server.
+        '''
+
+        def zkStart():
+            client = self.Client()
+            client.client_state, client.close = state, lambda: None
+            return client
+
+        monkeypatch.setattr(ansibleKeeper, 'zkStartRo', zkStart)
+        monkeypatch.setattr(ansibleKeeper, 'zkStartRw', zkStart)
+        session = ZkSession()
+
+        roClient = session.ro()
+        rwClient = session.rw()
+
+        assert session.ro() is rwClient
+        assert (rwClient is roClient) is (state == 'CONNECTED')
+        assert roClient.stopped is (state == 'CONNECTED_RO')
+        assert session.connects == connects
+
+
+class TestInventoryImport(object):
+    '''
+    Suite of tests for inventory file parsers and transaction batching used by --import.
+    '''
+
+    def test_parseIniInventory(self):
+        '''
+        Test parseIniInventory() with ungrouped hosts, quoted hostvars, group vars and children.
+        '''
+
+        text = '\n'.join(["lonely ansible_host=1.2.3.4",
+                          "[web]",
+                          "web1 http_port=80 motd=\"hello world\"  # comment",
+                          "[db]",
+                          "db1",
+                          "[web:vars]",
+                          "proxy=proxy.dmz",
+                          "motd = \"hello world\"",
+                          "[prod:children]",
+                          "web",
+                          "db"])
+
+        groupDict, hostVarDict, groupVarDict, childDict = parseIniInventory(text)
+
+        assert groupDict == {'ungrouped': ['lonely'], 'web': ['web1'], 'db': ['db1'], 'prod': []}
+        assert hostVarDict == {'lonely': {'ansible_host': '1.2.3.4'}, 'web1': {'http_port': '80', 'motd': 'hello world'},
+                               'db1': {}}
+        assert groupVarDict == {'web': {'proxy': 'proxy.dmz', 'motd': 'hello world'}}
+        assert childDict == {'prod': ['web', 'db']}
+
+
+    def test_parseJsonInventory(self):
+        '''
+        Test parseJsonInventory() with -I ansible output and non string hostvars.
+        '''
+
+        data = {tst.groupName: {'hosts': [tst.hostName], 'vars': {'port': 80}, 'children': ['db']},
+                'ungrouped': ['lonely'],
+                '_meta': {'hostvars': {tst.hostName: {'id': 1, 'tags': ['a', 'b']}}}}
+
+        groupDict, hostVarDict, groupVarDict, childDict = parseJsonInventory(data)
+
+        assert groupDict == {tst.groupName: [tst.hostName], 'ungrouped': ['lonely'], 'db': []}
+        assert hostVarDict == {tst.hostName: {'id': '1', 'tags': '["a", "b"]'}, 'lonely': {}}
+        assert groupVarDict == {tst.groupName: {'port': '80'}}
+        assert childDict == {tst.groupName: ['db']}
+
+
+    def test_importChildGroups(self, memory_zk, tmpdir):
+        '''
+        Test that --import creates child group edges and rejects edges closing a cycle with the existing ones.
+        '''
+
+        inventoryPath = tmpdir.join('hosts.ini')
+        inventoryPath.write('[web]\nweb1\n[prod:children]\nweb\n')
+
+        assert "child groups: 1" in importInventory(str(inventoryPath))
+        assert groupChildren(ansibleKeeper.zkSession.ro())[0] == {'prod': ['web']}
+        assert "child groups: 0" in importInventory(str(inventoryPath))
+
+        inventoryPath.write('[web:children]\nprod\n')
+        assert importInventory(str(inventoryPath)).startswith("ERROR  ==> import of")
+        assert groupChildren(ansibleKeeper.zkSession.ro())[0] == {'prod': ['web']}
+
+
+    def test_opBatches(self):
+        '''
+        Test that opBatches() keeps operation order and batch limits.
+        '''
+
+        ops = [('create', '/x/{0}'.format(i), 'v' * 100) for i in range(10)]
+
+        assert list(opBatches(ops, maxOps=4)) == [ops[0:4], ops[4:8], ops[8:10]]
+        assert [len(batch) for batch in opBatches(ops, maxBytes=400)] == [2, 2, 2, 2, 2]
+        assert list(opBatches([])) == []
+
+
+class TestAtomicWrites(object):
+    '''
+    Suite of tests for multi request commits used by add, rename and update.
+    '''
+
+    class Transaction(object):
+        def __init__(self, results):
+            self.ops, self.results = [], results
+
+        def create(self, *args):
+            self.ops.append(('create',) + args)
+
+        def set_data(self, *args):
+            self.ops.append(('set_data',) + args)
+
+        def commit(self):
+            return self.results
+
+    class Zk(object):
+        def __init__(self, results):
+            self.tx = TestAtomicWrites.Transaction(results)
+
+        def transaction(self):
+            return self.tx
+
+
+    def test_commitOpsFailedOperation(self):
+        '''
+        Test that commitOps() reports the failed operation and not the rolled back ones.
+        '''
+
+        ops = [('create', '/h1', ''), ('create', '/g1/h1', ''), ('set_data', '/gen', '')]
+        zk  = self.Zk([RolledBackError(), NodeExistsError(), RolledBackError()])
+
+        failed = commitOps(zk, ops)
+
+        assert zk.tx.ops == ops
+        assert failed[0] == ('create', '/g1/h1', '')
+        assert isinstance(failed[1], NodeExistsError)
+
+
+    def test_commitWriteBumpsGeneration(self):
+        '''
+        Test that commitWrite() commits the generation stamp in the same multi request.
+        '''
+
+        ops = [('create', '/h1', '')]
+        zk  = self.Zk(['/h1', None])
+
+        assert commitWrite(zk, ops) is None
+        assert zk.tx.ops == ops + [('set_data', "{}/generation".format(cfg.aPath), '')]
+
+
+    @pytest.mark.parametrize('kind', ['hosts', 'groups'])
+    def test_renameInBatches(self, memory_zk, monkeypatch, kind):
+        '''
+        Test that a rename too big for one multi request stopped halfway is reported and finished by a rerun.
+        '''
+
+        monkeypatch.setattr(cfg, 'txnMaxOps', 8)
+        zk = ansibleKeeper.zkSession.rw()
+
+        addHostWithHostvars(splitZnodeVarString('g1:h1,' + ','.join('v{0}:{0}'.format(i) for i in range(6))))
+        for group in ('g1', 'g2', 'g3'):
+            addHostWithHostvars(splitZnodeVarString('{0}:h{1}0,a:1'.format(group, group[1])))
+            if group != 'g1':
+                addHostToGroup(splitZnodeString(group + ':h1'))
+        before = ansibleInventoryDump()
+
+        renameArg     = 'hosts:h1:h2' if kind == 'hosts' else 'groups:g1:g9'
+        realCommitOps = ansibleKeeper.commitOps
+        token         = changesSince('now')['token']
+
+        ## copy batches go through, the first delete batch fails
+        monkeypatch.setattr(ansibleKeeper, 'commitOps', lambda zk, ops, results=None: (ops[0], NodeExistsError())
+                            if ops[0][0] == 'delete' else realCommitOps(zk, ops, results))
+        assert renameZnode(splitRenameZnodeString(renameArg))[0] == 'RENAME_HALF_DONE'
+        assert changesSince(token)['changes'] == []  ## nothing journaled while half done
+
+        monkeypatch.setattr(ansibleKeeper, 'commitOps', realCommitOps)
+        assert renameZnode(splitRenameZnodeString(renameArg)).startswith("RENAMED")
+        assert [change['op'] for change in changesSince(token)['changes']] == ['rename']
+        assert zk.get_children("{}/renames".format(cfg.aPath)) == []
+
+        after = ansibleInventoryDump()
+        if kind == 'hosts':
+            before['_meta']['hostvars']['h2'] = before['_meta']['hostvars'].pop('h1')
+            for group in ('g1', 'g2', 'g3'):
+                before[group]['hosts'] = sorted(['h2' if host == 'h1' else host for host in before[group]['hosts']])
+                after[group]['hosts'] = sorted(after[group]['hosts'])
+            assert zk.get_children(membershipPath('h2')) and zk.exists(membershipPath('h1')) is None
+        else:
+            before['g9'] = before.pop('g1')
+            assert sorted(zk.get_children(membershipPath('h1'))) == ['g2', 'g3', 'g9']
+        assert after == before
+
+
+class TestJournal(object):
+    '''
+    Suite of tests for the change journal.
+    '''
+
+    def test_commitWriteAppendsChange(self, monkeypatch):
+        '''
+        Test that a change record goes into the same multi request as the write.
+        '''
+
+        monkeypatch.setattr(cfg, 'journal', True)
+        generationStat = TestStreamingInventory.Stat('', [])
+        generationStat.version = 1  ## not a compaction turn
+
+        ops = [('create', '/h1', '')]
+        zk  = TestAtomicWrites.Zk(['/h1', journalPath('entry-0000000000'), generationStat])
+
+        assert commitWrite(zk, ops, {'op': 'add', 'host': 'h1'}) is None
+        assert zk.tx.ops[1] == ('create', journalPath('entry-'), '{"host": "h1", "op": "add"}', None, False, True)
+        assert journalToken('entry-0000000041') == 42
+
+
+    def test_changesSinceAndCompaction(self, memory_zk, monkeypatch):
+        '''
+        Test that changes after a token are returned in order and a compacted token gives an ERROR.
+        '''
+
+        monkeypatch.setattr(cfg, 'journalCompactEvery', 1000)
+        zk = ansibleKeeper.zkSession.rw()
+
+        assert changesSince('now') == {'token': 0, 'changes': []}
+        for i in range(5):
+            assert commitWrite(zk, [], {'op': 'update', 'host': 'h1', 'vars': {'a': str(i)}}) is None
+
+        changes = changesSince(3)
+        assert [change['vars']['a'] for change in changes['changes']] == ['3', '4']
+        assert changes['token'] == 5
+        assert changesSince(5)['changes'] == []
+
+        assert compactJournal(zk, keep=2) == 3
+        assert changesSince(2)[0] == 'COMPACTED'
+        assert len(changesSince(3)['changes']) == 2
+
+
+    def test_journalOpTooBig(self):
+        '''
+        Test that a change record too big for a write request keeps only its strings and asks for resync.
+        '''
+
+        op = journalOp({'op': 'update', 'host': 'h1', 'vars': {'blob': 'x' * cfg.txnMaxBytes}})
+        assert json.loads(op[2]) == {'op': 'update', 'host': 'h1', 'resync': True}
+
+
+class TestGroupUpdate(object):
+    '''
+    Suite of tests for group-wide hostvar updates.
+    '''
+
+    def test_hostOpBatches(self):
+        '''
+        Test that operations of one host are never split between batches.
+        '''
+
+        hostOps = [('h{0}'.format(i), [('set_data', '/h{0}/a'.format(i), ''), ('check', '/h{0}'.format(i), 0)])
+                   for i in range(5)]
+        batchList = list(hostOpBatches(hostOps, maxOps=5))
+
+        assert [len(batch) for batch in batchList] == [2, 2, 1]
+        assert [host for batch in batchList for host, ops in batch] == ['h0', 'h1', 'h2', 'h3', 'h4']
+
+
+    def test_updateGroupHosts(self, memory_zk):
+        '''
+        Test that hosts of a group and of its child groups are updated in one multi request with per host results.
+        '''
+
+        addHostWithHostvars(splitZnodeVarString('web:w1,ntp:a,lan_ip:1'))
+        addHostWithHostvars(splitZnodeVarString('web:w2,lan_ip:2'))
+        addHostWithHostvars(splitZnodeVarString('db:d1,ntp:a'))
+        addChildGroup(('web', 'db'))
+        token = changesSince('now')['token']
+
+        messageList = updateGroupHosts(splitGroupVarString('web,ntp:b'))
+
+        assert messageList[0] == "UPDATED  ==> host: d1 with new hostvars {'ntp': 'b'}"
+        assert messageList[1] == "UPDATED  ==> host: w1 with new hostvars {'ntp': 'b'}"
+        assert messageList[2].startswith("NOT UPDATED  ==> host: w2")
+        assert messageList[3].endswith("(updated: 2, not updated: 1, failed: 0) in multi requests: 1")
+        assert readHostVars(ansibleKeeper.zkSession.rw(), "{}/hosts/w1".format(cfg.aPath)) == {'ntp': 'b', 'lan_ip': '1'}
+        assert changesSince(token)['changes'][0]['hosts'] == {'d1': {'ntp': 'b'}, 'w1': {'ntp': 'b'}}
+
+        messageList = updateGroupHosts(splitGroupVarString('all,ntp:c'), limit='!db')
+        assert messageList[0] == "UPDATED  ==> host: w1 with new hostvars {'ntp': 'c'}"
+        assert len(messageList) == 3
+        assert updateGroupHosts(splitGroupVarString('nogroup,ntp:c'))[0][0] == 'GROUP_DOES_NOT_EXIST'
+
+
+class TestLargeDelete(object):
+    '''
+    Suite of tests for batched deletes of big groups.
+    '''
+
+    def test_deleteGroupInBatches(self, memory_zk, monkeypatch):
+        '''
+        Test that dry run counts znodes, a big group is deleted in parallel batches and a half done delete is finished.
+        '''
+
+        monkeypatch.setattr(cfg, 'txnMaxOps', 12)
+        zk = ansibleKeeper.zkSession.rw()
+        for i in range(20):
+            addHostWithHostvars(splitZnodeVarString('big:h{0:02d},a:1'.format(i)))
+
+        assert deleteZnodeRecur(splitZnodeString('big'), dryRun=True) == \
+            "DRY RUN  ==> delete group: big would remove znodes: 41 in multi requests: 5"
+        assert len(zk.get_children("{}/groups/big".format(cfg.aPath))) == 20
+
+        ## interrupted delete: first batch went through, the group is still there
+        assert commitBatches(zk, [[('delete', "{0}/groups/big/h0{1}".format(cfg.aPath, i), -1),
+                                   ('delete', membershipPath('h0{0}'.format(i), 'big'), -1)] for i in range(5)]) is None
+
+        assert deleteZnodeRecur(splitZnodeString('big'))[1] == "DELETED ==> group: big"
+        assert zk.exists("{}/groups/big".format(cfg.aPath)) is None
+        assert zk.get_children(membershipPath('h19')) == []
+
+
+    def test_deleteReportsRemovedBatches(self, memory_zk, monkeypatch):
+        '''
+        Test that a big delete whose group znode keeps failing reports the batches it already removed.
+        '''
+
+        monkeypatch.setattr(cfg, 'txnMaxOps', 12)
+        for i in range(20):
+            addHostWithHostvars(splitZnodeVarString('big:h{0:02d},a:1'.format(i)))
+
+        realCommitWrite = ansibleKeeper.commitWrite
+        monkeypatch.setattr(ansibleKeeper, 'commitWrite', lambda zk, ops, change=None: (ops[0], BadVersionError())
+                            if len(ops) > 0 else realCommitWrite(zk, ops, change))
+
+        assert deleteZnodeRecur(splitZnodeString('big')) == ('CONFLICT',
+            "ERROR  ==> big keeps changing during delete, removed znodes: 40 in multi requests: 4 !!! rerun to finish the delete")
+
+        monkeypatch.setattr(ansibleKeeper, 'commitWrite', realCommitWrite)
+        assert deleteZnodeRecur(splitZnodeString('big'))[1] == "DELETED ==> group: big"
+
+
+class TestBatch(object):
+    '''
+    Suite of tests for --batch mode.
+    '''
+
+    def test_runBatch(self, memory_zk):
+        '''
+        Test that results come one JSON line per operation in line order, reads between writes run concurrently.
+        '''
+
+        lines = ['# provisioning\n', '-A web:w1,ip:1\n', '["-A", "web:w2,motd:hello world"]\n', '\n',
+                 '-S hosts:w1\n', '--host w2\n', '-U web:w1,ip:2\n', '-S hosts:w1\n',
+                 '-A bogus\n', '-S "unterminated\n', '-D web --dry-run\n']
+        resultList = [json.loads(result) for result in runBatch(lines, parallel=2)]
+
+        assert [result['line'] for result in resultList] == [2, 3, 5, 6, 7, 8, 9, 10, 11]
+        assert resultList[1]['result'] == "ADDED  ==> host: w2 to group: web"
+        assert resultList[2]['result'] == {'w1': {'ip': '1'}}
+        assert resultList[3]['result'] == {'motd': 'hello world'}
+        assert resultList[5]['result'] == {'w1': {'ip': '2'}}
+        assert [result['ok'] for result in resultList[6:8]] == [False, False]
+        assert resultList[8]['result'].startswith("DRY RUN  ==> delete group: web")
+
+
+    def test_batchRenameOutput(self, memory_zk, capsys):
+        '''
+        Test that a batch with a host rename prints nothing but one JSON result per line.
+        '''
+
+        for result in runBatch(['-A web:w1,ip:1\n', '-R hosts:w1:w2\n', '-S hosts:w2\n']):
+            print result
+
+        resultList = [json.loads(line) for line in capsys.readouterr()[0].splitlines()]
+        assert [result['result'] for result in resultList] == [
+            "ADDED  ==> host: w1 to group: web", "RENAMED w1 --> w2", {'w2': {'ip': '1'}}]
+
+
+    def test_batchArgs(self):
+        '''
+        Test parsing of --batch lines.
+        '''
+
+        assert batchArgs("  # comment") is None
+        assert batchArgs("-U 'g:h,motd:a b'") == ['-U', 'g:h,motd:a b']
+        assert batchArgs('["-D", "g", "--dry-run"]') == ['-D', 'g', '--dry-run']
+
+        with pytest.raises(ValueError):
+            batchArgs("-S")
+
+
+class TestMembershipIndex(object):
+    '''
+    Suite of tests for host to groups reverse index.
+    '''
+
+    class Zk(object):
+        def __init__(self, tree):
+            self.tree, self.calls = tree, []
+
+        def get_children(self, path):
+            self.calls.append(path)
+            if path not in self.tree:
+                raise NoNodeError()
+            return self.tree[path]
+
+
+    def test_hostGroupsFromIndex(self):
+        '''
+        Test that hostGroups() reads only the host index entry and does not list any group.
+        '''
+
+        zk = self.Zk({membershipPath(tst.hostName): ['web', 'db']})
+
+        assert membershipPath(tst.hostName, 'web') == "{0}/memberships/{1}/web".format(cfg.aPath, tst.hostName)
+        assert hostGroups(zk, tst.hostName, indexed=True) == ['db', 'web']
+        assert hostGroups(zk, 'nohost', indexed=True) == []
+        assert zk.calls == [membershipPath(tst.hostName), membershipPath('nohost')]
+
+
+    def test_indexCreatedByFirstWrite(self, memory_zk):
+        '''
+        Test that membershipIndexed() only reads, the first host of an empty inventory creates the index
+        and a host without its index entry gets one when added to a new group.
+        '''
+
+        tree = memory_zk.tree
+        zk   = ansibleKeeper.zkSession.rw()
+
+        zxid = tree.zxid
+        assert membershipIndexed(zk) is True
+        assert (tree.zxid, zk.exists("{}/memberships".format(cfg.aPath))) == (zxid, None)
+
+        assert addHostWithHostvars(splitZnodeVarString('web:h1,a:1'))[0] == 'ADDED_HOST_TO_GROUP'
+        assert hostGroups(zk, 'h1', indexed=True) == ['web']
+
+        zk.delete(membershipPath('h1'), recursive=True)  ## as added by an older client
+        assert addHostToGroup(splitZnodeString('db:h1'))[0] == 'ADDED_HOST_TO_GROUP'
+        assert hostGroups(zk, 'h1', indexed=True) == ['db']
+
+
+    def test_addWithStaleIndex(self, memory_zk, capsys):
+        '''
+        Test that adds tripping over stale index entries succeed with a warning asking for --reindex and --reindex fixes the index.
+        '''
+
+        zk = ansibleKeeper.zkSession.rw()
+
+        addHostWithHostvars(splitZnodeVarString('web:h1,a:1'))
+        zk.create(membershipPath('h2'), b'')
+        zk.create(membershipPath('h1', 'db'), b'')
+
+        assert addHostWithHostvars(splitZnodeVarString('web:h2,a:1'))[0] == 'ADDED_HOST_TO_GROUP'
+        warning = capsys.readouterr()[1]
+        assert warning.startswith("WARNING  ==> stale membership index entry: {0}".format(membershipPath('h2')))
+        assert "--reindex" in warning
+
+        assert addHostToGroup(splitZnodeString('db:h1'))[0] == 'ADDED_HOST_TO_GROUP'
+        assert capsys.readouterr()[1].startswith("WARNING  ==> stale membership index entry: {0}".format(membershipPath('h1', 'db')))
+
+        assert sorted(ansibleInventoryDump()['web']['hosts']) == ['h1', 'h2']
+        assert ansibleInventoryDump()['db']['hosts'] == ['h1']
+
+        assert rebuildMembershipIndex().startswith("REINDEXED")
+        assert hostGroups(zk, 'h1') == ['db', 'web']
+        assert hostGroups(zk, 'h2') == ['web']
+
+
+class TestStreamingInventory(object):
+    '''
+    Suite of tests for streaming ansible inventory dump.
+    '''
+
+    class Stat(object):
+        def __init__(self, data, children):
+            self.dataLength, self.numChildren, self.version = len(data), len(children), 0
+
+    class Result(object):
+        def __init__(self, value):
+            self.value = value
+
+        def get(self):
+            if self.value is None:
+                raise NoNodeError()
+            return self.value
+
+    class TreeZk(object):
+        def __init__(self, tree):
+            self.tree = tree  ## {path: (data, [children])}
+
+        def get(self, path):
+            if path not in self.tree:
+                raise NoNodeError()
+            data, children = self.tree[path]
+            return data, TestStreamingInventory.Stat(data, children)
+
+        def get_async(self, path):
+            return TestStreamingInventory.Result(self.get(path) if path in self.tree else None)
+
+        def get_children_async(self, path, include_data=False):
+            if path not in self.tree:
+                return TestStreamingInventory.Result(None)
+            children = self.tree[path][1]
+            return TestStreamingInventory.Result((children, self.get(path)[1]) if include_data else children)
+
+        def get_children(self, path, include_data=False):
+            if path not in self.tree:
+                raise NoNodeError()
+            return self.get_children_async(path, include_data).get()
+
+
+    def test_chunksMatchInventoryDump(self, monkeypatch):
+        '''
+        Test that joined chunks are byte-identical to sorted json dump of ansibleInventoryDump().
+        '''
+
+        tree = {"{}/groups".format(cfg.aPath): ('', ['web', 'DB', 'gone']),
+                "{}/groups/web".format(cfg.aPath): ('', ['h2', 'h1']),
+                "{}/groups/DB".format(cfg.aPath): ('', ['h1']),
+                "{}/hosts".format(cfg.aPath): ('', ['h2', 'h1', 'h3']),
+                "{}/hosts/h1".format(cfg.aPath): ('', ['b', 'a']),
+                "{}/hosts/h1/a".format(cfg.aPath): ('1', []),
+                "{}/hosts/h1/b".format(cfg.aPath): ('2', []),
+                "{}/hosts/h2".format(cfg.aPath): (packHostVars({'c': '3'}), []),
+                "{}/hosts/h3".format(cfg.aPath): ('', [])}
+
+        monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession(self.TreeZk(tree)))
+
+        chunks = list(ansibleInventoryChunks(window=2))
+
+        assert ''.join(chunks) == json.dumps(ansibleInventoryDump(window=2), sort_keys=True)
+        assert ''.join(chunks) == '{"DB": {"hosts": ["h1"], "vars": {}}, "_meta": {"hostvars": {"h1": {"a": "1", "b": "2"}, ' \
+                                  '"h2": {"c": "3"}, "h3": {}}}, "web": {"hosts": ["h2", "h1"], "vars": {}}}'
+        assert len(chunks) > 5
+
+
+    def test_chunksWithGroupVars(self, monkeypatch):
+        '''
+        Test that group vars are emitted by chunks, ansibleInventoryDump() and the serial dump alike.
+        '''
+
+        tree = {"{}/groups".format(cfg.aPath): ('', ['web', 'all']),
+                "{}/groups/web".format(cfg.aPath): (packHostVars({'port': '80'}), ['h1']),
+                "{}/groups/all".format(cfg.aPath): (packHostVars({'ntp': 'pool.ntp.org'}), []),
+                "{}/hosts".format(cfg.aPath): ('', ['h1']),
+                "{}/hosts/h1".format(cfg.aPath): ('', [])}
+
+        monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession(self.TreeZk(tree)))
+
+        inventory = ansibleInventoryDump(window=1)
+
+        assert inventory['web']['vars'] == {'port': '80'}
+        assert inventory['all'] == {'hosts': [], 'vars': {'ntp': 'pool.ntp.org'}}
+        assert ''.join(ansibleInventoryChunks(window=1)) == json.dumps(inventory, sort_keys=True)
+
+
+    def test_chunksWithChildGroups(self, monkeypatch):
+        '''
+        Test that child groups are emitted as children by chunks and ansibleInventoryDump() alike.
+        '''
+
+        tree = {"{}/groups".format(cfg.aPath): ('', ['dc1', 'kafka', 'zk']),
+                "{}/groups/dc1".format(cfg.aPath): ('', []),
+                "{}/groups/kafka".format(cfg.aPath): ('', ['k1']),
+                "{}/groups/zk".format(cfg.aPath): ('', ['z1']),
+                "{}/children".format(cfg.aPath): ('', ['dc1']),
+                "{}/children/dc1".format(cfg.aPath): ('', ['zk', 'kafka']),
+                "{}/hosts".format(cfg.aPath): ('', ['k1', 'z1']),
+                "{}/hosts/k1".format(cfg.aPath): ('', []),
+                "{}/hosts/z1".format(cfg.aPath): ('', [])}
+
+        monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession(self.TreeZk(tree)))
+
+        inventory = ansibleInventoryDump(window=2)
+
+        assert inventory['dc1'] == {'hosts': [], 'vars': {}, 'children': ['kafka', 'zk']}
+        assert 'children' not in inventory['kafka']
+        assert ''.join(ansibleInventoryChunks(window=2)) == json.dumps(inventory, sort_keys=True)
+
+        limited = ansibleInventoryDump(window=2, limit='dc1:!k1')
+        assert limited == {'dc1': {'hosts': [], 'vars': {}, 'children': ['zk']}, 'zk': {'hosts': ['z1'], 'vars': {}},
+                           '_meta': {'hostvars': {'z1': {}}}}
+        assert ''.join(ansibleInventoryChunks(window=2, limit='dc1:!k1')) == json.dumps(limited, sort_keys=True)
+
+
+class TestChildGroups(object):
+    '''
+    Suite of tests for nested child groups.
+    '''
+
+    groupDict = {'dc1': [], 'dc1-kafka': [], 'dc1-kafka-brokers': ['b1', 'b2'], 'dc1-zk': ['z1', 'b1'], 'web': ['w1']}
+    childDict = {'dc1': ['dc1-kafka', 'dc1-zk'], 'dc1-kafka': ['dc1-kafka-brokers']}
+
+
+    def test_flattenGroups(self):
+        '''
+        Test that groups are expanded with hosts of all their descendants, a cycle does not loop forever.
+        '''
+
+        flatDict = flattenGroups(self.groupDict, self.childDict)
+
+        assert flatDict['dc1'] == ['b1', 'b2', 'z1']
+        assert flatDict['dc1-kafka'] == ['b1', 'b2']
+        assert flatDict['web'] == ['w1']
+        assert flattenGroups({'a': ['h1'], 'b': ['h2']}, {'a': ['b'], 'b': ['a']})['a'] == ['h1', 'h2']
+
+
+    def test_descendantGroups(self):
+        '''
+        Test that descendants are listed once, starting with the group itself.
+        '''
+
+        assert descendantGroups(self.childDict, 'dc1') == ['dc1', 'dc1-kafka', 'dc1-zk', 'dc1-kafka-brokers']
+        assert descendantGroups(self.childDict, 'web') == ['web']
+
+
+    def test_childEdgeOps(self):
+        '''
+        Test that edges of a group are moved on rename and parent znodes left without children are deleted.
+        '''
+
+        rootStat = TestStreamingInventory.Stat('', [])
+        createOps, deleteOps = childEdgeOps(self.childDict, rootStat, 'dc1-kafka', 'kafka')
+
+        assert createOps == [('create', childrenPath('dc1', 'kafka'), ''), ('create', childrenPath('kafka'), ''),
+                             ('create', childrenPath('kafka', 'dc1-kafka-brokers'), '')]
+        assert ('delete', childrenPath('dc1-kafka'), -1) in deleteOps
+        assert deleteOps[-1] == ('set_data', childrenPath(), '', 0)
+
+        createOps, deleteOps = childEdgeOps(self.childDict, rootStat, 'dc1-kafka-brokers')
+        assert createOps == []
+        assert deleteOps[:2] == [('delete', childrenPath('dc1-kafka', 'dc1-kafka-brokers'), -1),
+                                 ('delete', childrenPath('dc1-kafka'), -1)]
+        assert childEdgeOps(self.childDict, rootStat, 'web') == ([], [])
+
+
+class TestLimitPattern(object):
+    '''
+    Suite of tests for --limit host patterns.
+    '''
+
+    inventory = {'dc1': {'hosts': [], 'vars': {}, 'children': ['kafka', 'zk']},
+                 'kafka': {'hosts': ['kafka01', 'kafka02', 'kafka03'], 'vars': {'port': '9092'}},
+                 'zk': {'hosts': ['zk01'], 'vars': {}},
+                 'web': {'hosts': ['web01', 'kafka01'], 'vars': {}},
+                 'all': {'hosts': [], 'vars': {'ntp': 'pool.ntp.org'}},
+                 '_meta': {'hostvars': {'kafka01': {'a': '1'}, 'kafka02': {}, 'kafka03': {}, 'zk01': {}, 'web01': {}}}}
+
+
+    def test_splitLimitPattern(self):
+        '''
+        Test for splitLimitPattern() parser.
+        '''
+
+        assert splitLimitPattern("dc1:&web:!kafka03*") == [('', 'dc1'), ('&', 'web'), ('!', 'kafka03*')]
+        assert splitLimitPattern("~^web.*,zk01") == [('', '~^web.*'), ('', 'zk01')]
+        assert splitLimitPattern("~[web").startswith("SYNTAX ERROR")
+        assert splitLimitPattern("dc1:!").startswith("SYNTAX ERROR")
+
+
+    def test_limitAnsibleInventory(self):
+        '''
+        Test that unions, intersections, exclusions, globs and regexes select hosts like ansible does
+        and the result stays a valid inventory.
+        '''
+
+        hostVars = lambda pattern: sorted(limitAnsibleInventory(self.inventory, pattern)['_meta']['hostvars'])
+
+        assert hostVars('dc1') == ['kafka01', 'kafka02', 'kafka03', 'zk01']
+        assert hostVars('dc1:&web') == ['kafka01']
+        assert hostVars('dc1:!kafka0[23]') == ['kafka01', 'zk01']
+        assert hostVars('!dc1') == ['web01']
+        assert hostVars('~^kafka0[12]$,web01') == ['kafka01', 'kafka02', 'web01']
+        assert hostVars('all') == sorted(self.inventory['_meta']['hostvars'])
+
+        limited = limitAnsibleInventory(self.inventory, 'zk01')
+        assert limited['dc1'] == {'hosts': [], 'vars': {}, 'children': ['zk']}
+        assert limited['all'] == self.inventory['all']
+        assert sorted(limited) == ['_meta', 'all', 'dc1', 'zk']
+
+
+class TestBenchmarks(object):
+    '''
+    Suite of tests for benchmark inventory generator and in-memory backend.
+    '''
+
+    def test_generatedInventory(self, memory_zk):
+        '''
+        Test that generated inventory is read back by ansibleInventoryDump() with its shape.
+        '''
+
+        from benchmarks.generate import inventoryShape, generateInventory
+
+        zk    = memory_zk
+        shape = inventoryShape(hosts=20, groups=4, memberships=2, vars=3, valueSize=8, format='packed')
+
+        groupDict, varDict = generateInventory(zk, shape)
+        inventory = ansibleInventoryDump()
+
+        assert inventory['_meta']['hostvars'] == varDict
+        assert dict((group, sorted(inventory[group]['hosts'])) for group in groupDict) == \
+               dict((group, sorted(groupDict[group])) for group in groupDict)
+        assert sum(len(hostList) for hostList in groupDict.values()) == 40
+        assert hostGroups(zk, sorted(varDict)[0], indexed=True) == \
+               sorted(group for group in groupDict if sorted(varDict)[0] in groupDict[group])
+
+
+    def test_memoryTransactionRollback(self):
+        '''
+        Test that a failed multi request of the in-memory backend leaves the tree untouched.
+        '''
+
+        zk = MemoryZk(MemoryTree())
+        zk.ensure_path('/a/b')
+
+        assert commitOps(zk, [('create', '/a/c', ''), ('set_data', '/a/b', 'x'), ('create', '/a/b', '')])[0] == \
+               ('create', '/a/b', '')
+        assert sorted(zk.get_children('/a')) == ['b']
+        assert zk.get('/a/b')[0] == ''
+
+
+    def test_memoryBackend(self, monkeypatch):
+        '''
+        Test that cfg.zkBackend memory connects to one in-process tree with injected round trip latency.
+        '''
+
+        monkeypatch.setattr(ansibleKeeper, 'KazooClient', None)
+        monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession())
+        monkeypatch.setattr(cfg, 'zkBackend', 'memory')
+        monkeypatch.setattr(cfg, 'memoryLatency', 0.01)
+
+        addHostWithHostvars(tst.oneDict)
+        ansibleKeeper.zkSession.close()
+
+        startTime = time.time()
+        assert showHostVars(splitZnodeString(tst.hostHostStr)) == {tst.hostName: tst.varDict}
+        assert time.time() - startTime >= 0.02  ## connect and at least one read
+
+        with pytest.raises(BadVersionError):
+            ansibleKeeper.zkSession.rw().set(tst.hostPath, 'x', version=5)
+
+        client = ansibleKeeper.zkSession.rw()
+        ansibleKeeper.zkSession.close()
+        with pytest.raises(ConnectionClosedError):
+            client.get(tst.hostPath)
+
+
+class TestZkStats(object):
+    '''
+    Suite of tests for zookeeper request accounting used by --stats.
+    '''
+
+    class Client(object):
+        def get(self, path):
+            return 'data', None
+
+        def transaction(self):
+            return TestAtomicWrites.Transaction([True])
+
+        def stop(self):
+            pass
+
+
+    def test_latencyHistogram(self):
+        '''
+        Test that latencies land in the right buckets and percentiles are bucket upper bounds.
+        '''
+
+        stats = ZkStats()
+        for seconds in [0.0001] * 98 + [0.003, 2.0]:
+            stats.record('get', seconds)
+
+        latency = stats.summary()['latency']['get']
+
+        assert latency['count'] == 100
+        assert latency['p50'] == 0.0005
+        assert latency['p99'] == 0.005
+        assert latency['buckets'][-1] == (None, 1)
+        assert latency['max'] == 2.0
+
+
+    def test_statsClient(self):
+        '''
+        Test that StatsClient counts sync requests and multi commits and passes everything else through.
+        '''
+
+        stats  = ZkStats()
+        client = StatsClient(self.Client(), stats)
+
+        assert client.get('/x') == ('data', None)
+        tx = client.transaction()
+        tx.create('/y', '')
+        tx.commit()
+        client.stop()
+
+        with stats.phase('json encode'):
+            pass
+
+        summary = stats.summary()
+
+        assert summary['requests'] == {'get': 1, 'multi': 1}
+        assert summary['requestsTotal'] == 2
+        assert summary['phases'].keys() == ['json encode']
+
+
+class TestSnapshot(object):
+    '''
+    Suite of tests for inventory snapshot files.
+    '''
+
+    inventory = {'web': {'hosts': ['h2', 'h1'], 'vars': {'port': '80'}},
+                 'empty': {'hosts': [], 'vars': {}},
+                 '_meta': {'hostvars': {'h1': {'a': '1'}, 'h2': {}, 'lonely': {'b': '2'}}}}
+
+
+    def test_snapshotRoundTrip(self, tmpdir):
+        '''
+        Test that a written snapshot answers -I, -S and --host like the inventory it was written from.
+        '''
+
+        snapshotPath = str(tmpdir.join('inventory.snap'))
+        writeSnapshot(snapshotPath, self.inventory, {'aPath': cfg.aPath})
+
+        snapshot = openSnapshot(snapshotPath)
+
+        assert isSnapshot(snapshotPath)
+        assert snapshot.index['aPath'] == cfg.aPath
+        assert snapshot.ansibleInventory() == self.inventory
+        assert snapshot.inventory('all') == {'hosts': ['h1', 'h2', 'lonely'], 'groups': [{'empty': []}, {'web': ['h1', 'h2']}]}
+        assert snapshot.showHostVars(splitZnodeString('web')) == {'h1': {'a': '1'}, 'h2': {}}
+        assert snapshot.ansibleHost('lonely') == {'b': '2'}
+        assert snapshot.ansibleHost('nohost') == "ERROR  ==> no such host: nohost !!!"
+        assert json.loads(snapshot.answer('--host h1')) == {'a': '1'}
+        assert json.loads(snapshot.answer('--show-group-vars web')) == {'port': '80'}
+        assert snapshot.showGroupVars('empty') == {}
+        assert os.listdir(str(tmpdir)) == ['inventory.snap']
+
+
+    def test_snapshotImport(self, memory_zk, tmpdir):
+        '''
+        Test that a snapshot exported from one ansible-keeper path and imported into another restores it as it was.
+        '''
+
+        snapshotPath = str(tmpdir.join('inventory.snap'))
+
+        with inventoryRoot('/ansible-a'):
+            addHostWithHostvars({'web': {'w1': {'ip': '1'}}})
+            addHostWithHostvars({'db': {'d1': {'ip': '2'}}})
+            updateGroupVars(('web', "{}/groups/web".format(cfg.aPath), {'port': '80'}))
+            addChildGroup(('prod', 'web'))
+            assert exportSnapshot(snapshotPath).startswith("EXPORTED")
+
+        with inventoryRoot('/ansible-b'):
+            addHostWithHostvars({'web': {'w1': {'ip': '1'}}})
+            updateGroupVars(('web', "{}/groups/web".format(cfg.aPath), {'proxy': 'p.dmz'}))
+            importMsg = importSnapshot(snapshotPath)
+            assert "group vars: 1 child groups: 1" in importMsg
+            assert showGroupVars('web') == {'port': '80', 'proxy': 'p.dmz'}  ## merged like --group-vars
+
+        with inventoryRoot('/ansible-c'):
+            importSnapshot(snapshotPath)
+
+        assert diffInventories('/ansible-a', '/ansible-c')['equal'] is True
+        assert diffInventories(snapshotPath, '/ansible-c')['equal'] is True
+
+
+    def test_invalidSnapshot(self, tmpdir):
+        '''
+        Test that a file which is not a snapshot or a truncated one gives an ERROR string.
+        '''
+
+        notSnapshot = tmpdir.join('hosts.ini')
+        notSnapshot.write('[web]\nh1\n')
+        snapshotPath = str(tmpdir.join('inventory.snap'))
+        writeSnapshot(snapshotPath, self.inventory)
+        with open(snapshotPath, 'r+b') as snapshotFile:
+            snapshotFile.truncate(os.path.getsize(snapshotPath) - 10)
+
+        assert not isSnapshot(str(notSnapshot))
+        assert openSnapshot(str(notSnapshot)).startswith("ERROR  ==>")
+        assert openSnapshot(snapshotPath).startswith("ERROR  ==>")
+
+
+class TestAnsibleKeeper(object):
+    '''
+    Suite of tests for the AnsibleKeeper library client.
+    '''
+
+    def test_concurrentAdds(self, monkeypatch):
+        '''
+        Test that hosts submitted concurrently over one session are all added and failures come as exceptions.
+        '''
+
+        monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession())
+        keeper = AnsibleKeeper(client=MemoryZk(MemoryTree()), parallel=8)
+
+        futureList = [keeper.submit(keeper.addHost, 'web', "w{0}".format(i), {'ip': str(i)}) for i in range(50)]
+        resultList = keeper.gather(futureList)
+        resultList += keeper.gather([keeper.submit(keeper.addHost, 'web', 'w7', {})])
+
+        assert [result.code for result in resultList[:50]] == ['ADDED_HOST_TO_GROUP'] * 50
+        assert isinstance(resultList[50], ZnodeExistsError)
+        assert resultList[50].message.startswith("ERROR  ==> host: w7")
+        assert keeper.hostVars('w42').data == {'ip': '42'}
+        assert len(keeper.inventory().data['web']['hosts']) == 50
+
+        with pytest.raises(NoSuchZnodeError):
+            keeper.updateHost('nohost', {'ip': '1'})
+
+        with pytest.raises(KeeperSyntaxError):
+            keeper.run(['-R', 'hosts:w1'])
+
+        keeper.close()
+
+
+    def test_secondClient(self, monkeypatch):
+        '''
+        Test that a second client shares the config of the open one, asking for another config raises until it is closed
+        and the last close puts back the module session and path.
+        '''
+
+        monkeypatch.setattr(ansibleKeeper, 'zkSession', ZkSession())
+        monkeypatch.setattr(cfg, 'aPath', cfg.aPath)
+        session, aPath = ansibleKeeper.zkSession, cfg.aPath
+        tree   = MemoryTree()
+        keeper = AnsibleKeeper(client=MemoryZk(tree))
+        other  = AnsibleKeeper(path=cfg.aPath)
+
+        with pytest.raises(KeeperError) as error:
+            AnsibleKeeper(path='/other', client=MemoryZk(MemoryTree()))
+        assert error.value.code == 'CONFIG_CONFLICT'
+        assert "path, client" in error.value.message
+
+        assert other.addHost('web', 'w1').code == 'ADDED_HOST_TO_GROUP'
+        other.close()
+        assert keeper.hostVars('w1').data == {}
+        keeper.close()
+
+        assert (ansibleKeeper.zkSession, cfg.aPath) == (session, aPath)  ## put back by the last close
+
+        keeper = AnsibleKeeper(path='/other', client=MemoryZk(tree))
+        assert cfg.aPath == '/other'
+        keeper.addHost('db', 'd1')
+        assert 'web' not in keeper.inventory().data
+        keeper.close()
+        keeper.close()  ## closing twice restores once
+        assert (ansibleKeeper.zkSession, cfg.aPath) == (session, aPath)
+
+
+    def test_keeperResult(self):
+        '''
+        Test that operation results become result codes and exception classes.
+        '''
+
+        assert keeperResult("UPDATED  ==> host: h with new hostvars {}").code == 'UPDATED'
+        assert keeperResult(['UPDATED  ==> host: h', 'UPDATED  ==> hosts of group: g: 1']).data == ['UPDATED  ==> host: h']
+        assert keeperResult({'h': {}}).data == {'h': {}}
+
+        with pytest.raises(ConflictError):
+            keeperResult(('CONFLICT', "ERROR  ==> host: h keeps changing during update, nothing updated !!!"))
+
+        with pytest.raises(KeeperSyntaxError):
+            keeperResult(('SYNTAX_ERROR', "SYNTAX ERROR --> g <-- no valid number of groupnames [parentgroup:childgroup]"))
+
+        with pytest.raises(KeeperError) as error:
+            keeperResult(['ERROR  ==> host: h1', ('HOSTS_FAILED', "ERROR  ==> hosts of group: g: 1 !!!")])
+        assert (error.value.code, error.value.data) == ('HOSTS_FAILED', ['ERROR  ==> host: h1'])
+
+        ## the message type picks the exception, not the wording
+        with pytest.raises(NoSuchZnodeError):
+            keeperResult(('HOST_DOES_NOT_EXIST', "host: h is gone"))
+
+
+class TestLargeValues(object):
+    '''
+    Suite of tests for compressed and chunked hostvar values.
+    '''
+
+    @pytest.mark.parametrize('storage', ['legacy', 'packed'])
+    def test_largeValues(self, memory_zk, monkeypatch, storage):
+        '''
+        Test that large values are stored compressed or chunked and every reader decodes them.
+        '''
+
+        zk = memory_zk
+        monkeypatch.setattr(cfg, 'compressBytes', 256)
+        monkeypatch.setattr(cfg, 'chunkBytes', 1024)
+
+        if storage == 'packed':
+            zk.create("{}/format".format(cfg.aPath), FORMAT_VERSIONS['packed'], makepath=True)
+
+        cert  = '-----BEGIN CERTIFICATE-----' + 'MIIB' * 200
+        rules = ''.join(hashlib.sha512(str(i)).digest() for i in range(80)).encode('base64')  ## compresses poorly, chunked
+        addHostWithHostvars({'web': {'w1': {'ip': '1', 'cert': cert, 'rules': rules}}})
+
+        hostPath = "{}/hosts/w1".format(cfg.aPath)
+        stored   = zk.get(hostPath)[0] if storage == 'packed' else zk.get(hostPath + '/cert')[0]
+        assert stored.startswith(ZLIB_HEADER)
+        assert len(zk.get_children("{}/chunks".format(cfg.aPath))) == 1
+
+        assert ansibleHostAccess('w1') == {'ip': '1', 'cert': cert, 'rules': rules}
+        assert ansibleInventoryDump()['_meta']['hostvars']['w1']['rules'] == rules
+        assert ''.join(ansibleInventoryChunks()) == json.dumps(ansibleInventoryDump(), sort_keys=True)
+
+        updateZnode({'web': {'w1': {'rules': rules[::-1]}}})
+        stats = valueStats()
+        assert (stats['chunkedValues'], stats['chunkSets'], stats['orphanChunkSets']) == (1, 2, 1)
+        assert stats['ratio'] > 1
+
+        monkeypatch.setattr(cfg, 'chunkGcAge', -1)
+        assert valueStats(collect=True)['collectedChunkSets'] == 1
+        assert showHostVars(splitZnodeString('hosts:w1')) == {'w1': {'ip': '1', 'cert': cert, 'rules': rules[::-1]}}
+
+
+    def test_chunksOfFailedWrite(self, memory_zk, monkeypatch):
+        '''
+        Test that a failed write leaves no chunk set behind unless the set was too big for its multi request.
+        '''
+
+        zk = memory_zk
+        monkeypatch.setattr(cfg, 'compressBytes', 256)
+        monkeypatch.setattr(cfg, 'chunkBytes', 1024)
+
+        rules = ''.join(hashlib.sha512(str(i)).digest() for i in range(80)).encode('base64')
+        addHostWithHostvars({'web': {'w1': {'ip': '1'}}})
+        chunksPath = "{}/chunks".format(cfg.aPath)
+
+        assert addHostWithHostvars({'web': {'w1': {'rules': rules}}})[0] == 'HOST_EXISTS'
+        assert zk.exists(chunksPath) is None or zk.get_children(chunksPath) == []
+
+        assert addHostWithHostvars({'web': {'w2': {'rules': rules}}})[0] == 'ADDED_HOST_TO_GROUP'
+        assert len(zk.get_children(chunksPath)) == 1
+        assert ansibleHostAccess('w2') == {'rules': rules}
+
+        monkeypatch.setattr(cfg, 'txnMaxBytes', 4096)
+        assert addHostWithHostvars({'web': {'w1': {'rules': rules[::-1]}}})[0] == 'HOST_EXISTS'
+        assert len(zk.get_children(chunksPath)) == 2
+
+
+    def test_damagedChunks(self, monkeypatch):
+        '''
+        Test that a chunked value with a missing chunk is reported instead of returned cut short.
+        '''
+
+        zk = MemoryZk(MemoryTree())
+        monkeypatch.setattr(cfg, 'chunkBytes', 4)
+
+        manifest = writeChunks(zk, 'abcdefghij', 10)
+        assert resolveValues(zk, [{'v': manifest}])[0] == {'v': 'abcdefghij'}
+
+        zk.delete(chunkPath(json.loads(manifest[len(CHUNKED_HEADER):])['id'], 1))
+        assert resolveValues(zk, [{'v': manifest}])[0]['v'].startswith("ERROR  ==> chunked value:")
+
+
+class TestContentHashes(object):
+    '''
+    Suite of tests for content hashes of hosts and groups and inventory diffs.
+    '''
+
+    def test_digestIndex(self, memory_zk, tmpdir):
+        '''
+        Test that writes keep host digest entries in step with the hostvars and hashes equal those of a dump.
+        '''
+
+        def entries():
+            zk = ansibleKeeper.zkSession.ro()
+            return dict((host, unpackDigests(zk.get(digestPath(host))[0])) for host in zk.get_children(digestPath()))
+
+        def checked():
+            dump    = ansibleInventoryDump()
+            hashes  = inventoryHashes()
+            digests = inventoryDigests(dump)
+            assert entries() == dict((host, varDigests(varDict)) for host, varDict in dump['_meta']['hostvars'].items())
+            assert (hashes['root'], hashes['hosts'], hashes['groups']) == (digests['root'], digests['hosts'], digests['groups'])
+            return hashes
+
+        addHostWithHostvars({'web': {'w1': {'ip': '1'}}, 'db': {'d1': {'ip': '3'}}})
+        addHostWithHostvars({'web': {'w2': {'ip': '2'}}})
+        addChildGroup(('all', 'web'))
+        first = checked()
+
+        updateZnode({'web': {'w1': {'ip': '9'}}})
+        updateGroupHosts(splitGroupVarString('web,ntp:b'))
+        renameZnode(splitRenameZnodeString('hosts:w2:w3'))
+        deleteZnodeRecur(splitZnodeString('hosts:d1'))
+        assert checked()['root'] != first['root']
+
+        inventoryPath = tmpdir.join('hosts.ini')
+        inventoryPath.write('[web]\nw1 ip=7\nw4 ip=4\n')
+        importInventory(str(inventoryPath))
+        checked()
+
+
+    def test_readOnlyHashes(self, memory_zk, monkeypatch):
+        '''
+        Test that hashes, validate and diff never write, digest hosts without an entry in memory and
+        that --reindex brings the digest index back.
+        '''
+
+        tree = memory_zk.tree
+
+        addHostWithHostvars({'web': {'w1': {'ip': '1'}}})
+        addHostWithHostvars({'web': {'w2': {'ip': '2'}}})
+        zk = ansibleKeeper.zkSession.rw()
+        zk.delete(digestPath('w1'))                  ## written by an older ansible-keeper
+        zk.set(digestPath('w2'), b'not json')       ## damaged
+        cached = ansibleInventoryDump()
+
+        def noWrites():
+            raise AssertionError('read only path asked for a read-write session')
+
+        monkeypatch.setattr(ansibleKeeper.zkSession, 'rw', noWrites)
+        zxid = tree.zxid
+
+        assert inventoryHashes()['root'] == inventoryDigests(cached)['root']
+        assert validateInventory(cached)['valid'] is True
+        assert diffInventories('live', 'live')['equal'] is True
+        assert AnsibleKeeper.hashes.__defaults__ == (False,)
+        assert tree.zxid == zxid
+
+        monkeypatch.delattr(ansibleKeeper.zkSession, 'rw')
+
+        assert rebuildDigestIndex() == "REINDEXED  ==> host digests: 2 (added: 1, fixed: 1, removed: 0)"
+        assert unpackDigests(ansibleKeeper.zkSession.ro().get(digestPath('w2'))[0]) == varDigests({'ip': '2'})
+        assert rebuildDigestIndex() == "REINDEXED  ==> host digests: 2 (added: 0, fixed: 0, removed: 0)"
+
+
+    def test_diffInventories(self, memory_zk, tmpdir):
+        '''
+        Test that diffs of two ansible-keeper paths and of a snapshot against zookeeper name what differs.
+        '''
+
+        with inventoryRoot('/ansible-a'):
+            addHostWithHostvars({'web': {'w1': {'ip': '1', 'os': 'x'}}})
+            addHostWithHostvars({'web': {'w2': {'ip': '2'}}})
+            snapshotPath = str(tmpdir.join('a.snap'))
+            writeSnapshot(snapshotPath, ansibleInventoryDump())
+
+        with inventoryRoot('/ansible-b'):
+            addHostWithHostvars({'web': {'w1': {'ip': '9', 'dc': '1'}}})
+            addHostWithHostvars({'web': {'w3': {'ip': '3'}}})
+
+        diff = diffInventories('/ansible-a', '/ansible-b')
+        assert diff['equal'] is False
+        assert diff['hosts'] == {'added': ['w3'], 'removed': ['w2'],
+                                 'changed': {'w1': {'added': {'dc': '1'}, 'removed': ['os'], 'changed': {'ip': ['1', '9']}}}}
+        assert diff['groups']['changed'] == {'web': {'hosts': {'added': ['w3'], 'removed': ['w2']}}}
+
+        assert diffInventories(snapshotPath, '/ansible-a')['equal'] is True
+        assert diffInventories('/ansible-a', '/nowhere')[0] == 'NO_INVENTORY'
+
+
+    def test_validateInventory(self, memory_zk):
+        '''
+        Test that a stale cached inventory is found invalid with its stale hosts and groups named.
+        '''
+
+        addHostWithHostvars({'web': {'w1': {'ip': '1'}}})
+        addHostWithHostvars({'web': {'w2': {'ip': '2'}}})
+        cached = ansibleInventoryDump()
+        assert validateInventory(cached)['valid'] is True
+
+        updateZnode({'web': {'w2': {'ip': '9'}}})
+        addHostWithHostvars({'db': {'d1': {}}})
+
+        validation = validateInventory(cached)
+        assert (validation['valid'], validation['hosts'], validation['groups']) == (False, ['d1', 'w2'], ['db'])